@@ -12,8 +12,15 @@ from girder_jobs.models.job import Job
 
 from dive_utils import constants
 
-from .crud_annotation import GroupItem, RevisionLogItem, TrackItem
-from .event import send_new_user_email
+from .crud_annotation import (
+    GroupItem,
+    LabelSummaryItem,
+    RevisionHeadItem,
+    RevisionLogItem,
+    TrackChunkItem,
+    TrackItem,
+)
+from .event import cleanup_dataset_annotations, send_new_user_email
 from .views_annotation import AnnotationResource
 from .views_configuration import ConfigurationResource
 from .views_dataset import DatasetResource
@@ -31,8 +38,11 @@ logger = logging.getLogger(__name__)
 class GirderPlugin(plugin.GirderPlugin):
     def load(self, info):
         ModelImporter.registerModel('trackItem', TrackItem, plugin='dive_server')
+        ModelImporter.registerModel('trackChunkItem', TrackChunkItem, plugin='dive_server')
         ModelImporter.registerModel('groupItem', GroupItem, plugin='dive_server')
         ModelImporter.registerModel('revisionLogItem', RevisionLogItem, plugin='dive_server')
+        ModelImporter.registerModel('revisionHeadItem', RevisionHeadItem, plugin='dive_server')
+        ModelImporter.registerModel('labelSummaryItem', LabelSummaryItem, plugin='dive_server')
 
         info["apiRoot"].dive_annotation = AnnotationResource("dive_annotation")
         info["apiRoot"].dive_configuration = ConfigurationResource("dive_configuration")
@@ -74,3 +84,8 @@ class GirderPlugin(plugin.GirderPlugin):
             'send_new_user_email',
             send_new_user_email,
         )
+        events.bind(
+            'model.folder.remove',
+            'cleanup_dataset_annotations',
+            cleanup_dataset_annotations,
+        )
@@ -1,15 +1,29 @@
-from typing import Callable, Generator, Iterable, List, Optional, Tuple
+import base64
+from datetime import datetime, timedelta
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional, Tuple
 
+import bson
+from bson.objectid import ObjectId
 from girder.constants import AccessType
+from girder.exceptions import RestException
 from girder.models.folder import Folder
+from girder.models.user import User
+from girder_jobs.models.job import Job, JobStatus
 from pydantic import Field
 from pydantic.main import BaseModel
 import pymongo
+from pymongo.collection import Collection
 from pymongo.cursor import Cursor
 
 from dive_server import crud, crud_dataset
-from dive_utils import constants, fromMeta, models, types
-from dive_utils.serializers import viame
+from dive_utils import TRUTHY_META_VALUES, constants, fromMeta, models, packing, transforms, types
+from dive_utils.serializers import dive, viame
 
 DATASET = 'dataset'
 SET = 'set'
@@ -17,12 +31,155 @@ REVISION_DELETED = 'rev_deleted'
 REVISION_CREATED = 'rev_created'
 REVISION = 'revision'
 IDENTIFIER = 'id'
+BEGIN = 'begin'
+END = 'end'
+HEAD = 'head'
+ALLOCATED = 'allocated'
+MAIN_HEAD = 'main_head'
+SNAPSHOT = 'snapshot'
+SNAPSHOTS = 'snapshots'
+COMPACTED = 'compacted'
+CHUNK = 'chunk'
+CHUNKED = 'chunked'
+HASH = 'hash'
+MASK = 'mask'
+BASE_DATASET = 'base_dataset'
+BASE_REVISION = 'base_revision'
+LABELS_COUNTED = 'labels_counted'
+WRITER = 'writer'
+LEASE_EXPIRES = 'lease_expires'
+LABEL = 'label'
+LABEL_COUNT = 'count'
+CONFIDENCE_PAIRS = 'confidencePairs'
+DETECTIONS = 'detections'
+STATS = 'stats'
+
+# Fields added by storage, which are not part of a record's annotation content
+STORAGE_FIELDS = {
+    '_id',
+    DATASET,
+    SET,
+    REVISION_CREATED,
+    REVISION_DELETED,
+    SNAPSHOT,
+    CHUNKED,
+    HASH,
+    MASK,
+    DETECTIONS,
+    packing.PACKED,
+}
+
+# Number of snapshots kept per dataset.  Older snapshots are dropped as new ones are taken.
+SNAPSHOT_RETENTION = 3
 
 DEFAULT_ANNOTATION_SORT = [[IDENTIFIER, 1]]
 DEFAULT_REVISION_SORT = [[REVISION, pymongo.DESCENDING]]
 
+# Ways of computing Girder-Total-Count for paged listings
+COUNT_EXACT = 'exact'
+COUNT_ESTIMATED = 'estimated'
+COUNT_NONE = 'none'
+COUNT_MODES = [COUNT_EXACT, COUNT_ESTIMATED, COUNT_NONE]
+
+
+def encode_continuation(key: Any) -> str:
+    """Opaque token for the page that starts after the record with this sort key"""
+    return base64.urlsafe_b64encode(json.dumps({'after': key}).encode()).decode()
+
+
+def decode_continuation(token: str) -> Any:
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode()))['after']
+    except (ValueError, TypeError, KeyError):
+        raise RestException('Invalid continuation token')
+
+
+def keyset_filter(sort: list, key: str, after: Any) -> dict:
+    """
+    Filter selecting the records after `after` in `sort` order.
+
+    Keyset pagination only works when the listing is sorted on the unique key, which
+    lets each page seek on the index instead of skipping over every earlier record.
+    """
+    if not sort or sort[0][0] != key:
+        raise RestException(f'Continuation tokens require sorting by {key}')
+    return {key: {'$lt' if sort[0][1] == pymongo.DESCENDING else '$gt': after}}
+
+
+def merge_filters(query: Optional[dict], filters: Optional[dict]) -> dict:
+    """Combine two queries, merging the operators of fields that appear in both"""
+    merged = dict(query or {})
+    for key, condition in (filters or {}).items():
+        if isinstance(merged.get(key), dict) and isinstance(condition, dict):
+            merged[key] = {**merged[key], **condition}
+        elif key == '$and' and key in merged:
+            merged[key] = merged[key] + condition
+        else:
+            merged[key] = condition
+    return merged
+
+
+def paginate(cursor: Iterable[dict], limit: int, key: str) -> Tuple[List[dict], Optional[str]]:
+    """Read one page, and a continuation token if another page may follow it"""
+    results = list(cursor)
+    token = None
+    if limit and len(results) == limit:
+        token = encode_continuation(results[-1][key])
+    return results, token
+
 
 class BaseItem(crud.PydanticModel):
+    # Whether records of a clone's base dataset show through in list() and count()
+    LAYERED = True
+    # Base records looked up among a clone's own records at a time
+    REPLACED_READ_BATCH = 1000
+
+    def live_query(
+        self,
+        dsFolder: types.GirderModel,
+        revision: Optional[int] = None,
+        set: Optional[str] = None,
+    ) -> dict:
+        """Query selecting the records of dsFolder visible at revision (default head)"""
+        heads = RevisionHeadItem()
+        state = heads.get(dsFolder)
+        if revision is not None:
+            head = revision
+        elif set:
+            head = heads.head(dsFolder, set)
+        else:
+            head = state[HEAD]
+        if head < state.get(COMPACTED, 0):
+            raise RestException(f'Revision {head} was removed by annotation history compaction')
+        live = [{REVISION_DELETED: {'$gt': head}}, {REVISION_DELETED: {'$exists': False}}]
+        snapshot = nearest_snapshot(state.get(SNAPSHOTS) or [], head)
+        if snapshot is None:
+            query: dict = {
+                DATASET: dsFolder['_id'],
+                REVISION_CREATED: {'$lte': head},
+                '$or': live,
+            }
+        else:
+            # Everything live at head was either live at the snapshot or created after it,
+            # so tombstones older than the snapshot are never scanned.
+            query = {
+                DATASET: dsFolder['_id'],
+                '$and': [
+                    {
+                        '$or': [
+                            {SNAPSHOT: snapshot},
+                            {REVISION_CREATED: {'$gt': snapshot, '$lte': head}},
+                        ]
+                    },
+                    {'$or': live},
+                ],
+            }
+        if set:
+            query[SET] = set
+        else:
+            query[SET] = None
+        return query
+
     def list(
         self,
         dsFolder: types.GirderModel,
@@ -30,21 +187,236 @@ class BaseItem(crud.PydanticModel):
         offset=0,
         sort=DEFAULT_ANNOTATION_SORT,
         revision: Optional[int] = None,
-        set: Optional[int] = None,
-    ) -> Cursor:
-        head: int = RevisionLogItem().latest(dsFolder, set) if revision is None else revision
+        set: Optional[str] = None,
+        filters: Optional[dict] = None,
+        fields: Optional[dict] = None,
+        after: Optional[Any] = None,
+        feature_filters: Optional[dict] = None,
+    ) -> Iterable[dict]:
+        """
+        List the records visible at revision.
+
+        feature_filters lets storage skip features the caller will discard: TrackItem
+        only reads the chunks of chunked tracks that match them.
+        """
+        base = self.base_layer(dsFolder, revision, set)
+        if base is not None:
+            return self._list_layered(
+                dsFolder,
+                base,
+                limit,
+                offset,
+                sort,
+                revision,
+                filters,
+                fields,
+                after,
+                feature_filters,
+            )
+        return self._list_own(
+            dsFolder, limit, offset, sort, revision, set, filters, fields, after, feature_filters
+        )
+
+    def _list_own(
+        self,
+        dsFolder: types.GirderModel,
+        limit: int,
+        offset: int,
+        sort: list,
+        revision: Optional[int],
+        set: Optional[str],
+        filters: Optional[dict],
+        fields: Optional[dict],
+        after: Optional[Any],
+        feature_filters: Optional[dict],
+    ) -> Iterable[dict]:
+        """List the records stored in dsFolder itself, ignoring any base layer"""
+        query = merge_filters(self.live_query(dsFolder, revision, set), filters)
+        if after is not None:
+            query = merge_filters(query, keyset_filter(sort, IDENTIFIER, after))
+        return self.decode(
+            self.find(
+                offset=offset,
+                limit=limit,
+                sort=sort,
+                query=query,
+                fields=self.PROJECT_FIELDS if fields is None else fields,
+            ),
+            dsFolder,
+            revision,
+            set,
+            feature_filters,
+        )
+
+    def base_layer(
+        self, dsFolder: types.GirderModel, revision: Optional[int], set: Optional[str]
+    ) -> Optional[Tuple[types.GirderModel, int, Callable[[Iterable[dict]], Iterable[dict]]]]:
+        """
+        The base dataset and revision of a clone, and a function dropping the base records
+        its own records replace at revision.  None when dsFolder is not a clone.
+
+        Base records are looked up among the clone's records a batch at a time, so the
+        work is bounded by the base records read, however many the clone replaced.
+        """
+        if not self.LAYERED or set:
+            return None
+        state = RevisionHeadItem().get(dsFolder)
+        if state.get(BASE_DATASET) is None:
+            return None
+        revision = state[HEAD] if revision is None else revision
+
+        def unreplaced(records: Iterable[dict]) -> Generator[dict, None, None]:
+            records = iter(records)
+            while True:
+                batch = list(itertools.islice(records, self.REPLACED_READ_BATCH))
+                if not batch:
+                    return
+                replaced = self._replaced(dsFolder, revision, [r[IDENTIFIER] for r in batch])
+                yield from (record for record in batch if record[IDENTIFIER] not in replaced)
+
+        return {'_id': state[BASE_DATASET]}, state[BASE_REVISION], unreplaced
+
+    def _replaced(self, dsFolder: types.GirderModel, revision: int, ids: List[int]) -> frozenset:
+        """The ids a clone replaced by revision: any version or deletion mask it created"""
         query = {
             DATASET: dsFolder['_id'],
-            REVISION_CREATED: {'$lte': head},
-            '$or': [{REVISION_DELETED: {'$gt': head}}, {REVISION_DELETED: {'$exists': False}}],
+            IDENTIFIER: {'$in': ids},
+            SET: None,
+            REVISION_CREATED: {'$lte': revision},
         }
-        if set:
-            query[SET] = set
-        else:
-            query[SET] = None
-        return self.find(
-            offset=offset, limit=limit, sort=sort, query=query, fields=self.PROJECT_FIELDS
+        return frozenset(
+            record[IDENTIFIER] for record in self.collection.find(query, {'_id': 0, IDENTIFIER: 1})
+        )
+
+    def _replaced_batches(
+        self, dsFolder: types.GirderModel, revision: Optional[int]
+    ) -> Generator[List[int], None, None]:
+        """Every id a clone replaced by revision, in batches read in order from the id index"""
+        if revision is None:
+            revision = RevisionHeadItem().head(dsFolder)
+        query = {DATASET: dsFolder['_id'], SET: None, REVISION_CREATED: {'$lte': revision}}
+        cursor = self.collection.find(
+            query, {'_id': 0, IDENTIFIER: 1}, sort=[(DATASET, 1), (IDENTIFIER, 1)]
+        )
+        batch: List[int] = []
+        last = None
+        for record in cursor:
+            # Versions of one id are adjacent
+            if record[IDENTIFIER] == last:
+                continue
+            last = record[IDENTIFIER]
+            batch.append(last)
+            if len(batch) == self.REPLACED_READ_BATCH:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _list_layered(
+        self,
+        dsFolder: types.GirderModel,
+        base: Tuple[types.GirderModel, int, dict],
+        limit: int,
+        offset: int,
+        sort: list,
+        revision: Optional[int],
+        filters: Optional[dict],
+        fields: Optional[dict],
+        after: Optional[Any],
+        feature_filters: Optional[dict],
+    ) -> Iterable[dict]:
+        """Merge the clone's own records with the base records they do not replace"""
+        directions = {direction for _key, direction in sort}
+        if len(directions) > 1:
+            raise RestException('Cloned datasets can only be sorted in one direction')
+        keys = [key for key, _direction in sort]
+        base_folder, base_revision, unreplaced = base
+        window = dict(sort=sort, fields=fields, after=after, feature_filters=feature_filters)
+        layers = [
+            self._list_own(
+                dsFolder,
+                limit=offset + limit if limit else 0,
+                offset=0,
+                revision=revision,
+                set=None,
+                filters=filters,
+                **window,
+            ),
+            # Unlimited, since replaced records are dropped as the merge reads on
+            unreplaced(self.list(base_folder, revision=base_revision, filters=filters, **window)),
+        ]
+        merged = heapq.merge(
+            *layers,
+            key=lambda record: [record.get(key) for key in keys],
+            reverse=directions == {pymongo.DESCENDING},
+        )
+        return itertools.islice(merged, offset, offset + limit if limit else None)
+
+    def encode(self, record: dict) -> dict:
+        """Convert a record to its stored form"""
+        return record
+
+    def decode(
+        self,
+        cursor: Iterable[dict],
+        dsFolder: types.GirderModel,
+        revision: Optional[int] = None,
+        set: Optional[str] = None,
+        feature_filters: Optional[dict] = None,
+    ) -> Iterable[dict]:
+        """Convert stored records read at revision back to their JSON shape"""
+        return cursor
+
+    def count(
+        self,
+        dsFolder: types.GirderModel,
+        revision: Optional[int] = None,
+        set: Optional[str] = None,
+        filters: Optional[dict] = None,
+    ) -> int:
+        query = merge_filters(self.live_query(dsFolder, revision, set), filters)
+        total = self.collection.count_documents(query)
+        base = self.base_layer(dsFolder, revision, set)
+        if base is not None:
+            base_folder, base_revision, _unreplaced = base
+            total += self.count(base_folder, base_revision, filters=filters)
+            # Less the base records the clone's own records replace
+            for batch in self._replaced_batches(dsFolder, revision):
+                replaced = {'$and': [{IDENTIFIER: {'$in': batch}}]}
+                total -= self.count(
+                    base_folder, base_revision, filters=merge_filters(filters, replaced)
+                )
+        return total
+
+    def changes(
+        self, dsFolder: types.GirderModel, since: int, head: int, set: Optional[str] = None
+    ) -> Tuple[Iterable[dict], List]:
+        """Records upserted and ids deleted after revision since, up to and including head"""
+        upserted = self.find(
+            query={
+                '$and': [
+                    self.live_query(dsFolder, head, set),
+                    {REVISION_CREATED: {'$gt': since}},
+                ]
+            },
+            sort=DEFAULT_ANNOTATION_SORT,
+            fields=self.PROJECT_FIELDS,
         )
+        upserted = self.decode(upserted, dsFolder, head, set)
+        expired = self.collection.distinct(
+            IDENTIFIER,
+            {
+                DATASET: dsFolder['_id'],
+                SET: set or None,
+                REVISION_DELETED: {'$gt': since, '$lte': head},
+            },
+        )
+        # An update tombstones the old record too, so only report ids that are gone at head
+        live = self.collection.distinct(
+            IDENTIFIER,
+            {'$and': [self.live_query(dsFolder, head, set), {IDENTIFIER: {'$in': expired}}]},
+        )
+        return upserted, sorted(frozenset(expired) - frozenset(live))
 
     def initialize(self):
         self._indices = [
@@ -52,6 +424,11 @@ class BaseItem(crud.PydanticModel):
             [[(DATASET, 1), (IDENTIFIER, 1)], {}],
             # Index for ensuring uniqueness and dataset consistency
             [[(DATASET, 1), (IDENTIFIER, 1), (REVISION_CREATED, 1)], {'unique': True}],
+            # Indices for snapshot reads: snapshot members plus the delta created after it
+            [[(DATASET, 1), (SNAPSHOT, 1)], {}],
+            [[(DATASET, 1), (REVISION_CREATED, 1)], {}],
+            # Index for finding records deleted since a revision
+            [[(DATASET, 1), (REVISION_DELETED, 1)], {}],
         ]
         super().initialize(self.NAME, self.MODEL)
 
@@ -60,9 +437,196 @@ class TrackItem(BaseItem):
     PROJECT_FIELDS = {
         **{'_id': 0},
         **{key: 1 for key in models.Track.schema()['properties'].keys()},
+        packing.PACKED: 1,
+        CHUNKED: 1,
+    }
+    # Types, frames and bounds, for exports that gather images and categories first
+    SUMMARY_FIELDS = {
+        '_id': 0,
+        IDENTIFIER: 1,
+        BEGIN: 1,
+        END: 1,
+        CONFIDENCE_PAIRS: 1,
+        'features.frame': 1,
+        'features.bounds': 1,
+        packing.PACKED: 1,
+        CHUNKED: 1,
     }
     NAME = 'trackItem'
     MODEL = models.TrackItemSchema
+    # Chunked tracks whose features are read together
+    CHUNK_READ_BATCH = 100
+
+    def initialize(self):
+        super().initialize()
+        # Index for frame-window queries over track extents
+        self._indices.append([[(DATASET, 1), (BEGIN, 1), (END, 1)], {}])
+        # Index for the last annotated frame of annotation statistics
+        self._indices.append([[(DATASET, 1), (END, 1)], {}])
+
+    def encode(self, record: dict) -> dict:
+        return packing.pack_track(record, pack_min_features())
+
+    def decode(
+        self,
+        cursor: Iterable[dict],
+        dsFolder: types.GirderModel,
+        revision: Optional[int] = None,
+        set: Optional[str] = None,
+        feature_filters: Optional[dict] = None,
+    ) -> Generator[dict, None, None]:
+        # Generator, so packed and chunked tracks are only assembled as they are read
+        cursor = iter(cursor)
+        while True:
+            batch = list(itertools.islice(cursor, self.CHUNK_READ_BATCH))
+            if not batch:
+                return
+            chunked = [track[IDENTIFIER] for track in batch if track.get(CHUNKED)]
+            features = {}
+            if chunked:
+                features = TrackChunkItem().features(
+                    dsFolder, chunked, revision, set, feature_filters
+                )
+            for track in batch:
+                if track.pop(CHUNKED, False):
+                    track['features'] = features.get(track[IDENTIFIER], [])
+                yield packing.unpack_track(track)
+
+    @staticmethod
+    def frame_window(frame_start: Optional[int], frame_end: Optional[int]) -> dict:
+        """Filter for tracks whose [begin, end] overlaps the window"""
+        filters = {}
+        if frame_end is not None:
+            filters[BEGIN] = {'$lte': frame_end}
+        if frame_start is not None:
+            filters[END] = {'$gte': frame_start}
+        return filters
+
+    @staticmethod
+    def confidence_filter(thresholds: Optional[dict], typeFilter: Optional[Iterable[str]]) -> dict:
+        """
+        Filter for tracks with a confidence pair that exports keep: one whose type is in
+        typeFilter (when not empty) and whose confidence meets its threshold (when
+        thresholds is not None), the default threshold applying to unnamed types.
+        """
+        types = sorted(typeFilter or [])
+        if thresholds is None:
+            if not types:
+                return {}
+            return {CONFIDENCE_PAIRS: {'$elemMatch': {'0': {'$in': types}}}}
+        default = thresholds.get('default', 0)
+        named = {
+            label: threshold
+            for label, threshold in thresholds.items()
+            if label != 'default' and (not types or label in types)
+        }
+        clauses = [{'0': label, '1': {'$gte': named[label]}} for label in sorted(named)]
+        if not types:
+            others = {'$nin': sorted(thresholds.keys() - {'default'})}
+            clauses.append({'0': others, '1': {'$gte': default}})
+        elif types != sorted(named):
+            others = {'$in': [label for label in types if label not in named]}
+            clauses.append({'0': others, '1': {'$gte': default}})
+        return {CONFIDENCE_PAIRS: {'$elemMatch': {'$or': clauses}}}
+
+    @staticmethod
+    def trim_features(track: dict, frame_start: Optional[int], frame_end: Optional[int]) -> dict:
+        """
+        Drop the features of track outside the window, in place.
+
+        frame_window_fields() does this in the database, but packed features can only be
+        trimmed once they are unpacked.
+        """
+        track['features'] = [
+            feature
+            for feature in track.get('features') or []
+            if (frame_start is None or feature['frame'] >= frame_start)
+            and (frame_end is None or feature['frame'] <= frame_end)
+        ]
+        return track
+
+    @classmethod
+    def frame_window_fields(cls, frame_start: Optional[int], frame_end: Optional[int]) -> dict:
+        """Projection that trims each track's features to the window"""
+        bounds = []
+        if frame_start is not None:
+            bounds.append({'$gte': ['$$feature.frame', frame_start]})
+        if frame_end is not None:
+            bounds.append({'$lte': ['$$feature.frame', frame_end]})
+        if not bounds:
+            return cls.PROJECT_FIELDS
+        return {
+            **cls.PROJECT_FIELDS,
+            'features': {
+                '$filter': {'input': '$features', 'as': 'feature', 'cond': {'$and': bounds}}
+            },
+        }
+
+
+class TrackChunkItem(BaseItem):
+    """
+    Feature chunks of tracks too long to store in one document.
+
+    A chunked track is a TrackItem header with chunked=True plus one chunk per range
+    of chunk_frames() frames.  Chunks are versioned like any other record, so a save
+    only rewrites the chunks whose features changed.
+    """
+
+    PROJECT_FIELDS = {
+        '_id': 0,
+        IDENTIFIER: 1,
+        CHUNK: 1,
+        BEGIN: 1,
+        END: 1,
+        'features': 1,
+        packing.PACKED: 1,
+    }
+    NAME = 'trackChunkItem'
+    MODEL = models.TrackChunkSchema
+    # Chunks are always read from the same layer as their track header
+    LAYERED = False
+
+    def initialize(self):
+        super().initialize()
+        # A track has many chunks per revision, so uniqueness includes the chunk
+        self._indices = [index for index in self._indices if not index[1].get('unique')]
+        self._indices += [
+            [[(DATASET, 1), (IDENTIFIER, 1), (CHUNK, 1), (REVISION_CREATED, 1)], {'unique': True}],
+            [[(DATASET, 1), (BEGIN, 1), (END, 1)], {}],
+        ]
+
+    def encode(self, record: dict) -> dict:
+        return packing.pack_track(record, pack_min_features())
+
+    def decode(
+        self,
+        cursor: Iterable[dict],
+        dsFolder: types.GirderModel,
+        revision: Optional[int] = None,
+        set: Optional[str] = None,
+        feature_filters: Optional[dict] = None,
+    ) -> Iterable[dict]:
+        return (packing.unpack_track(record) for record in cursor)
+
+    def features(
+        self,
+        dsFolder: types.GirderModel,
+        ids: List[int],
+        revision: Optional[int] = None,
+        set: Optional[str] = None,
+        feature_filters: Optional[dict] = None,
+    ) -> Dict[int, List[dict]]:
+        """Features of the chunked tracks ids at revision, in frame order"""
+        features: Dict[int, List[dict]] = {}
+        for chunk in self.list(
+            dsFolder,
+            sort=[(IDENTIFIER, 1), (CHUNK, 1)],
+            revision=revision,
+            set=set,
+            filters={IDENTIFIER: {'$in': ids}, **(feature_filters or {})},
+        ):
+            features.setdefault(chunk[IDENTIFIER], []).extend(chunk['features'])
+        return features
 
 
 class GroupItem(BaseItem):
@@ -85,6 +649,15 @@ class RevisionLogItem(crud.PydanticModel):
         super().initialize("revisionLogItem", models.RevisionLog)
 
     def latest(self, dsFolder: types.GirderModel, set: Optional[str] = None) -> int:
+        return RevisionHeadItem().head(dsFolder, set)
+
+    def latest_entry(self, dsFolder: types.GirderModel, set: Optional[str] = None):
+        """The log entry of the newest revision of set, None before the first save"""
+        query = {DATASET: dsFolder['_id'], SET: set or {'$in': [None, '']}}
+        return self.findOne(query, sort=[[REVISION, pymongo.DESCENDING]])
+
+    def latest_logged(self, dsFolder: types.GirderModel, set: Optional[str] = None) -> int:
+        """Find the head by scanning the log.  Only used to seed RevisionHeadItem."""
         query = {DATASET: dsFolder['_id']}
         if set:
             query[SET] = set
@@ -99,12 +672,28 @@ class RevisionLogItem(crud.PydanticModel):
         sort=DEFAULT_REVISION_SORT,
         before: Optional[int] = None,
         set: Optional[str] = None,
-    ) -> Tuple[Cursor, int]:
+        after: Optional[int] = None,
+        count: str = COUNT_EXACT,
+    ) -> Tuple[Cursor, Optional[int]]:
+        """
+        List log entries, newest first by default.
+
+        The total is None when count is COUNT_NONE.  COUNT_ESTIMATED reads the head
+        counter instead of counting, which overestimates once history has been compacted.
+        """
         query: dict = {DATASET: dsFolder['_id']}
         if before is not None:
             query[REVISION] = {'$lte': before}
         if set:
             query[SET] = set
+        total = None
+        if count == COUNT_ESTIMATED and not set and before is None:
+            total = RevisionHeadItem().head(dsFolder)
+        elif count != COUNT_NONE:
+            total = self.collection.count_documents(query)
+        if after is not None:
+            keyset = keyset_filter(sort, REVISION, after)[REVISION]
+            query[REVISION] = {**query.get(REVISION, {}), **keyset}
         cursor = self.find(
             offset=offset,
             limit=limit,
@@ -112,7 +701,6 @@ class RevisionLogItem(crud.PydanticModel):
             query=query,
             fields=RevisionLogItem.PROJECT_FIELDS,
         )
-        total = self.find(query=query).count()
         return cursor, total
 
     def sets(
@@ -133,25 +721,923 @@ class RevisionLogItem(crud.PydanticModel):
         return cursor
 
 
-def rollback(dsFolder: types.GirderModel, revision: int):
-    """Reset to previous revision."""
-    # TODO implement immutabble forward-rollback (like git revert)
-    # Logic: delete everything created after revision
-    # And erase deletions for anything deleted after revision
+class RevisionHeadItem(crud.PydanticModel):
+    """
+    Per-dataset revision counters, read and advanced in O(1).
+
+    The dataset document (set=None) hands out revision numbers with an atomic $inc on
+    ``allocated`` so that concurrent saves never share a revision.  ``head`` is only
+    advanced after the revision log entry is written, so readers never observe a
+    revision that is still being saved.  Documents with a set track that set's head,
+    and ``main_head`` on the dataset document tracks the head of the main set.
+
+    Writers hold the dataset's write lease (``writer`` until ``lease_expires``) from
+    their first read to their commit, so at most one revision is being written at a
+    time and the head only ever moves over fully written revisions.
+    """
+
+    def initialize(self):
+        self._indices = [
+            [[(DATASET, 1), (SET, 1)], {'unique': True}],
+        ]
+        super().initialize("revisionHeadItem", models.RevisionHead)
+
+    @staticmethod
+    def _filter(dsFolder: types.GirderModel, set: Optional[str] = None) -> dict:
+        return {DATASET: dsFolder['_id'], SET: set or None}
+
+    def _seed(self, dsFolder: types.GirderModel, set: Optional[str] = None) -> dict:
+        """Create the counter from the revision log for datasets saved before it existed"""
+        latest = RevisionLogItem().latest_logged(dsFolder, set)
+        filter = self._filter(dsFolder, set)
+        seed = {'$max': {HEAD: latest, ALLOCATED: latest}}
+        after = pymongo.ReturnDocument.AFTER
+        try:
+            return self.collection.find_one_and_update(
+                filter, seed, upsert=True, return_document=after
+            )
+        except pymongo.errors.DuplicateKeyError:
+            # A concurrent first save inserted the counter between our match and insert
+            return self.collection.find_one_and_update(filter, seed, return_document=after)
+
+    def get(self, dsFolder: types.GirderModel, set: Optional[str] = None) -> dict:
+        result = self.collection.find_one(self._filter(dsFolder, set))
+        if result is None:
+            result = self._seed(dsFolder, set)
+        return result
+
+    def head(self, dsFolder: types.GirderModel, set: Optional[str] = None) -> int:
+        return self.get(dsFolder, set)[HEAD]
+
+    def set_head(self, dsFolder: types.GirderModel, set: Optional[str] = None) -> int:
+        """
+        The newest revision saved to set.  Unlike head, saves to other sets do not
+        move it for the main set.
+        """
+        if set:
+            return self.head(dsFolder, set)
+        state = self.get(dsFolder)
+        if MAIN_HEAD in state:
+            return state[MAIN_HEAD]
+        # Datasets last saved before the main set head was kept
+        entry = RevisionLogItem().latest_entry(dsFolder) or {}
+        result = self.collection.find_one_and_update(
+            self._filter(dsFolder),
+            {'$max': {MAIN_HEAD: entry.get(REVISION, 0)}},
+            return_document=pymongo.ReturnDocument.AFTER,
+        )
+        return result[MAIN_HEAD]
+
+    def allocate(self, dsFolder: types.GirderModel) -> int:
+        """
+        Atomically reserve the next revision number for a save.
+
+        A revision whose save fails is never committed, so committed revisions can
+        have gaps: consumers must order revisions, never count on consecutive numbers.
+        """
+        filter = self._filter(dsFolder)
+        increment = {'$inc': {ALLOCATED: 1}}
+        after = pymongo.ReturnDocument.AFTER
+        result = self.collection.find_one_and_update(filter, increment, return_document=after)
+        if result is None:
+            self._seed(dsFolder)
+            result = self.collection.find_one_and_update(filter, increment, return_document=after)
+        return result[ALLOCATED]
+
+    def acquire(self, dsFolder: types.GirderModel, seconds: float) -> Optional[ObjectId]:
+        """Take the write lease for seconds, or None while another writer holds it"""
+        self.get(dsFolder)
+        now = datetime.utcnow()
+        lease = ObjectId()
+        result = self.collection.find_one_and_update(
+            {**self._filter(dsFolder), '$or': [{WRITER: None}, {LEASE_EXPIRES: {'$lt': now}}]},
+            {'$set': {WRITER: lease, LEASE_EXPIRES: now + timedelta(seconds=seconds)}},
+        )
+        return None if result is None else lease
+
+    def renew(self, dsFolder: types.GirderModel, lease: ObjectId, seconds: float):
+        """Extend a held write lease, failing if it expired and another writer took it"""
+        result = self.collection.update_one(
+            {**self._filter(dsFolder), WRITER: lease},
+            {'$set': {LEASE_EXPIRES: datetime.utcnow() + timedelta(seconds=seconds)}},
+        )
+        if result.matched_count == 0:
+            raise RestException('The annotation write lease expired, try again', code=409)
+
+    def release(self, dsFolder: types.GirderModel, lease: ObjectId):
+        self.collection.update_one(
+            {**self._filter(dsFolder), WRITER: lease}, {'$unset': {WRITER: '', LEASE_EXPIRES: ''}}
+        )
+
+    def commit(
+        self, dsFolder: types.GirderModel, revision: int, set: Optional[str], lease: ObjectId
+    ):
+        """Publish a logged revision to readers.  Only the holder of the write lease may."""
+        published = {HEAD: revision, ALLOCATED: revision}
+        if not set:
+            published[MAIN_HEAD] = revision
+        result = self.collection.update_one(
+            {**self._filter(dsFolder), WRITER: lease}, {'$max': published}
+        )
+        if result.matched_count == 0:
+            raise RestException('The annotation write lease expired, try again', code=409)
+        if set:
+            self.collection.update_one(
+                self._filter(dsFolder, set), {'$max': {HEAD: revision}}, upsert=True
+            )
+
+    def add_snapshot(self, dsFolder: types.GirderModel, revision: int) -> List[int]:
+        """Publish a snapshot to readers and return the snapshots that aged out"""
+        filter = self._filter(dsFolder)
+        result = self.collection.find_one_and_update(
+            filter,
+            {'$addToSet': {SNAPSHOTS: revision}},
+            return_document=pymongo.ReturnDocument.AFTER,
+        )
+        expired = sorted(result.get(SNAPSHOTS) or [])[:-SNAPSHOT_RETENTION]
+        if expired:
+            self.collection.update_one(filter, {'$pull': {SNAPSHOTS: {'$in': expired}}})
+        return expired
+
+    def compact(self, dsFolder: types.GirderModel, revision: int):
+        """Mark revisions older than revision as no longer readable"""
+        self.collection.update_one(
+            self._filter(dsFolder), {'$max': {COMPACTED: revision}}, upsert=True
+        )
+
+    def require_readable(self, dsFolder: types.GirderModel, revision: int):
+        if revision < self.get(dsFolder).get(COMPACTED, 0):
+            raise RestException(f'Revision {revision} was removed by annotation history compaction')
+
+    def set_base(self, dsFolder: types.GirderModel, base: types.GirderModel, revision: int):
+        """Make dsFolder a copy-on-write clone of base at revision"""
+        self.get(dsFolder)
+        self.collection.update_one(
+            self._filter(dsFolder),
+            {'$set': {BASE_DATASET: base['_id'], BASE_REVISION: revision}},
+        )
+
+    def clear_base(self, dsFolder: types.GirderModel):
+        self.collection.update_one(
+            self._filter(dsFolder), {'$unset': {BASE_DATASET: '', BASE_REVISION: ''}}
+        )
+
+    def mark_labels_counted(self, dsFolder: types.GirderModel):
+        self.get(dsFolder)
+        self.collection.update_one(self._filter(dsFolder), {'$set': {LABELS_COUNTED: True}})
+
+    def labels_counted(self, dataset_ids: List[ObjectId]) -> List[ObjectId]:
+        """The datasets among dataset_ids whose label summary is complete"""
+        query = {DATASET: {'$in': dataset_ids}, SET: None, LABELS_COUNTED: True}
+        return self.collection.distinct(DATASET, query)
+
+    def clones(self, dsFolder: types.GirderModel) -> List[dict]:
+        """Counters of the datasets that use dsFolder as their base"""
+        return list(self.collection.find({BASE_DATASET: dsFolder['_id'], SET: None}))
+
+    def reset(self, dsFolder: types.GirderModel, revision: int):
+        """Move every counter of the dataset back to revision"""
+        self.collection.update_many(
+            {DATASET: dsFolder['_id']},
+            {
+                '$min': {HEAD: revision, ALLOCATED: revision},
+                '$pull': {SNAPSHOTS: {'$gt': revision}},
+            },
+        )
+        self.collection.update_one(self._filter(dsFolder), {'$min': {MAIN_HEAD: revision}})
+
+
+def top_label(confidencePairs: Optional[List]) -> Optional[str]:
+    """The type of the highest-score pair, keeping the first pair when scores tie"""
+    best = None
+    for pair in confidencePairs or []:
+        if best is None or pair[1] > best[1]:
+            best = pair
+    if best is None or not isinstance(best[0], str):
+        return None
+    return best[0]
+
+
+class LabelSummaryItem(crud.PydanticModel):
+    """
+    Per-dataset counts of live tracks by top label, so get_labels never reads tracks.
+
+    save_annotations and rollback apply the label changes of each revision.  Datasets
+    saved before the summary existed are counted in full the first time they are read.
+    """
+
+    def initialize(self):
+        self._indices = [
+            [[(DATASET, 1), (SET, 1), (LABEL, 1)], {'unique': True}],
+        ]
+        super().initialize('labelSummaryItem', models.LabelCount)
+
+    def add(self, dsFolder: types.GirderModel, changes: Dict[Tuple[Optional[str], str], int]):
+        """Apply count changes keyed by (set, label)"""
+        operations = [
+            pymongo.UpdateOne(
+                {DATASET: dsFolder['_id'], SET: set, LABEL: label},
+                {'$inc': {LABEL_COUNT: change}},
+                upsert=True,
+            )
+            for (set, label), change in changes.items()
+            if change
+        ]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+            self.collection.delete_many({DATASET: dsFolder['_id'], LABEL_COUNT: {'$lte': 0}})
+
+    def recount(self, dsFolder: types.GirderModel):
+        """Count the live tracks of every set of dsFolder from scratch"""
+        counts: Dict[Tuple[Optional[str], str], int] = {}
+        track_model = TrackItem()
+        sets = track_model.collection.distinct(SET, {DATASET: dsFolder['_id']})
+        for set in [None, *[name for name in sets if name]]:
+            fields = {IDENTIFIER: 1, CONFIDENCE_PAIRS: 1}
+            for track in track_model.list(dsFolder, set=set, fields=fields):
+                label = top_label(track.get(CONFIDENCE_PAIRS))
+                if label is not None:
+                    counts[(set, label)] = counts.get((set, label), 0) + 1
+        self.collection.delete_many({DATASET: dsFolder['_id']})
+        if counts:
+            self.collection.insert_many(
+                [
+                    {DATASET: dsFolder['_id'], SET: set, LABEL: label, LABEL_COUNT: count}
+                    for (set, label), count in counts.items()
+                ]
+            )
+        RevisionHeadItem().mark_labels_counted(dsFolder)
+
+    def copy(self, source: types.GirderModel, dest: types.GirderModel):
+        """Give dest the main set counts of source"""
+        counts = self.collection.find({DATASET: source['_id'], SET: None})
+        self.collection.delete_many({DATASET: dest['_id']})
+        documents = [{**count, '_id': ObjectId(), DATASET: dest['_id']} for count in counts]
+        if documents:
+            self.collection.insert_many(documents)
+        RevisionHeadItem().mark_labels_counted(dest)
+
+
+def _count_tracks(stats: dict, tracks: Iterable[dict], change: int):
+    """Add (change=1) or remove (change=-1) track versions from the counts of stats"""
+    types = dict(stats['types'])
+    for track in tracks:
+        stats['tracks'] += change
+        stats['detections'] += change * track.get(DETECTIONS, len(track.get('features') or []))
+        label = top_label(track.get(CONFIDENCE_PAIRS))
+        if label is not None:
+            types[label] = types.get(label, 0) + change
+    stats['types'] = sorted([label, count] for label, count in types.items() if count > 0)
+
+
+def _extend_frames(stats: dict, tracks: Iterable[dict]):
+    for track in tracks:
+        if stats['firstFrame'] is None or track[BEGIN] < stats['firstFrame']:
+            stats['firstFrame'] = track[BEGIN]
+        if stats['lastFrame'] is None or track[END] > stats['lastFrame']:
+            stats['lastFrame'] = track[END]
+
+
+def _frame_range(
+    dsFolder: types.GirderModel, revision: Optional[int], set: Optional[str]
+) -> Tuple[Optional[int], Optional[int]]:
+    """First and last annotated frame at revision, from one indexed read each"""
+    frames = []
+    for key, direction in ((BEGIN, pymongo.ASCENDING), (END, pymongo.DESCENDING)):
+        first = TrackItem().list(
+            dsFolder,
+            limit=1,
+            sort=[[key, direction]],
+            revision=revision,
+            set=set,
+            fields={IDENTIFIER: 1, BEGIN: 1, END: 1},
+        )
+        frames.append(next((track[key] for track in first), None))
+    return frames[0], frames[1]
+
+
+def annotation_stats(
+    dsFolder: types.GirderModel, revision: Optional[int] = None, set: Optional[str] = None
+) -> dict:
+    """Statistics of the tracks live at revision, read in full"""
+    stats = models.AnnotationStats().dict()
+    for track in TrackItem().list(dsFolder, revision=revision, set=set):
+        _count_tracks(stats, [track], 1)
+        _extend_frames(stats, [track])
+    return stats
+
+
+def next_stats(
+    dsFolder: types.GirderModel,
+    revision: int,
+    set: Optional[str],
+    previous: dict,
+    removed: List[dict],
+    added: List[dict],
+) -> dict:
+    """
+    Statistics at revision from those of the previous revision and the track versions
+    it replaced.  The frame range is only read again when a removed track bounded it.
+    """
+    stats = {**previous, 'types': list(previous['types'])}
+    _count_tracks(stats, removed, -1)
+    _count_tracks(stats, added, 1)
+    if any(
+        track[BEGIN] == previous['firstFrame'] or track[END] == previous['lastFrame']
+        for track in removed
+    ):
+        stats['firstFrame'], stats['lastFrame'] = _frame_range(dsFolder, revision, set)
+    else:
+        _extend_frames(stats, added)
+    return stats
+
+
+def get_annotation_stats(dsFolder: types.GirderModel, set: Optional[str] = None) -> dict:
+    """Statistics at the newest revision, computed and cached in its log entry if missing"""
+    log = RevisionLogItem()
+    entry = log.latest_entry(dsFolder, set)
+    if entry is None:
+        # Nothing saved yet, but a clone already reads its base
+        return {REVISION: 0, **annotation_stats(dsFolder, set=set)}
+    stats = entry.get(STATS)
+    if stats is None:
+        stats = annotation_stats(dsFolder, revision=entry[REVISION], set=set)
+        log.collection.update_one({'_id': entry['_id']}, {'$set': {STATS: stats}})
+    return {REVISION: entry[REVISION], **stats}
+
+
+def _positive_env(name: str, cast: Callable = int):
+    try:
+        value = cast(os.environ[name])
+    except (KeyError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def snapshot_interval() -> int:
+    """Revisions between snapshots, from DIVE_ANNOTATION_SNAPSHOT_INTERVAL.  0 disables."""
+    return _positive_env('DIVE_ANNOTATION_SNAPSHOT_INTERVAL') or 0
+
+
+def write_lease_seconds() -> float:
+    """
+    Seconds a dataset's write lease lasts without renewal, from DIVE_ANNOTATION_WRITE_LEASE.
+    Writers renew it before every batch they write, so it only bounds how long a writer
+    that died blocks the dataset.
+    """
+    return _positive_env('DIVE_ANNOTATION_WRITE_LEASE', float) or 300.0
+
+
+def pack_min_features() -> int:
+    """
+    Tracks with at least this many features are stored packed, from
+    DIVE_ANNOTATION_PACK_MIN_FEATURES.  0 disables packing.
+    """
+    return _positive_env('DIVE_ANNOTATION_PACK_MIN_FEATURES') or 0
+
+
+def chunk_frames() -> int:
+    """
+    Frames per chunk of a chunked track, from DIVE_ANNOTATION_CHUNK_FRAMES.  Tracks with
+    more features than this are chunked.  0 disables chunking.
+    """
+    return _positive_env('DIVE_ANNOTATION_CHUNK_FRAMES') or 0
+
+
+def split_track(track: dict, span: int) -> Tuple[dict, List[dict]]:
+    """Split a long track into a header and chunks of span frames each"""
+    features = track.get('features') or []
+    if not span or len(features) <= span:
+        return track, []
+    header = {key: value for key, value in track.items() if key != 'features'}
+    header[CHUNKED] = True
+    grouped: Dict[int, List[dict]] = {}
+    for feature in features:
+        grouped.setdefault(feature['frame'] // span, []).append(feature)
+    chunks = [
+        {
+            IDENTIFIER: track[IDENTIFIER],
+            CHUNK: chunk,
+            BEGIN: chunk_features[0]['frame'],
+            END: chunk_features[-1]['frame'],
+            'features': chunk_features,
+        }
+        for chunk, chunk_features in sorted(grouped.items())
+    ]
+    return header, chunks
+
+
+def _same_chunk(stored: dict, record: dict) -> bool:
+    keys = (BEGIN, END, 'features', packing.PACKED)
+    return bson.encode({key: stored.get(key) for key in keys}) == bson.encode(
+        {key: record.get(key) for key in keys}
+    )
+
+
+def _update_chunks(
+    datasetId: ObjectId,
+    revision: int,
+    chunked: Dict[int, List[dict]],
+    unchunked: List[int],
+    set: Optional[str] = None,
+):
+    """
+    Write the chunks of the chunked tracks being saved, leaving unchanged chunks in place.
+
+    Chunks of the unchunked ids, which were deleted or are now stored whole, are expired.
+    """
+    model = TrackChunkItem()
+    expire_update = {'$set': {REVISION_DELETED: revision}}
+    # Saves to the main set must not expire the chunks of other sets
+    query: dict = {
+        DATASET: datasetId,
+        SET: set or None,
+        REVISION_DELETED: {'$exists': False},
+        IDENTIFIER: {'$in': list(chunked) + list(unchunked)},
+    }
+    existing: Dict[int, Dict[int, dict]] = {}
+    for stored in model.collection.find(query):
+        existing.setdefault(stored[IDENTIFIER], {})[stored[CHUNK]] = stored
+    operations: List[Any] = []
+    for id, chunks in chunked.items():
+        current = existing.pop(id, {})
+        for chunk in chunks:
+            record = {DATASET: datasetId, REVISION_CREATED: revision, **chunk}
+            if set:
+                record[SET] = set
+            record = model.encode(record)
+            stored = current.pop(chunk[CHUNK], None)
+            if stored is not None:
+                if _same_chunk(stored, record):
+                    continue
+                operations.append(pymongo.UpdateOne({'_id': stored['_id']}, expire_update))
+            operations.append(pymongo.InsertOne(record))
+        existing[id] = current
+    for current in existing.values():
+        for stored in current.values():
+            operations.append(pymongo.UpdateOne({'_id': stored['_id']}, expire_update))
+    if operations:
+        model.collection.bulk_write(operations, ordered=False)
+
+
+def content_hash(record: dict) -> str:
+    """Stable hash of the annotation content of a record, ignoring storage fields"""
+    content = {key: value for key, value in record.items() if key not in STORAGE_FIELDS}
+    canonical = json.dumps(_drop_none(content), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+
+def _drop_none(value: Any) -> Any:
+    # Records built with and without exclude_none must hash the same
+    if isinstance(value, dict):
+        return {k: _drop_none(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_drop_none(v) for v in value]
+    return value
+
+
+def nearest_snapshot(snapshots: List[int], revision: int) -> Optional[int]:
+    """Find the newest snapshot taken at or before revision"""
+    candidates = [snapshot for snapshot in snapshots if snapshot <= revision]
+    return max(candidates) if candidates else None
+
+
+def take_snapshot(dsFolder: types.GirderModel, revision: int):
+    """
+    Mark every record live at revision as a member of that revision's snapshot.
+
+    Reads at or after a snapshot select its members plus the records created since,
+    rather than filtering every tombstoned version in the dataset.  Records are only
+    marked, never copied, and the snapshot is published once marking is complete.
+    """
     dsId = dsFolder['_id']
-    RevisionLogItem().removeWithQuery({DATASET: dsId, REVISION: {'$gt': revision}})
-    removeQuery = {DATASET: dsId, REVISION_CREATED: {'$gt': revision}}
-    # Deletion is lazy, so restoring a record means clearing its rev_deleted
-    # tombstone.  Those records must be selected by REVISION_DELETED: keying this
-    # off REVISION_CREATED only ever matches records removeWithQuery just dropped,
-    # leaving live records tombstoned with a revision number that save_annotations
-    # will re-issue, silently deleting them again on the next save.
-    restoreQuery = {DATASET: dsId, REVISION_DELETED: {'$gt': revision}}
-    updateQuery = {'$unset': {REVISION_DELETED: ""}}
-    TrackItem().removeWithQuery(removeQuery)
-    TrackItem().update(restoreQuery, updateQuery)
-    GroupItem().removeWithQuery(removeQuery)
-    GroupItem().update(restoreQuery, updateQuery)
+    live_query = {
+        DATASET: dsId,
+        REVISION_CREATED: {'$lte': revision},
+        '$or': [{REVISION_DELETED: {'$gt': revision}}, {REVISION_DELETED: {'$exists': False}}],
+    }
+    for model in (TrackItem(), TrackChunkItem(), GroupItem()):
+        model.collection.update_many(live_query, {'$addToSet': {SNAPSHOT: revision}})
+    expired = RevisionHeadItem().add_snapshot(dsFolder, revision)
+    if expired:
+        expired_query = {DATASET: dsId, SNAPSHOT: {'$in': expired}}
+        for model in (TrackItem(), TrackChunkItem(), GroupItem()):
+            model.collection.update_many(expired_query, {'$pull': {SNAPSHOT: {'$in': expired}}})
+
+
+def rollback(dsFolder: types.GirderModel, revision: int):
+    """
+    Reset to previous revision, discarding every later revision.
+
+    See revert_annotations for a rollback that keeps history.
+    """
+    lease = acquire_write_lease(dsFolder)
+    try:
+        # Logic: delete everything created after revision
+        # And erase deletions for anything deleted after revision
+        dsId = dsFolder['_id']
+        RevisionHeadItem().require_readable(dsFolder, revision)
+        for clone in RevisionHeadItem().clones(dsFolder):
+            if clone[BASE_REVISION] > revision:
+                materialize_base({'_id': clone[DATASET]})
+        RevisionLogItem().removeWithQuery({DATASET: dsId, REVISION: {'$gt': revision}})
+        removeQuery = {DATASET: dsId, REVISION_CREATED: {'$gt': revision}}
+        # Deletion is lazy, so restoring a record means clearing its rev_deleted
+        # tombstone.  Those records must be selected by REVISION_DELETED: keying this
+        # off REVISION_CREATED only ever matches records removeWithQuery just dropped,
+        # leaving live records tombstoned with a revision number that save_annotations
+        # will re-issue, silently deleting them again on the next save.
+        restoreQuery = {DATASET: dsId, REVISION_DELETED: {'$gt': revision}}
+        updateQuery = {'$unset': {REVISION_DELETED: ""}}
+        # Snapshots taken after revision no longer describe any state of the dataset
+        snapshotQuery = {DATASET: dsId, SNAPSHOT: {'$gt': revision}}
+        snapshotUpdate = {'$pull': {SNAPSHOT: {'$gt': revision}}}
+        # Records created after revision disappear, and records deleted after it come back
+        is_clone = RevisionHeadItem().get(dsFolder).get(BASE_DATASET) is not None
+        labels: Dict[Tuple[Optional[str], str], int] = {}
+        label_changes = [
+            ({**removeQuery, REVISION_DELETED: {'$exists': False}}, -1),
+            ({**restoreQuery, REVISION_CREATED: {'$lte': revision}}, 1),
+        ]
+        for query, change in [] if is_clone else label_changes:
+            for record in TrackItem().collection.find(query, {SET: 1, CONFIDENCE_PAIRS: 1}):
+                label = top_label(record.get(CONFIDENCE_PAIRS))
+                if label is not None:
+                    key = (record.get(SET), label)
+                    labels[key] = labels.get(key, 0) + change
+        RevisionHeadItem().reset(dsFolder, revision)
+        for model in (TrackItem(), TrackChunkItem(), GroupItem()):
+            model.removeWithQuery(removeQuery)
+            model.update(restoreQuery, updateQuery)
+            model.update(snapshotQuery, snapshotUpdate)
+        if is_clone:
+            # Removing the clone's own records uncovers base records, so count again
+            LabelSummaryItem().recount(dsFolder)
+        else:
+            LabelSummaryItem().add(dsFolder, labels)
+    finally:
+        RevisionHeadItem().release(dsFolder, lease)
+
+
+def _live_versions(
+    model: BaseItem, dsFolder: types.GirderModel, revision: Optional[int], set: Optional[str]
+) -> Dict[int, Tuple[ObjectId, Optional[str]]]:
+    """Record id and content hash of every id live at revision"""
+    listed = model.list(dsFolder, revision=revision, set=set, fields={IDENTIFIER: 1, HASH: 1})
+    return {record[IDENTIFIER]: (record['_id'], record.get(HASH)) for record in listed}
+
+
+def _same_version(
+    target: Tuple[ObjectId, Optional[str]], current: Optional[Tuple[ObjectId, Optional[str]]]
+) -> bool:
+    if current is None:
+        return False
+    return target[0] == current[0] or (target[1] is not None and target[1] == current[1])
+
+
+def revert_annotations(
+    dsFolder: types.GirderModel,
+    user: types.GirderUserModel,
+    revision: int,
+    set: Optional[str] = None,
+    batch_size=1000,
+    progress: Optional[Callable[[int], None]] = None,
+) -> dict:
+    """
+    Save a new revision whose annotations are those at revision, like git revert.
+
+    Only ids whose live version differs from revision are written, and their old
+    versions are read and written into the new revision batch_size ids at a time.
+    The dataset's write lease is held from before the live versions are compared to
+    the commit, so no other save lands between the comparison and the batches.
+    Reverting again is a no-op, so an interrupted revert is resumed by running it again.
+    """
+    RevisionHeadItem().require_readable(dsFolder, revision)
+    write = RevisionWrite(dsFolder, user, description=f'Revert to revision {revision}', set=set)
+    restored = 0
+    try:
+        write.hold()
+        for kind, model, serialize in (
+            ('tracks', TrackItem(), dive.serialize_track),
+            ('groups', GroupItem(), dive.serialize_group),
+        ):
+            current = _live_versions(model, dsFolder, None, set)
+            target = _live_versions(model, dsFolder, revision, set)
+            restore = sorted(
+                id for id, version in target.items() if not _same_version(version, current.get(id))
+            )
+            for start in range(0, len(restore), batch_size):
+                batch = restore[start : start + batch_size]
+                filters = {IDENTIFIER: {'$in': batch}}
+                upserted = [
+                    serialize(record)
+                    for record in model.list(dsFolder, revision=revision, set=set, filters=filters)
+                ]
+                write.save(**{f'upsert_{kind}': upserted})
+                restored += len(batch)
+                if progress:
+                    progress(restored)
+            removed = sorted(current.keys() - target.keys())
+            for start in range(0, len(removed), batch_size):
+                write.save(**{f'delete_{kind}': removed[start : start + batch_size]})
+        return write.commit()
+    except Exception:
+        write.abort()
+        raise
+
+
+def revert_job(job: types.GirderModel):
+    """Run revert_annotations for a local job created by crud_rpc.revert_annotations"""
+    params = job['kwargs']
+    dsFolder = Folder().load(params['folderId'], force=True)
+    user = User().load(job['userId'], force=True)
+    revision = params['revision']
+    job = Job().updateJob(
+        job,
+        log=f'Reverting annotations of {dsFolder["name"]} to revision {revision}\n',
+        status=JobStatus.RUNNING,
+    )
+
+    def progress(restored: int):
+        Job().updateJob(job, progressMessage=f'Restored {restored} annotations')
+
+    try:
+        result = revert_annotations(
+            dsFolder, user, revision, set=params.get('set'), progress=progress
+        )
+    except Exception as err:
+        Job().updateJob(job, log=f'Revert failed: {err}\n', status=JobStatus.ERROR)
+        raise
+    Job().updateJob(
+        job,
+        log=f'Restored {result["updated"]} and removed {result["deleted"]} annotations.\n',
+        status=JobStatus.SUCCESS,
+        otherFields={'revert': result},
+    )
+
+
+def transform_annotations(
+    dsFolder: types.GirderModel,
+    user: types.GirderUserModel,
+    transform_list: List[transforms.Transform],
+    set: Optional[str] = None,
+    revision: Optional[int] = None,
+    progress_every=10000,
+    progress: Optional[Callable[[int], None]] = None,
+    batch_size=1000,
+    set_head: Optional[int] = None,
+) -> dict:
+    """
+    Save a new revision with transform_list applied to the annotations at revision.
+
+    Annotations are read and transformed on the server as a stream, and those a
+    transform changed are written batch_size at a time into the one new revision.
+    The dataset's write lease is held from before the first read to the commit, so
+    no other save lands between the revision read and the batches written over it.
+    With set_head, the transform fails if the set was saved since that revision.
+    """
+    write = RevisionWrite(dsFolder, user, description=transforms.describe(transform_list), set=set)
+    read = 0
+    try:
+        write.hold()
+        # Transforms are not idempotent, so refuse to apply them over later edits of
+        # the set, including the revision of an earlier delivery of the same job
+        if set_head is not None and RevisionHeadItem().set_head(dsFolder, set) != set_head:
+            raise RestException('Annotations changed since the transform was scheduled', code=409)
+        if revision is None:
+            # The reads must not see the batches already written
+            revision = RevisionHeadItem().head(dsFolder, set)
+        for key, model, serialize, apply in (
+            ('upsert_tracks', TrackItem(), dive.serialize_track, transforms.transform_track),
+            ('upsert_groups', GroupItem(), dive.serialize_group, transforms.transform_group),
+        ):
+            changed = []
+            for record in model.list(dsFolder, revision=revision, set=set):
+                annotation = serialize(record)
+                if apply(annotation, transform_list):
+                    changed.append(annotation)
+                if len(changed) == batch_size:
+                    write.save(**{key: changed})
+                    changed = []
+                read += 1
+                if read % progress_every == 0:
+                    # Long runs of unchanged annotations save nothing that would renew it
+                    write.hold()
+                    if progress:
+                        progress(read)
+            if changed:
+                write.save(**{key: changed})
+        return write.commit()
+    except Exception:
+        write.abort()
+        raise
+
+
+def transform_job(job: types.GirderModel):
+    """Run transform_annotations for a local job created by crud_rpc.transform_annotations"""
+    params = job['kwargs']
+    dsFolder = Folder().load(params['folderId'], force=True)
+    user = User().load(job['userId'], force=True)
+    args = transforms.AnnotationTransformArgs(**params['args'])
+    job = Job().updateJob(
+        job,
+        log=f'{transforms.describe(args.transforms)} of {dsFolder["name"]}\n',
+        status=JobStatus.RUNNING,
+    )
+
+    def progress(read: int):
+        Job().updateJob(job, progressMessage=f'Transformed {read} annotations')
+
+    try:
+        result = transform_annotations(
+            dsFolder,
+            user,
+            args.transforms,
+            set=args.set,
+            revision=params['revision'],
+            progress=progress,
+            set_head=params['setHead'],
+        )
+    except Exception as err:
+        Job().updateJob(job, log=f'Transform failed: {err}\n', status=JobStatus.ERROR)
+        raise
+    Job().updateJob(
+        job,
+        log=f'Changed {result["updated"]} annotations.\n',
+        status=JobStatus.SUCCESS,
+        otherFields={'transform': result},
+    )
+
+
+def retention_policy() -> Tuple[Optional[int], Optional[float]]:
+    """
+    Default history retention from DIVE_ANNOTATION_RETAIN_REVISIONS (keep the last N
+    revisions) and DIVE_ANNOTATION_RETAIN_DAYS (keep revisions newer than D days).
+    """
+    return (
+        _positive_env('DIVE_ANNOTATION_RETAIN_REVISIONS'),
+        _positive_env('DIVE_ANNOTATION_RETAIN_DAYS', float),
+    )
+
+
+def retention_revision(
+    dsFolder: types.GirderModel,
+    keep_revisions: Optional[int] = None,
+    keep_days: Optional[float] = None,
+) -> int:
+    """Oldest revision that must stay readable.  When both rules are given, the longer wins."""
+    head = RevisionHeadItem().head(dsFolder)
+    candidates = []
+    if keep_revisions is not None:
+        candidates.append(head - max(keep_revisions, 1) + 1)
+    if keep_days is not None:
+        cutoff = datetime.utcnow() - timedelta(days=keep_days)
+        oldest = RevisionLogItem().findOne(
+            {DATASET: dsFolder['_id'], 'created': {'$gte': cutoff}},
+            sort=[[REVISION, pymongo.ASCENDING]],
+        )
+        candidates.append(oldest[REVISION] if oldest else head)
+    if not candidates:
+        raise ValueError('A retention policy needs keep_revisions or keep_days')
+    return min(max(min(candidates), 0), head)
+
+
+def _squash_revision_log(dsFolder: types.GirderModel, revision: int) -> int:
+    """Fold log entries up to revision into the newest such entry of each set"""
+    entries = RevisionLogItem().find(
+        {DATASET: dsFolder['_id'], REVISION: {'$lte': revision}},
+        sort=[[REVISION, pymongo.DESCENDING]],
+    )
+    kept: dict = {}
+    squashed: List = []
+    for entry in entries:
+        key = entry.get(SET) or None
+        if key not in kept:
+            kept[key] = {**entry, 'count': 1}
+            continue
+        kept[key]['additions'] += entry.get('additions', 0)
+        kept[key]['deletions'] += entry.get('deletions', 0)
+        kept[key]['count'] += 1
+        squashed.append(entry['_id'])
+    for entry in kept.values():
+        if entry['count'] > 1:
+            RevisionLogItem().collection.update_one(
+                {'_id': entry['_id']},
+                {
+                    '$set': {
+                        'additions': entry['additions'],
+                        'deletions': entry['deletions'],
+                        'description': f'{entry.get("description") or "save"} '
+                        f'(squashed {entry["count"]} revisions)',
+                    }
+                },
+            )
+    if squashed:
+        RevisionLogItem().collection.delete_many({'_id': {'$in': squashed}})
+    return len(squashed)
+
+
+def _delete_in_batches(
+    collection: Collection, query: dict, batch_size: int
+) -> Generator[int, None, None]:
+    """Delete matching documents a batch at a time, yielding the size of each batch"""
+    while True:
+        ids = [doc['_id'] for doc in collection.find(query, {'_id': 1}, limit=batch_size)]
+        if not ids:
+            return
+        yield collection.delete_many({'_id': {'$in': ids}}).deleted_count
+
+
+def delete_annotations(datasetId: ObjectId, batch_size=1000) -> dict:
+    """Remove every annotation record and revision of a dataset, in batches"""
+    for clone in RevisionHeadItem().clones({'_id': datasetId}):
+        materialize_base({'_id': clone[DATASET]})
+    removed = {}
+    for model in (
+        TrackItem(),
+        TrackChunkItem(),
+        GroupItem(),
+        RevisionLogItem(),
+        RevisionHeadItem(),
+        LabelSummaryItem(),
+    ):
+        query = {DATASET: datasetId}
+        removed[model.name] = sum(_delete_in_batches(model.collection, query, batch_size))
+    return removed
+
+
+def compact_annotations(
+    dsFolder: types.GirderModel,
+    keep_revisions: Optional[int] = None,
+    keep_days: Optional[float] = None,
+    batch_size=1000,
+    progress: Optional[Callable[[int], None]] = None,
+) -> dict:
+    """
+    Physically delete track and group versions that no retained revision can read.
+
+    Revisions older than the retention point stop being readable before anything is
+    deleted, and every batch is an idempotent delete, so an interrupted compaction
+    is resumed by running it again.
+    """
+    retain_from = retention_revision(dsFolder, keep_revisions, keep_days)
+    # Clones read their base revision, so it must stay readable
+    for clone in RevisionHeadItem().clones(dsFolder):
+        retain_from = min(retain_from, clone[BASE_REVISION])
+    RevisionHeadItem().compact(dsFolder, retain_from)
+    dead_query = {
+        DATASET: dsFolder['_id'],
+        REVISION_DELETED: {'$lte': retain_from},
+        # Masks hide base records of a clone for as long as the clone exists
+        MASK: {'$exists': False},
+    }
+    stats = {'retainFrom': retain_from, 'tracksRemoved': 0, 'chunksRemoved': 0, 'groupsRemoved': 0}
+    for model, key in (
+        (TrackItem(), 'tracksRemoved'),
+        (TrackChunkItem(), 'chunksRemoved'),
+        (GroupItem(), 'groupsRemoved'),
+    ):
+        for removed in _delete_in_batches(model.collection, dead_query, batch_size):
+            stats[key] += removed
+            if progress:
+                progress(stats['tracksRemoved'] + stats['chunksRemoved'] + stats['groupsRemoved'])
+    stats['revisionsSquashed'] = _squash_revision_log(dsFolder, retain_from)
+    return stats
+
+
+def compaction_job(job: types.GirderModel):
+    """Run compact_annotations for a local job created by crud_rpc.compact_annotations"""
+    params = job['kwargs']
+    dsFolder = Folder().load(params['folderId'], force=True)
+    job = Job().updateJob(
+        job,
+        log=f'Compacting annotation history of {dsFolder["name"]}\n',
+        status=JobStatus.RUNNING,
+    )
+
+    def progress(removed: int):
+        Job().updateJob(job, progressMessage=f'Removed {removed} superseded annotations')
+
+    try:
+        stats = compact_annotations(
+            dsFolder,
+            keep_revisions=params.get('keepRevisions'),
+            keep_days=params.get('keepDays'),
+            progress=progress,
+        )
+    except Exception as err:
+        Job().updateJob(job, log=f'Compaction failed: {err}\n', status=JobStatus.ERROR)
+        raise
+    Job().updateJob(
+        job,
+        log=(
+            f'Kept revisions from {stats["retainFrom"]}. '
+            f'Removed {stats["tracksRemoved"]} track and {stats["groupsRemoved"]} group '
+            f'versions, squashed {stats["revisionsSquashed"]} revision log entries.\n'
+        ),
+        status=JobStatus.SUCCESS,
+        otherFields={'compaction': stats},
+    )
 
 
 def get_annotation_csv_generator(
@@ -174,8 +1660,11 @@ def get_annotation_csv_generator(
     thresholds = fromMeta(folder, "confidenceFilters", {})
     datasetInfo = fromMeta(folder, "datasetInfo", {})
 
+    # Tracks without any pair the export keeps are not read at all
+    filters = TrackItem.confidence_filter(thresholds if excludeBelowThreshold else None, typeFilter)
+
     def downloadGenerator():
-        datalist = TrackItem().list(folder, revision=revision)
+        datalist = TrackItem().list(folder, revision=revision, filters=filters)
         for data in viame.export_tracks_as_csv(
             datalist,
             excludeBelowThreshold,
@@ -185,6 +1674,7 @@ def get_annotation_csv_generator(
             typeFilter=typeFilter,
             revision=revision,
             datasetInfo=datasetInfo,
+            trusted=True,
         ):
             yield data
 
@@ -211,82 +1701,199 @@ class AnnotationUpdateArgs(BaseModel):
         extra = 'ignore'
 
 
-def save_annotations(
-    dsFolder: types.GirderModel,
-    user: types.GirderUserModel,
-    upsert_tracks: Optional[Iterable[dict]] = None,
-    delete_tracks: Optional[Iterable[int]] = None,
-    upsert_groups: Optional[Iterable[dict]] = None,
-    delete_groups: Optional[Iterable[int]] = None,
-    description="save",
-    overwrite=False,
-    set='',
-):
+# Seconds a writer waits for another writer to release the lease, and between attempts
+WRITE_LEASE_WAIT = 10.0
+WRITE_LEASE_POLL = 0.1
+
+
+def acquire_write_lease(dsFolder: types.GirderModel) -> ObjectId:
+    """
+    Take the write lease of dsFolder, waiting up to WRITE_LEASE_WAIT seconds for the
+    current writer.  What a writer whose lease expired left above the head is removed
+    before the new writer reads anything.
+    """
+    heads = RevisionHeadItem()
+    deadline = time.monotonic() + WRITE_LEASE_WAIT
+    lease = heads.acquire(dsFolder, write_lease_seconds())
+    while lease is None:
+        if time.monotonic() >= deadline:
+            raise RestException(
+                'Annotations are being saved by another user or job, try again', code=409
+            )
+        time.sleep(WRITE_LEASE_POLL)
+        lease = heads.acquire(dsFolder, write_lease_seconds())
+    state = heads.get(dsFolder)
+    if state.get(ALLOCATED, 0) > state.get(HEAD, 0):
+        _discard_unpublished(dsFolder, state[HEAD])
+    return lease
+
+
+def _discard_unpublished(dsFolder: types.GirderModel, head: int):
+    """Remove the records and log entries of revisions above head that were never published"""
+    query = {DATASET: dsFolder['_id']}
+    for model in (TrackItem(), TrackChunkItem(), GroupItem()):
+        model.collection.delete_many({**query, REVISION_CREATED: {'$gt': head}})
+        model.collection.update_many(
+            {**query, REVISION_DELETED: {'$gt': head}}, {'$unset': {REVISION_DELETED: ''}}
+        )
+    logged = RevisionLogItem().collection.delete_many({**query, REVISION: {'$gt': head}})
+    if logged.deleted_count:
+        # The writer may have counted its labels before it lost the lease
+        LabelSummaryItem().recount(dsFolder)
+
+
+class RevisionWrite:
     """
+    One revision written by one or more saves, then published by commit.
+
     Annotations are lazy-deleted by marking their staleness property as true.
+    Upserts whose content hash matches the live record are skipped, so saves that
+    change nothing write nothing and leave no revision.  The revision number is
+    allocated by the first save that changes something; readers only see the
+    revision once it is committed, and abort removes what its saves wrote.  The
+    dataset's write lease is held from the first save to commit or abort, which
+    release it.
     """
-    datasetId = dsFolder['_id']
-    new_revision = RevisionLogItem().latest(dsFolder) + 1
-    delete_annotation_update = {'$set': {REVISION_DELETED: new_revision}}
 
-    if upsert_tracks is None:
-        upsert_tracks = []
-    if upsert_groups is None:
-        upsert_groups = []
-    if delete_tracks is None:
-        delete_tracks = []
-    if delete_groups is None:
-        delete_groups = []
+    def __init__(
+        self,
+        dsFolder: types.GirderModel,
+        user: types.GirderUserModel,
+        description="save",
+        overwrite=False,
+        set='',
+    ):
+        self.dsFolder = dsFolder
+        self.user = user
+        self.description = description
+        self.overwrite = overwrite
+        self.set = set
+        # Saves to the main set must not expire the records of other sets
+        self.live_filter: dict = {
+            DATASET: dsFolder['_id'],
+            SET: set or None,
+            REVISION_DELETED: {'$exists': False},
+        }
+        self.is_clone = not set and RevisionHeadItem().get(dsFolder).get(BASE_DATASET) is not None
+        self.revision: Optional[int] = None
+        # Statistics at the revision so far, None when they are counted in full on commit
+        self.stats: Optional[dict] = None
+        self.labels: Dict[Tuple[Optional[str], str], int] = {}
+        self.additions = 0
+        self.deletions = 0
+        self.lease: Optional[ObjectId] = None
+        # How far commit got, so that abort undoes only what was done
+        self.logged = False
+        self.labeled = False
+        self.committed = False
+
+    def hold(self):
+        """Take the write lease on the first call, and renew it on later ones"""
+        if self.lease is None:
+            self.lease = acquire_write_lease(self.dsFolder)
+        else:
+            RevisionHeadItem().renew(self.dsFolder, self.lease, write_lease_seconds())
+
+    def release(self):
+        if self.lease is not None:
+            RevisionHeadItem().release(self.dsFolder, self.lease)
+            self.lease = None
+
+    def plan(
+        self, collection: crud.PydanticModel, upsert_list: List[dict], delete_list: List[int]
+    ) -> Tuple[List[dict], List[int], List[int], Dict[int, dict]]:
+        """
+        Find the changed upserts, the live ids to delete, which of those are only
+        live in the base dataset of a clone, and the live versions.  Versions of the
+        dataset's own records keep their _id, which update_collection expires.
+        """
+        for record in upsert_list:
+            record[HASH] = content_hash(record)
+        query = dict(self.live_filter)
+        ids: dict = {}
+        if not self.overwrite:
+            ids = {IDENTIFIER: {'$in': [r[IDENTIFIER] for r in upsert_list] + delete_list}}
+            query.update(ids)
+        fields = {
+            IDENTIFIER: 1,
+            HASH: 1,
+            CONFIDENCE_PAIRS: 1,
+            BEGIN: 1,
+            END: 1,
+            DETECTIONS: 1,
+        }
+        stored = {doc[IDENTIFIER]: doc for doc in collection.collection.find(query, fields)}
+        from_base = {}
+        base = collection.base_layer(self.dsFolder, None, self.set)
+        if base is not None:
+            base_folder, base_revision, unreplaced = base
+            from_base = {
+                record[IDENTIFIER]: record
+                for record in unreplaced(
+                    collection.list(base_folder, revision=base_revision, filters=ids, fields=fields)
+                )
+            }
+            for record in from_base.values():
+                # Base records are masked, never expired
+                record.pop('_id', None)
+            stored.update(from_base)
+        hashes = {id: doc.get(HASH) for id, doc in stored.items()}
+        changed = [r for r in upsert_list if hashes.get(r[IDENTIFIER]) != r[HASH]]
+        if self.overwrite:
+            kept = {r[IDENTIFIER] for r in upsert_list}
+            deleted = [id for id in stored if id not in kept]
+        else:
+            deleted = [id for id in delete_list if id in stored]
+        base_only = [id for id in deleted if id in from_base]
+        return changed, deleted, base_only, stored
 
     def update_collection(
+        self,
         collection: crud.PydanticModel,
         upsert_list: Iterable[dict],
         delete_list: Iterable[int],
-        set: Optional[str] = None,
+        stored: Dict[int, dict],
     ):
+        """
+        Expire the live versions plan() read of the deleted and upserted ids and insert
+        the upserts.  Each version is expired by its _id only while it is still live, so
+        a version another writer expired or replaced since it was read fails the save
+        instead of leaving two live versions of an id.
+        """
+        delete_annotation_update = {'$set': {REVISION_DELETED: self.revision}}
         expire_operations = []  # Mark existing records as deleted
         expire_result = {}
         insert_operations = []  # Insert new records
         insert_result = {}
 
-        if overwrite:
-            query = {DATASET: datasetId, REVISION_DELETED: {'$exists': False}}
-            if set:
-                query[SET] = set
-            expire_result = collection.collection.bulk_write(
-                [pymongo.UpdateMany(query, delete_annotation_update)]
-            ).bulk_api_result
+        def expire(id: int):
+            # Versions only live in the base dataset of a clone are masked instead
+            version = stored.get(id)
+            if version is not None and '_id' in version:
+                filter = {'_id': version['_id'], REVISION_DELETED: {'$exists': False}}
+                expire_operations.append(pymongo.UpdateOne(filter, delete_annotation_update))
 
         for id in delete_list:
-            filter = {IDENTIFIER: id, DATASET: datasetId, REVISION_DELETED: {'$exists': False}}
-            if set:
-                filter[SET] = set
-            # UpdateMany for safety, UpdateOne would also work
-            expire_operations.append(pymongo.UpdateMany(filter, delete_annotation_update))
+            expire(id)
 
         for newdict in upsert_list:
-            update_dict = {DATASET: datasetId, REVISION_CREATED: new_revision}
-            if set:
-                update_dict[SET] = set
+            update_dict = {DATASET: self.dsFolder['_id'], REVISION_CREATED: self.revision}
+            if self.set:
+                update_dict[SET] = self.set
             newdict.update(update_dict)
             newdict.pop(REVISION_DELETED, None)
-            filter = {
-                IDENTIFIER: newdict[IDENTIFIER],
-                DATASET: datasetId,
-                REVISION_DELETED: {'$exists': False},
-            }
-            if set:
-                filter[SET] = set
-            if not overwrite:
-                # UpdateMany for safety, UpdateOne would also work
-                expire_operations.append(pymongo.UpdateMany(filter, delete_annotation_update))
-            insert_operations.append(pymongo.InsertOne(newdict))
+            expire(newdict[IDENTIFIER])
+            insert_operations.append(pymongo.InsertOne(collection.encode(newdict)))
 
         # Ordered=false allows fast parallel writes
         if len(expire_operations):
             expire_result = collection.collection.bulk_write(
                 expire_operations, ordered=False
             ).bulk_api_result
+            if expire_result.get('nModified', 0) != len(expire_operations):
+                raise RestException(
+                    'Annotations were changed by another writer, try again', code=409
+                )
         if len(insert_operations):
             insert_result = collection.collection.bulk_write(
                 insert_operations, ordered=False
@@ -296,30 +1903,182 @@ def save_annotations(
         deletions = expire_result.get('nModified', 0)
         return additions, deletions
 
-    track_additions, track_deletions = update_collection(
-        TrackItem(), upsert_tracks, delete_tracks, set
-    )
-    group_additions, group_deletions = update_collection(
-        GroupItem(), upsert_groups, delete_groups, set
-    )
-    additions = track_additions + group_additions
-    deletions = track_deletions + group_deletions
-
-    if additions or deletions:
-        # Write the revision to the log
-        log_entry = models.RevisionLog(
-            dataset=datasetId,
-            author_name=user['login'],
-            author_id=user['_id'],
-            revision=new_revision,
-            additions=additions,
-            deletions=deletions,
-            description=description,
-            set=set,
+    def mask_base(self, collection: crud.PydanticModel, deleted: List[int], base_only: List[int]):
+        """
+        Hide the base dataset's version of ids deleted in a clone.  Every deletion is
+        masked, because the clone's own tombstones may later be compacted away.
+        """
+        if not self.is_clone or not deleted:
+            return 0
+        mask = {
+            DATASET: self.dsFolder['_id'],
+            REVISION_CREATED: self.revision,
+            REVISION_DELETED: self.revision,
+        }
+        collection.collection.insert_many([{**mask, IDENTIFIER: id, MASK: True} for id in deleted])
+        return len(base_only)
+
+    def save(
+        self,
+        upsert_tracks: Optional[Iterable[dict]] = None,
+        delete_tracks: Optional[Iterable[int]] = None,
+        upsert_groups: Optional[Iterable[dict]] = None,
+        delete_groups: Optional[Iterable[int]] = None,
+    ):
+        """Write annotations to the revision.  An id may only be saved once per revision."""
+        if self.overwrite and self.revision is not None:
+            raise ValueError('An overwriting revision is written by a single save')
+        dsFolder = self.dsFolder
+        set = self.set
+        upsert_tracks = list(upsert_tracks or [])
+        upsert_groups = list(upsert_groups or [])
+        delete_tracks = list(delete_tracks or [])
+        delete_groups = list(delete_groups or [])
+
+        self.hold()
+        changed_tracks, deleted_tracks, base_tracks, live_tracks = self.plan(
+            TrackItem(), upsert_tracks, delete_tracks
+        )
+        changed_groups, deleted_groups, base_groups, live_groups = self.plan(
+            GroupItem(), upsert_groups, delete_groups
+        )
+        if not (changed_tracks or deleted_tracks or changed_groups or deleted_groups):
+            return
+
+        if self.revision is None:
+            previous_entry = RevisionLogItem().latest_entry(dsFolder, set)
+            if previous_entry is not None:
+                self.stats = previous_entry.get(STATS)
+            elif not self.is_clone:
+                self.stats = models.AnnotationStats().dict()
+        replaced = [live_tracks[id] for id in deleted_tracks]
+        replaced += [
+            live_tracks[t[IDENTIFIER]] for t in changed_tracks if t[IDENTIFIER] in live_tracks
+        ]
+        uncounted = [track[IDENTIFIER] for track in replaced if DETECTIONS not in track]
+        if self.stats is not None and uncounted:
+            # Tracks saved before feature counts were stored
+            detections = {
+                track[IDENTIFIER]: len(track.get('features') or [])
+                for track in TrackItem().list(
+                    dsFolder, set=set, filters={IDENTIFIER: {'$in': uncounted}}
+                )
+            }
+            for track in replaced:
+                track.setdefault(DETECTIONS, detections.get(track[IDENTIFIER], 0))
+
+        if self.revision is None:
+            # Revisions allocated by saves that fail are never committed, so the
+            # committed revision numbers may have gaps
+            self.revision = RevisionHeadItem().allocate(dsFolder)
+
+        span = chunk_frames()
+        chunked: Dict[int, List[dict]] = {}
+        headers = []
+        for track in changed_tracks:
+            track[DETECTIONS] = len(track.get('features') or [])
+            header, chunks = split_track(track, span)
+            headers.append(header)
+            if chunks:
+                chunked[header[IDENTIFIER]] = chunks
+
+        track_additions, track_deletions = self.update_collection(
+            TrackItem(), headers, deleted_tracks, live_tracks
+        )
+        track_deletions += self.mask_base(TrackItem(), deleted_tracks, base_tracks)
+        unchunked = [track[IDENTIFIER] for track in headers if not track.get(CHUNKED)]
+        _update_chunks(dsFolder['_id'], self.revision, chunked, unchunked + deleted_tracks, set)
+        group_additions, group_deletions = self.update_collection(
+            GroupItem(), changed_groups, deleted_groups, live_groups
         )
-        RevisionLogItem().create(log_entry)
+        group_deletions += self.mask_base(GroupItem(), deleted_groups, base_groups)
+
+        for tracks, change in ((replaced, -1), (changed_tracks, 1)):
+            for track in tracks:
+                label = top_label(track.get(CONFIDENCE_PAIRS))
+                if label is not None:
+                    key = (set or None, label)
+                    self.labels[key] = self.labels.get(key, 0) + change
+        additions = track_additions + group_additions
+        deletions = track_deletions + group_deletions
+        if (additions or deletions) and self.stats is not None:
+            self.stats = next_stats(
+                dsFolder, self.revision, set, self.stats, replaced, changed_tracks
+            )
+        self.additions += additions
+        self.deletions += deletions
+
+    def abort(self):
+        """Remove what the saves wrote, leaving the revision number unused"""
+        if self.revision is not None and not self.committed:
+            query = {DATASET: self.dsFolder['_id']}
+            for model in (TrackItem(), TrackChunkItem(), GroupItem()):
+                model.collection.delete_many({**query, REVISION_CREATED: self.revision})
+                model.collection.update_many(
+                    {**query, REVISION_DELETED: self.revision}, {'$unset': {REVISION_DELETED: ''}}
+                )
+            if self.logged:
+                RevisionLogItem().collection.delete_many({**query, REVISION: self.revision})
+            if self.labeled:
+                LabelSummaryItem().recount(self.dsFolder)
+        self.release()
 
-    return {"updated": additions, "deleted": deletions}
+    def commit(self) -> dict:
+        """Log the revision, publish it to readers and release the write lease"""
+        dsFolder = self.dsFolder
+        if self.revision is not None and (self.additions or self.deletions):
+            self.hold()
+            stats = self.stats
+            if stats is None:
+                stats = annotation_stats(dsFolder, self.revision, self.set)
+            # Write the revision to the log
+            log_entry = models.RevisionLog(
+                dataset=dsFolder['_id'],
+                author_name=self.user['login'],
+                author_id=self.user['_id'],
+                revision=self.revision,
+                additions=self.additions,
+                deletions=self.deletions,
+                description=self.description,
+                set=self.set,
+                stats=stats,
+            )
+            RevisionLogItem().create(log_entry)
+            self.logged = True
+            LabelSummaryItem().add(dsFolder, self.labels)
+            self.labeled = True
+            RevisionHeadItem().commit(dsFolder, self.revision, self.set, self.lease)
+            self.committed = True
+
+            interval = snapshot_interval()
+            if interval:
+                snapshots = RevisionHeadItem().get(dsFolder).get(SNAPSHOTS) or [0]
+                if self.revision - max(snapshots) >= interval:
+                    take_snapshot(dsFolder, self.revision)
+
+        self.release()
+        return {"updated": self.additions, "deleted": self.deletions}
+
+
+def save_annotations(
+    dsFolder: types.GirderModel,
+    user: types.GirderUserModel,
+    upsert_tracks: Optional[Iterable[dict]] = None,
+    delete_tracks: Optional[Iterable[int]] = None,
+    upsert_groups: Optional[Iterable[dict]] = None,
+    delete_groups: Optional[Iterable[int]] = None,
+    description="save",
+    overwrite=False,
+    set='',
+):
+    """Save annotations as a new revision, see RevisionWrite"""
+    write = RevisionWrite(dsFolder, user, description=description, overwrite=overwrite, set=set)
+    try:
+        write.save(upsert_tracks, delete_tracks, upsert_groups, delete_groups)
+        return write.commit()
+    except Exception:
+        write.abort()
+        raise
 
 
 def clone_annotations(
@@ -328,37 +2087,149 @@ def clone_annotations(
     user: types.GirderUserModel,
     revision: Optional[int] = None,
 ):
-    track_iter = TrackItem().list(source, revision=revision)
-    group_iter = GroupItem().list(source, revision=revision)
-    save_annotations(
-        dest,
-        user,
-        upsert_tracks=track_iter,
-        upsert_groups=group_iter,
-        description="initialize clone",
-    )
+    """
+    Make dest a copy-on-write clone of source at revision (default head).
+
+    Nothing is copied: dest reads the records of source at that revision until it
+    replaces or deletes them, and only its own edits are stored.
+    """
+    heads = RevisionHeadItem()
+    if revision is None:
+        revision = heads.head(source)
+    heads.require_readable(source, revision)
+    heads.set_base(dest, source, revision)
+    source_state = heads.get(source)
+    if source_state.get(LABELS_COUNTED) and revision == source_state[HEAD]:
+        LabelSummaryItem().copy(source, dest)
+
+
+def materialize_base(dsFolder: types.GirderModel):
+    """
+    Copy the base records a clone still reads into the clone itself, and detach it.
+
+    Copies are created at revision 0, expire at the first revision of the clone that
+    replaced them, and belong to the clone's snapshots taken while they were live, so
+    every revision of the clone reads the same as before.
+    """
+    heads = RevisionHeadItem()
+    base = heads.get(dsFolder)
+    if base.get(BASE_DATASET) is None:
+        return
+    lease = acquire_write_lease(dsFolder)
+    try:
+        # Read the snapshots again now that no writer can add one
+        base = heads.get(dsFolder)
+        base_folder = {'_id': base[BASE_DATASET]}
+        snapshots = sorted(base.get(SNAPSHOTS) or [])
+
+        def copied(record: dict, id: int, replaced: Dict[Any, int]) -> dict:
+            record.update({DATASET: dsFolder['_id'], REVISION_CREATED: 0})
+            expired = replaced.get(id)
+            if expired is not None:
+                record[REVISION_DELETED] = expired
+            members = [snapshot for snapshot in snapshots if expired is None or expired > snapshot]
+            if members:
+                record[SNAPSHOT] = members
+            return record
+
+        for model, chunked in ((TrackItem(), True), (GroupItem(), False)):
+            replaced: Dict[Any, int] = {}
+            for record in model.collection.find(
+                {DATASET: dsFolder['_id'], SET: None}, {IDENTIFIER: 1, REVISION_CREATED: 1}
+            ):
+                id = record[IDENTIFIER]
+                replaced[id] = min(
+                    replaced.get(id, record[REVISION_CREATED]), record[REVISION_CREATED]
+                )
+            span = chunk_frames()
+            operations: List[Any] = []
+            chunks: Dict[int, List[dict]] = {}
+            for record in model.list(base_folder, revision=base[BASE_REVISION]):
+                record[HASH] = content_hash(record)
+                record = copied(record, record[IDENTIFIER], replaced)
+                if chunked:
+                    record, chunks[record[IDENTIFIER]] = split_track(record, span)
+                operations.append(pymongo.InsertOne(model.encode(record)))
+            if operations:
+                model.collection.bulk_write(operations, ordered=False)
+            chunk_model = TrackChunkItem()
+            chunk_operations = []
+            for id, track_chunks in chunks.items():
+                for chunk in track_chunks:
+                    chunk = copied(chunk, id, replaced)
+                    chunk_operations.append(pymongo.InsertOne(chunk_model.encode(chunk)))
+            if chunk_operations:
+                chunk_model.collection.bulk_write(chunk_operations, ordered=False)
+        heads.clear_base(dsFolder)
+    finally:
+        heads.release(dsFolder, lease)
+
+
+def iter_tracks(
+    dataset: types.GirderModel,
+    revision: Optional[int] = None,
+    filters: Optional[dict] = None,
+    fields: Optional[dict] = None,
+) -> Generator[dict, None, None]:
+    """Stream the tracks of the DIVE json annotation file that match filters"""
+    for t in TrackItem().list(dataset, revision=revision, filters=filters, fields=fields):
+        yield dive.serialize_track(t)
+
+
+def iter_groups(
+    dataset: types.GirderModel, revision: Optional[int] = None
+) -> Generator[dict, None, None]:
+    """Stream the groups of the DIVE json annotation file"""
+    for g in GroupItem().list(dataset, revision=revision):
+        yield dive.serialize_group(g)
+
+
+def get_tracks(
+    dataset: types.GirderModel, revision: Optional[int] = None, filters: Optional[dict] = None
+) -> Dict[int, dict]:
+    """Get the tracks of the DIVE json annotation file that match filters, by id"""
+    return {track['id']: track for track in iter_tracks(dataset, revision, filters)}
 
 
 def get_annotations(
     dataset: types.GirderModel, revision: Optional[int] = None, set: Optional[str] = None
 ):
     """Get the DIVE json annotation file as a dict"""
-    tracks = TrackItem().list(dataset, revision=revision)
-    groups = GroupItem().list(dataset, revision=revision)
     annotations: types.DIVEAnnotationSchema = {
-        'tracks': {},
-        'groups': {},
+        'tracks': get_tracks(dataset, revision=revision),
+        'groups': {group['id']: group for group in iter_groups(dataset, revision)},
         'version': constants.AnnotationsCurrentVersion,
     }
-    for t in tracks:
-        serialized = models.Track(**t).dict(exclude_none=True)
-        annotations['tracks'][serialized['id']] = serialized
-    for g in groups:
-        serialized = models.Group(**g).dict(exclude_none=True)
-        annotations['groups'][serialized['id']] = serialized
     return annotations
 
 
+def get_changes(dataset: types.GirderModel, since: int, set: Optional[str] = None) -> dict:
+    """
+    Annotation changes after revision since, for clients that already hold that revision.
+
+    Pass the returned revision as since on the next call to keep polling.
+    """
+    heads = RevisionHeadItem()
+    heads.require_readable(dataset, since)
+    head = heads.head(dataset)
+    changes: dict = {
+        'since': since,
+        'revision': head,
+        'tracks': {'upserted': [], 'deleted': []},
+        'groups': {'upserted': [], 'deleted': []},
+    }
+    if since >= head:
+        return changes
+    for key, model, serialize in [
+        ('tracks', TrackItem(), dive.serialize_track),
+        ('groups', GroupItem(), dive.serialize_group),
+    ]:
+        upserted, deleted = model.changes(dataset, since, head, set)
+        changes[key]['upserted'] = [serialize(doc) for doc in upserted]
+        changes[key]['deleted'] = deleted
+    return changes
+
+
 def add_annotations(
     dataset: types.GirderModel,
     new_tracks: dict,
@@ -374,7 +2245,7 @@ def add_annotations(
     }
     max_track_id = -1
     for t in tracks:
-        serialized = models.Track(**t).dict(exclude_none=True)
+        serialized = dive.serialize_track(t)
         annotations['tracks'][serialized['id']] = serialized
         max_track_id = max(max_track_id, serialized['id'])
     # Now add in the new tracks while renaming them
@@ -393,89 +2264,75 @@ def add_annotations(
     return annotations['tracks']
 
 
+def count_legacy_labels(limit=0, batch_size=1000, dry_run=False) -> List[ObjectId]:
+    """
+    Count the labels of datasets saved before label summaries existed, at most limit
+    of them when limit is set.  Counted datasets are skipped, so it can be run again.
+    """
+    query = {f'meta.{constants.DatasetMarker}': {'$in': TRUTHY_META_VALUES}}
+    cursor = iter(Folder().find(query, fields=['_id'], sort=[('_id', pymongo.ASCENDING)]))
+    counted: List[ObjectId] = []
+    while True:
+        batch = [folder['_id'] for folder in itertools.islice(cursor, batch_size)]
+        if not batch:
+            return counted
+        done = frozenset(RevisionHeadItem().labels_counted(batch))
+        for dataset_id in batch:
+            if dataset_id in done:
+                continue
+            if limit and len(counted) == limit:
+                return counted
+            if not dry_run:
+                LabelSummaryItem().recount({'_id': dataset_id})
+            counted.append(dataset_id)
+
+
 def get_labels(user: types.GirderUserModel, published=False, shared=False):
     """Find raw highest-score confidence-pair labels in datasets visible to ``user``.
 
-    This aggregation intentionally does not resolve type hierarchies.  Resolved display
-    types depend on each viewer's checked types and confidence thresholds, neither of
-    which the server has.  The aggregation chooses the maximum raw score while keeping
-    the first stored pair when scores tie.
+    Labels come from the per-dataset counts in LabelSummaryItem.  They intentionally do
+    not resolve type hierarchies.  Resolved display types depend on each viewer's
+    checked types and confidence thresholds, neither of which the server has.  The
+    label of a track is its maximum raw score, keeping the first stored pair when
+    scores tie.
     """
     accessLevel = AccessType.WRITE
     if published or shared:
         accessLevel = AccessType.READ
+    query = crud_dataset.get_dataset_query(
+        user, published=published, shared=shared, level=accessLevel
+    )
     pipeline = [
+        # Begin query by selecting datasets
+        {'$match': query},
+        # Datasets saved before label summaries existed are left out until the
+        # migration, see count_legacy_labels, has counted them
         {
-            # Begin query by selecting datasets
-            '$match': crud_dataset.get_dataset_query(
-                user, published=published, shared=shared, level=accessLevel
-            )
+            '$lookup': {
+                'from': 'revisionHeadItem',
+                'localField': '_id',
+                'foreignField': DATASET,
+                'as': 'head',
+            },
         },
+        {'$match': {'head': {'$elemMatch': {SET: None, LABELS_COUNTED: True}}}},
         {
-            # Left join to get annotationItems for all datasets
+            # Left join to get the label counts of every set of each dataset
             '$lookup': {
-                'from': 'trackItem',
-                # Map the foreign key _id to dataset_id in the query
-                'let': {'dataset_id': '$_id'},
-                # Create a new field 'label' for each annotation
+                'from': 'labelSummaryItem',
+                'localField': '_id',
+                'foreignField': DATASET,
                 'as': 'label',
-                'pipeline': [
-                    {'$match': {'$expr': {'$eq': ['$dataset', '$$dataset_id']}}},
-                    {'$match': {'$expr': {'$eq': [{'$type': "$rev_deleted"}, 'missing']}}},
-                    # Select the confidencePairs, which is the only field needed
-                    {'$project': {'confidencePairs': 1}},
-                    # Preserve the raw highest-score pair.  Do not resolve hierarchy here:
-                    # resolved display types are viewer-specific (checked types/thresholds).
-                    # A strict comparison keeps the first stored pair when scores tie.
-                    {
-                        '$set': {
-                            'confidencePairs': {
-                                '$reduce': {
-                                    'input': '$confidencePairs',
-                                    'initialValue': [],
-                                    'in': {
-                                        '$cond': [
-                                            {
-                                                '$or': [
-                                                    {'$eq': [{'$size': '$$value'}, 0]},
-                                                    {
-                                                        '$gt': [
-                                                            {'$arrayElemAt': ['$$this', 1]},
-                                                            {'$arrayElemAt': ['$$value', 1]},
-                                                        ]
-                                                    },
-                                                ]
-                                            },
-                                            '$$this',
-                                            '$$value',
-                                        ],
-                                    },
-                                },
-                            }
-                        }
-                    },
-                    # Reduce returns the winning [type, score] pair.  Library labels are
-                    # strings, so project the pair back to its raw type name before grouping.
-                    {'$set': {'confidencePairs': {'$arrayElemAt': ['$confidencePairs', 0]}}},
-                    # Imported empty vectors have no raw label and must not create a null
-                    # Library row.  The public label API guarantees string identifiers.
-                    {'$match': {'$expr': {'$eq': [{'$type': '$confidencePairs'}, 'string']}}},
-                ],
             },
         },
-        # after the lookup, label will be an array of strings on each dataset.
-        # unwind to duplicate N records in the query for N labels.
+        # unwind to duplicate N records in the query for N label counts.
         {'$unwind': '$label'},
-        # Preserve properties of dataset by moving them into a sub-object.
-        {'$set': {'dataset': {'id': '$_id', 'name': '$name'}}},
-        # Drop unwanted fields.
-        {'$project': {'label.confidencePairs': 1, '_id': 1, 'dataset': 1}},
         # Group records by label values
         {
             '$group': {
-                '_id': '$label.confidencePairs',
-                'count': {'$count': {}},
-                'datasets': {'$addToSet': '$dataset'},
+                '_id': '$label.label',
+                'count': {'$sum': '$label.count'},
+                'datasets': {'$addToSet': {'id': '$_id', 'name': '$name'}},
             }
         },
         {'$sort': {'_id': 1}},
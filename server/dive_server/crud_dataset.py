@@ -1,7 +1,20 @@
 import copy
 import json
 from pathlib import Path
-from typing import Any, Dict, Generator, Iterable, List, Literal, Optional, Set, Tuple, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 from bson.objectid import InvalidId, ObjectId
 import cherrypy
@@ -221,9 +234,38 @@ def list_datasets(
     limit: int,
     offset: int,
     sortParams: Tuple[Tuple[str, int]],
+    annotationStats: bool = False,
 ):
-    """Enumerate all public and private data the user can access"""
+    """
+    Enumerate all public and private data the user can access
+
+    annotationStats adds the statistics logged with the newest revision of each
+    dataset's main annotation set, when that revision has them.
+    """
     sort, sortDir = (sortParams or [['created', 1]])[0]
+    stats_lookup = []
+    if annotationStats:
+        stats_lookup = [
+            {
+                '$lookup': {
+                    'from': 'revisionLogItem',
+                    'let': {'dataset': '$_id'},
+                    'pipeline': [
+                        {
+                            '$match': {
+                                '$expr': {'$eq': ['$dataset', '$$dataset']},
+                                'set': {'$in': [None, '']},
+                            }
+                        },
+                        {'$sort': {'revision': -1}},
+                        {'$limit': 1},
+                        {'$project': {'_id': 0, 'stats': 1}},
+                    ],
+                    'as': 'annotationStats',
+                },
+            },
+            {'$set': {'annotationStats': {'$first': '$annotationStats.stats'}}},
+        ]
     # based on https://stackoverflow.com/a/49483919
     pipeline = [
         {'$match': get_dataset_query(user, published, shared)},
@@ -243,6 +285,7 @@ def list_datasets(
                     },
                     {'$set': {'ownerLogin': {'$first': '$ownerLogin'}}},
                     {'$set': {'ownerLogin': '$ownerLogin.login'}},
+                    *stats_lookup,
                 ],
                 'totalCount': [{'$count': 'count'}],
             },
@@ -251,7 +294,8 @@ def list_datasets(
     response = next(Folder().collection.aggregate(pipeline))
     total = response['totalCount'][0]['count'] if len(response['results']) > 0 else 0
     cherrypy.response.headers['Girder-Total-Count'] = total
-    return [Folder().filter(doc, additionalKeys=['ownerLogin']) for doc in response['results']]
+    additionalKeys = ['ownerLogin', 'annotationStats'] if annotationStats else ['ownerLogin']
+    return [Folder().filter(doc, additionalKeys=additionalKeys) for doc in response['results']]
 
 
 def _multicam_camera_order(multi_cam: dict) -> List[str]:
@@ -762,73 +806,153 @@ def _filtered_annotation_tracks(
     typeFilter: Iterable[str],
 ) -> dict:
     """Return track dict for export after threshold and type filtering."""
-    annotations = crud_annotation.get_annotations(dsFolder, revision=revision)
-    tracks = annotations['tracks']
     thresholds = fromMeta(dsFolder, "confidenceFilters", {}) if excludeBelowThreshold else {}
-    default_threshold = thresholds.get('default', 0)
+    tracks = crud_annotation.get_tracks(
+        dsFolder,
+        revision=revision,
+        filters=_export_filter(thresholds, excludeBelowThreshold, typeFilter),
+    )
     updated_tracks = {}
     for track_id in tracks:
-        track = models.Track(**tracks[track_id])
-        confidence_pairs = track.confidencePairs
-        if excludeBelowThreshold:
-            confidence_pairs = [
-                pair
-                for pair in confidence_pairs
-                if pair[1] >= thresholds.get(pair[0], default_threshold)
-            ]
-        if typeFilter:
-            confidence_pairs = [pair for pair in confidence_pairs if pair[0] in typeFilter]
-        if not confidence_pairs:
-            continue
-        if excludeBelowThreshold or typeFilter:
-            # Filters select raw stored evidence.  Copy before pruning so an export
-            # never mutates the stored track or leaks removed pairs into its output.
-            exported_track = dict(tracks[track_id])
-            exported_track['confidencePairs'] = [list(pair) for pair in confidence_pairs]
+        exported_track = _export_track(
+            tracks[track_id], thresholds, excludeBelowThreshold, typeFilter
+        )
+        if exported_track is not None:
             updated_tracks[track_id] = exported_track
-        else:
-            updated_tracks[track_id] = tracks[track_id]
     return updated_tracks
 
 
-def _dive_json_export_text(
+def _export_filter(
+    thresholds: dict, excludeBelowThreshold: bool, typeFilter: Iterable[str]
+) -> dict:
+    # The query drops tracks with no pair left, so only their pairs are pruned in Python
+    return crud_annotation.TrackItem.confidence_filter(
+        thresholds if excludeBelowThreshold else None, typeFilter
+    )
+
+
+def _export_track(
+    track: dict, thresholds: dict, excludeBelowThreshold: bool, typeFilter: Iterable[str]
+) -> Optional[dict]:
+    """The track with the confidence pairs an export keeps, None if it keeps none"""
+    confidence_pairs = track['confidencePairs']
+    if excludeBelowThreshold:
+        default_threshold = thresholds.get('default', 0)
+        confidence_pairs = [
+            pair
+            for pair in confidence_pairs
+            if pair[1] >= thresholds.get(pair[0], default_threshold)
+        ]
+    if typeFilter:
+        confidence_pairs = [pair for pair in confidence_pairs if pair[0] in typeFilter]
+    if not confidence_pairs:
+        return None
+    if excludeBelowThreshold or typeFilter:
+        # Filters select raw stored evidence.  Copy before pruning so an export
+        # never mutates the stored track or leaks removed pairs into its output.
+        exported_track = dict(track)
+        exported_track['confidencePairs'] = [list(pair) for pair in confidence_pairs]
+        return exported_track
+    return track
+
+
+# Bytes of JSON text gathered before each yield of a streamed export
+EXPORT_CHUNK_SIZE = 1 << 16
+
+
+def _dive_json_export_chunks(
     dsFolder: types.GirderModel,
     revision: Optional[int],
     excludeBelowThreshold: bool,
     typeFilter: Iterable[str],
-) -> str:
-    annotations = crud_annotation.get_annotations(dsFolder, revision=revision)
-    annotations['tracks'] = _filtered_annotation_tracks(
-        dsFolder, revision, excludeBelowThreshold, typeFilter
+    include_fps=True,
+) -> Generator[str, None, None]:
+    """
+    Stream the DIVE JSON export text, reading each track and group once.
+
+    The text is the same as json.dumps of the annotations dict, but only one
+    chunk of it is held in memory at a time.
+    """
+    thresholds = fromMeta(dsFolder, "confidenceFilters", {}) if excludeBelowThreshold else {}
+    filters = _export_filter(thresholds, excludeBelowThreshold, typeFilter)
+    if revision is None:
+        # Tracks and groups are read at the same revision even when a save lands between
+        revision = crud_annotation.RevisionHeadItem().head(dsFolder)
+    tracks = (
+        _export_track(track, thresholds, excludeBelowThreshold, typeFilter)
+        for track in crud_annotation.iter_tracks(dsFolder, revision, filters)
     )
+    buffer: List[str] = []
+    size = 0
+
+    def members(key: str, annotations: Iterable[Optional[dict]]):
+        nonlocal size
+        separator = ''
+        buffer.append(f'{json.dumps(key)}: {{')
+        for annotation in annotations:
+            if annotation is None:
+                continue
+            text = f'{separator}{json.dumps(str(annotation["id"]))}: {json.dumps(annotation)}'
+            buffer.append(text)
+            size += len(text)
+            separator = ', '
+            if size >= EXPORT_CHUNK_SIZE:
+                yield ''.join(buffer)
+                buffer.clear()
+                size = 0
+        buffer.append('}')
+
+    buffer.append('{')
+    yield from members('tracks', tracks)
+    buffer.append(', ')
+    yield from members('groups', crud_annotation.iter_groups(dsFolder, revision))
+    buffer.append(f', "version": {json.dumps(constants.AnnotationsCurrentVersion)}')
     # Annotation FPS rides on the document the same way CSV/COCO carry it.
     fps = fromMeta(dsFolder, constants.FPSMarker, None)
-    if isinstance(fps, (int, float)) and not isinstance(fps, bool) and fps > 0:
-        annotations['fps'] = float(fps)
-    return json.dumps(annotations)
+    if include_fps and isinstance(fps, (int, float)) and not isinstance(fps, bool) and fps > 0:
+        buffer.append(f', "fps": {json.dumps(float(fps))}')
+    buffer.append('}')
+    yield ''.join(buffer)
+
 
+def _video_frame_filename(frame: int) -> Optional[str]:
+    """Every frame up to the last annotated one is named in a video's COCO export"""
+    return f'frame_{frame:06d}.jpg' if frame >= 0 else None
 
-def _coco_json_export_text(
+
+def _coco_json_export_chunks(
     dsFolder: types.GirderModel,
     user: types.GirderUserModel,
     revision: Optional[int],
     excludeBelowThreshold: bool,
     typeFilter: Iterable[str],
-) -> str:
-    filtered_tracks = list(
-        _filtered_annotation_tracks(dsFolder, revision, excludeBelowThreshold, typeFilter).values()
-    )
-    image_filenames = {}
+) -> Iterator[str]:
+    """
+    Stream the COCO export text from two reads of the filtered tracks at the same
+    revision: one of their types, frames and bounds for the categories and images,
+    then one of the tracks.
+    The type hierarchy is checked before returning, so an invalid one is still an error
+    response rather than a truncated stream.  Callers that only call this once the
+    response streams check it first with type_hierarchy_for_export.
+    """
+    thresholds = fromMeta(dsFolder, "confidenceFilters", {}) if excludeBelowThreshold else {}
+    filters = _export_filter(thresholds, excludeBelowThreshold, typeFilter)
+    if revision is None:
+        # Both reads see the same tracks even when a save lands between them
+        revision = crud_annotation.RevisionHeadItem().head(dsFolder)
+
+    def filtered_tracks(fields: Optional[dict] = None):
+        for track in crud_annotation.iter_tracks(dsFolder, revision, filters, fields):
+            exported_track = _export_track(track, thresholds, excludeBelowThreshold, typeFilter)
+            if exported_track is not None:
+                yield exported_track
+
     dataset_type = fromMeta(dsFolder, constants.TypeMarker)
+    image_filename: Callable[[int], Optional[str]] = _video_frame_filename
     if dataset_type == constants.ImageSequenceType:
         images = crud.valid_images(dsFolder, user)
-        image_filenames = {i: image['name'] for i, image in enumerate(images)}
-    else:
-        max_frame = -1
-        for track_data in filtered_tracks:
-            for feature in track_data.get('features', []):
-                max_frame = max(max_frame, feature.get('frame', -1))
-        image_filenames = {i: f'frame_{i:06d}.jpg' for i in range(max_frame + 1)}
+        image_filename = {i: image['name'] for i, image in enumerate(images)}.get
+
     # Annotation FPS rides on videos[].annotation_fps for video datasets only; image sequences
     # omit the table so re-import does not treat them as video.
     export_fps = None
@@ -836,15 +960,16 @@ def _coco_json_export_text(
         fps = fromMeta(dsFolder, constants.FPSMarker, None)
         if isinstance(fps, (int, float)) and not isinstance(fps, bool) and fps > 0:
             export_fps = float(fps)
-    coco = kwcoco.export_dive_as_coco(
-        filtered_tracks,
-        image_filenames=image_filenames,
+    return kwcoco.stream_dive_as_coco(
+        filtered_tracks(crud_annotation.TrackItem.SUMMARY_FIELDS),
+        filtered_tracks(),
+        image_filename,
         dataset_name=dsFolder['name'],
         datasetInfo=fromMeta(dsFolder, "datasetInfo", {}),
         typeHierarchy=type_hierarchy_for_export(dsFolder, user, artifact='COCO file'),
         fps=export_fps,
+        chunk_size=EXPORT_CHUNK_SIZE,
     )
-    return json.dumps(coco)
 
 
 def export_multicam_annotations_zipstream(
@@ -900,7 +1025,7 @@ def export_multicam_annotations_zipstream(
             elif format == 'dive_json':
 
                 def makeDiveJson(child_folder=child):
-                    yield _dive_json_export_text(
+                    yield from _dive_json_export_chunks(
                         child_folder,
                         revision,
                         excludeBelowThreshold,
@@ -912,7 +1037,7 @@ def export_multicam_annotations_zipstream(
             else:
 
                 def makeCocoJson(child_folder=child):
-                    yield _coco_json_export_text(
+                    yield from _coco_json_export_chunks(
                         child_folder,
                         user,
                         revision,
@@ -1034,11 +1159,9 @@ def _yield_single_dataset_export(
 
     def makeDiveJson():
         """Include DIVE JSON output annotation file"""
-        annotations = crud_annotation.get_annotations(dsFolder)
-        annotations['tracks'] = _filtered_annotation_tracks(
-            dsFolder, None, excludeBelowThreshold, typeFilter
+        yield from _dive_json_export_chunks(
+            dsFolder, None, excludeBelowThreshold, typeFilter, include_fps=False
         )
-        yield json.dumps(annotations)
 
     for data in z.addFile(makeMetajson, Path(f'{zip_path}{constants.ConfigFileName}')):
         yield data
@@ -1,6 +1,7 @@
+import codecs
 from datetime import datetime, timedelta
 import json
-from typing import Dict, List, Literal, NamedTuple, Optional, Tuple, TypedDict, cast
+from typing import Dict, Iterator, List, Literal, NamedTuple, Optional, Tuple, TypedDict, cast
 
 from girder.constants import AccessType
 from girder.exceptions import RestException
@@ -27,6 +28,7 @@ from dive_utils import (
     frame_metadata,
     fromMeta,
     models,
+    transforms,
     types,
 )
 from dive_utils.constants import TrainingModelExtensions
@@ -605,6 +607,26 @@ def _frame_metadata_kept_warning(name: str) -> str:
     return f'{name} was stored as frame metadata, not annotations; it stays in the dataset folder.'
 
 
+def _file_text(file: types.GirderModel) -> Iterator[str]:
+    """The text of a file, a chunk at a time"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for chunk in File().download(file, headers=False)():
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+def _file_lines(file: types.GirderModel) -> Iterator[str]:
+    """The lines of a text file, as str.splitlines has them, read a chunk at a time"""
+    pending = ''
+    for text in _file_text(file):
+        lines = (pending + text).splitlines(keepends=True)
+        # The last line may continue in the next chunk
+        pending = lines.pop() if lines else ''
+        for line in lines:
+            yield line.splitlines()[0]
+    yield from pending.splitlines()
+
+
 def _get_data_by_type(
     file: types.GirderModel,
     image_map: Optional[Dict[str, int]] = None,
@@ -621,8 +643,7 @@ def _get_data_by_type(
     """
     if file is None:
         return None, None
-    file_generator = File().download(file, headers=False)()
-    file_string = b"".join(list(file_generator)).decode()
+    # CSV and JSON are read a chunk at a time as they are parsed; KPF is read whole
     data_dict = None
     warnings = None
 
@@ -631,7 +652,8 @@ def _get_data_by_type(
         as_type = crud.FileType.VIAME_CSV
     elif file['exts'][-1] == 'json':
         try:
-            data_dict = json.loads(file_string)
+            # The annotations of a COCO file are left in the file until they are imported
+            data_dict = kwcoco.read_coco_json(lambda: _file_text(file))
         except json.JSONDecodeError:
             if configuration_only:
                 return None, None
@@ -673,7 +695,9 @@ def _get_data_by_type(
             warnings,
             fps,
             datasetInfo,
-        ) = viame.load_csv_as_tracks_and_attributes(file_string.splitlines(), image_map)
+        ) = viame.load_sorted_csv_as_tracks_and_attributes(
+            viame.sort_csv_rows(lambda: _file_lines(file)), image_map
+        )
         meta = {
             **({'fps': fps} if fps is not None else {}),
             **({'datasetInfo': datasetInfo} if datasetInfo else {}),
@@ -685,7 +709,7 @@ def _get_data_by_type(
             'type': as_type,
         }, warnings
     if as_type == crud.FileType.MEVA_KPF:
-        converted, attributes = kpf.convert(kpf.load(file_string))
+        converted, attributes = kpf.convert(kpf.load(''.join(_file_text(file))))
         return {
             'annotations': converted,
             'meta': None,
@@ -693,9 +717,6 @@ def _get_data_by_type(
             'type': as_type,
         }, warnings
 
-    # All filetypes below are JSON, so if as_type was specified, it needs to be loaded.
-    if data_dict is None:
-        data_dict = json.loads(file_string)
     if as_type == crud.FileType.COCO_JSON:
         (
             converted,
@@ -1477,3 +1498,93 @@ def convert_large_image(
             user=user,
             expires=datetime.now() + timedelta(seconds=30),
         )
+
+
+def compact_annotations(
+    user: types.GirderUserModel,
+    dsFolder: types.GirderModel,
+    keepRevisions: Optional[int] = None,
+    keepDays: Optional[float] = None,
+) -> types.GirderModel:
+    """Schedule a local job that drops annotation history outside the retention policy"""
+    crud.verify_dataset(dsFolder)
+    if keepRevisions is None and keepDays is None:
+        keepRevisions, keepDays = crud_annotation.retention_policy()
+    if keepRevisions is None and keepDays is None:
+        raise RestException('A retention policy requires keepRevisions or keepDays')
+    job = Job().createLocalJob(
+        module='dive_server.crud_annotation',
+        function='compaction_job',
+        kwargs={
+            'folderId': str(dsFolder['_id']),
+            'keepRevisions': keepRevisions,
+            'keepDays': keepDays,
+        },
+        title=f'Compact annotation history of {dsFolder["name"]}',
+        type='DIVE Annotation Compaction',
+        user=user,
+        public=False,
+        asynchronous=True,
+        otherFields={constants.JOBCONST_DATASET_ID: dsFolder['_id']},
+    )
+    # Run on the ``local`` Celery queue like batch postprocess, see event.convert_video_recursive
+    from dive_tasks.local_tasks import run_annotation_compaction_job
+
+    run_annotation_compaction_job.delay(str(job['_id']))
+    return job
+
+
+def revert_annotations(
+    user: types.GirderUserModel,
+    dsFolder: types.GirderModel,
+    revision: int,
+    set: Optional[str] = None,
+) -> types.GirderModel:
+    """Schedule a local job that saves the annotations of revision as a new revision"""
+    crud.verify_dataset(dsFolder)
+    crud_annotation.RevisionHeadItem().require_readable(dsFolder, revision)
+    job = Job().createLocalJob(
+        module='dive_server.crud_annotation',
+        function='revert_job',
+        kwargs={'folderId': str(dsFolder['_id']), 'revision': revision, 'set': set},
+        title=f'Revert annotations of {dsFolder["name"]} to revision {revision}',
+        type='DIVE Annotation Revert',
+        user=user,
+        public=False,
+        asynchronous=True,
+        otherFields={constants.JOBCONST_DATASET_ID: dsFolder['_id']},
+    )
+    from dive_tasks.local_tasks import run_annotation_revert_job
+
+    run_annotation_revert_job.delay(str(job['_id']))
+    return job
+
+
+def transform_annotations(
+    user: types.GirderUserModel,
+    dsFolder: types.GirderModel,
+    args: transforms.AnnotationTransformArgs,
+) -> types.GirderModel:
+    """Schedule a local job that saves transformed annotations as a new revision"""
+    crud.verify_dataset(dsFolder)
+    job = Job().createLocalJob(
+        module='dive_server.crud_annotation',
+        function='transform_job',
+        kwargs={
+            'folderId': str(dsFolder['_id']),
+            'args': args.dict(),
+            # The job transforms this revision, and fails if the set was saved since
+            'revision': crud_annotation.RevisionHeadItem().head(dsFolder),
+            'setHead': crud_annotation.RevisionHeadItem().set_head(dsFolder, args.set),
+        },
+        title=f'Transform annotations of {dsFolder["name"]}',
+        type='DIVE Annotation Transform',
+        user=user,
+        public=False,
+        asynchronous=True,
+        otherFields={constants.JOBCONST_DATASET_ID: dsFolder['_id']},
+    )
+    from dive_tasks.local_tasks import run_annotation_transform_job
+
+    run_annotation_transform_job.delay(str(job['_id']))
+    return job
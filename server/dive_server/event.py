@@ -54,6 +54,17 @@ def send_new_user_email(event):
         logger.exception("Failed to send new user email")
 
 
+def cleanup_dataset_annotations(event):
+    """Purge the annotation records of a DIVE dataset folder that is being deleted"""
+    folder = event.info
+    if not asbool(fromMeta(folder, DatasetMarker, False)):
+        return
+    # Deletion runs in batches on the ``local`` Celery queue, see convert_video_recursive
+    from dive_tasks.local_tasks import delete_dataset_annotations
+
+    delete_dataset_annotations.delay(str(folder['_id']))
+
+
 def _rename_item_and_files(item, new_name: str):
     """Rename a Girder item and its child file documents to *new_name*, then save."""
     if item.get('name') != new_name:
@@ -3,14 +3,14 @@ from typing import List, Optional
 import cherrypy
 from girder.api import access
 from girder.api.describe import Description, autoDescribeRoute
-from girder.api.rest import Resource, setRawResponse
+from girder.api.rest import Resource
 from girder.constants import AccessType, TokenScope
 from girder.exceptions import RestException
 from girder.models.folder import Folder
 
 from dive_utils import constants, fromMeta, setContentDisposition
 
-from . import crud, crud_annotation, crud_dataset
+from . import crud, crud_annotation, crud_dataset, crud_rpc
 
 DatasetModelParam = {
     'description': "dataset id",
@@ -19,6 +19,24 @@ DatasetModelParam = {
     'required': True,
 }
 
+ContinuationParam = {
+    'description': (
+        'Continuation token from the Dive-Continuation-Token header of the previous page. '
+        'Pages after the first then seek directly to their first record.'
+    ),
+    'dataType': 'string',
+    'required': False,
+}
+CountParam = {
+    'description': (
+        'How to compute the Girder-Total-Count header: exact counts every record, '
+        'estimated avoids the count where a cheap estimate exists, none omits the header'
+    ),
+    'dataType': 'string',
+    'enum': crud_annotation.COUNT_MODES,
+    'required': False,
+}
+
 
 GetAnnotationParams = (
     Description("Get annotations of a dataset")
@@ -26,9 +44,50 @@ GetAnnotationParams = (
     .modelParam("folderId", **DatasetModelParam, level=AccessType.READ)
     .param('revision', 'revision', dataType='integer', required=False)
     .param('set', 'set', dataType='string', required=False)
+    .param('after', **ContinuationParam)
+    .param('count', **CountParam, default=crud_annotation.COUNT_NONE)
+)
+
+GetTrackParams = (
+    Description("Get tracks of a dataset, optionally only those within a frame window")
+    .pagingParams("id", defaultLimit=0)
+    .modelParam("folderId", **DatasetModelParam, level=AccessType.READ)
+    .param('revision', 'revision', dataType='integer', required=False)
+    .param('set', 'set', dataType='string', required=False)
+    .param(
+        'frameStart',
+        'Only return tracks that end on or after this frame',
+        dataType='integer',
+        required=False,
+    )
+    .param(
+        'frameEnd',
+        'Only return tracks that begin on or before this frame',
+        dataType='integer',
+        required=False,
+    )
+    .param(
+        'trimFeatures',
+        'Only return the features of each track that fall within the frame window',
+        dataType='boolean',
+        default=False,
+        required=False,
+    )
+    .param('after', **ContinuationParam)
+    .param('count', **CountParam, default=crud_annotation.COUNT_NONE)
 )
 
 
+def _page(cursor, limit: int, key: str, total: Optional[int]):
+    """Send the total and continuation token headers for one page of results"""
+    results, token = crud_annotation.paginate(cursor, limit, key)
+    if total is not None:
+        cherrypy.response.headers['Girder-Total-Count'] = total
+    if token is not None:
+        cherrypy.response.headers['Dive-Continuation-Token'] = token
+    return results
+
+
 class AnnotationResource(Resource):
     """RESTFul Annotation Resource"""
 
@@ -42,22 +101,69 @@ class AnnotationResource(Resource):
         self.route("GET", ("export",), self.export)
         self.route("GET", ("labels",), self.get_labels)
         self.route("GET", ("sets",), self.get_sets)
+        self.route("GET", ("changes",), self.get_changes)
         self.route("PATCH", (), self.save_annotations)
         self.route("POST", ("rollback",), self.rollback)
 
     @access.user
-    @autoDescribeRoute(GetAnnotationParams)
-    def get_tracks(self, limit: int, offset: int, sort, folder, revision, set):
-        return crud_annotation.TrackItem().list(
-            folder, limit=limit, offset=offset, sort=sort, revision=revision, set=set
+    @autoDescribeRoute(GetTrackParams)
+    def get_tracks(
+        self,
+        limit: int,
+        offset: int,
+        sort,
+        folder,
+        revision,
+        set,
+        frameStart: Optional[int],
+        frameEnd: Optional[int],
+        trimFeatures: bool,
+        after: Optional[str],
+        count: str,
+    ):
+        TrackItem = crud_annotation.TrackItem
+        filters = TrackItem.frame_window(frameStart, frameEnd)
+        fields = None
+        if trimFeatures:
+            fields = TrackItem.frame_window_fields(frameStart, frameEnd)
+        cursor = TrackItem().list(
+            folder,
+            limit=limit,
+            offset=offset,
+            sort=sort,
+            revision=revision,
+            set=set,
+            filters=filters,
+            fields=fields,
+            after=None if after is None else crud_annotation.decode_continuation(after),
+            feature_filters=filters if trimFeatures else None,
         )
+        if trimFeatures:
+            cursor = (TrackItem.trim_features(t, frameStart, frameEnd) for t in cursor)
+        total = None
+        if count != crud_annotation.COUNT_NONE:
+            total = TrackItem().count(folder, revision=revision, set=set, filters=filters)
+        return _page(cursor, limit, crud_annotation.IDENTIFIER, total)
 
     @access.user
     @autoDescribeRoute(GetAnnotationParams)
-    def get_groups(self, limit: int, offset: int, sort, folder, revision, set):
-        return crud_annotation.GroupItem().list(
-            folder, limit=limit, offset=offset, sort=sort, revision=revision, set=set
+    def get_groups(
+        self, limit: int, offset: int, sort, folder, revision, set, after: Optional[str], count: str
+    ):
+        GroupItem = crud_annotation.GroupItem
+        cursor = GroupItem().list(
+            folder,
+            limit=limit,
+            offset=offset,
+            sort=sort,
+            revision=revision,
+            set=set,
+            after=None if after is None else crud_annotation.decode_continuation(after),
         )
+        total = None
+        if count != crud_annotation.COUNT_NONE:
+            total = GroupItem().count(folder, revision=revision, set=set)
+        return _page(cursor, limit, crud_annotation.IDENTIFIER, total)
 
     @access.user
     @autoDescribeRoute(
@@ -72,13 +178,23 @@ class AnnotationResource(Resource):
             default='',
             required=False,
         )
+        .param('after', **ContinuationParam)
+        .param('count', **CountParam, default=crud_annotation.COUNT_EXACT)
     )
-    def get_revisions(self, limit: int, offset: int, sort, folder, set):
+    def get_revisions(
+        self, limit: int, offset: int, sort, folder, set, after: Optional[str], count: str
+    ):
         cursor, total = crud_annotation.RevisionLogItem().list(
-            folder, limit, offset, sort, None, set
+            folder,
+            limit,
+            offset,
+            sort,
+            None,
+            set,
+            after=None if after is None else crud_annotation.decode_continuation(after),
+            count=count,
         )
-        cherrypy.response.headers['Girder-Total-Count'] = total
-        return cursor
+        return _page(cursor, limit, crud_annotation.REVISION, total)
 
     @access.user
     @autoDescribeRoute(
@@ -90,6 +206,21 @@ class AnnotationResource(Resource):
         cursor = crud_annotation.RevisionLogItem().sets(folder, limit, offset, sort)
         return cursor
 
+    @access.user
+    @autoDescribeRoute(
+        Description("Get the tracks and groups changed since a revision")
+        .modelParam("folderId", **DatasetModelParam, level=AccessType.READ)
+        .param(
+            'since',
+            'Revision the client already has.  Pass the returned revision on the next call.',
+            dataType='integer',
+        )
+        .param('set', 'set', dataType='string', required=False)
+    )
+    def get_changes(self, folder, since: int, set: Optional[str]):
+        crud.verify_dataset(folder)
+        return crud_annotation.get_changes(folder, since, set)
+
     @access.public(scope=TokenScope.DATA_READ, cookie=True)
     @autoDescribeRoute(
         Description("Export annotations of a clip into CSV format.")
@@ -161,23 +292,31 @@ class AnnotationResource(Resource):
             return gen
         elif format == 'dive_json':
             setContentDisposition(f'{folder["name"]}.dive.json', mime='application/json')
-            setRawResponse()
-            return crud_dataset._dive_json_export_text(
-                folder,
-                revisionId,
-                excludeBelowThreshold,
-                typeFilter,
-            ).encode('utf-8')
+            # CherryPy only encodes text/* bodies, so the JSON text is streamed as bytes
+            return lambda: (
+                chunk.encode('utf-8')
+                for chunk in crud_dataset._dive_json_export_chunks(
+                    folder,
+                    revisionId,
+                    excludeBelowThreshold,
+                    typeFilter,
+                )
+            )
         elif format == 'coco_json':
+            user = self.getCurrentUser()
+            # An invalid type hierarchy is an error response rather than a truncated stream
+            crud_dataset.type_hierarchy_for_export(folder, user, artifact='COCO file')
             setContentDisposition(f'{folder["name"]}.coco.json', mime='application/json')
-            setRawResponse()
-            return crud_dataset._coco_json_export_text(
-                folder,
-                self.getCurrentUser(),
-                revisionId,
-                excludeBelowThreshold,
-                typeFilter,
-            ).encode('utf-8')
+            return lambda: (
+                chunk.encode('utf-8')
+                for chunk in crud_dataset._coco_json_export_chunks(
+                    folder,
+                    user,
+                    revisionId,
+                    excludeBelowThreshold,
+                    typeFilter,
+                )
+            )
         else:
             raise RestException(f'Format {format} is not a valid option.')
 
@@ -210,9 +349,19 @@ class AnnotationResource(Resource):
         Description("Rollback annotation revision to the specified version")
         .modelParam("folderId", **DatasetModelParam, level=AccessType.WRITE)
         .param('revision', 'revision', dataType='integer')
+        .param(
+            'revert',
+            'Keep history: save the state of revision as a new revision in a background '
+            'job, which is returned',
+            required=False,
+            default=False,
+            dataType='boolean',
+        )
     )
-    def rollback(self, folder, revision):
+    def rollback(self, folder, revision, revert):
         crud.verify_dataset(folder)
+        if revert:
+            return crud_rpc.revert_annotations(self.getCurrentUser(), folder, revision)
         crud_annotation.rollback(folder, revision)
 
     @access.user
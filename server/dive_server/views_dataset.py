@@ -14,7 +14,7 @@ from girder.models.item import Item
 from dive_utils import constants, setContentDisposition
 from dive_utils.models import MetadataMutable
 
-from . import crud, crud_dataset
+from . import crud, crud_annotation, crud_dataset
 
 DatasetModelParam = {
     'description': "dataset id",
@@ -51,6 +51,7 @@ class DatasetResource(Resource):
         self.route("POST", (":id", "metadata_file"), self.set_dataset_metadata_file)
         self.route("GET", (":id", "media"), self.get_media)
         self.route("GET", (":id", "frame_metadata_sources"), self.get_frame_metadata_sources)
+        self.route("GET", (":id", "annotation_stats"), self.get_annotation_stats)
         self.route("GET", ("export",), self.export)
         self.route("GET", (":id", "configuration"), self.get_configuration)
         self.route("GET", (":id", "media", ":mediaId", "download"), self.download_media)
@@ -187,6 +188,13 @@ class DatasetResource(Resource):
             default=False,
             dataType='boolean',
         )
+        .param(
+            'annotationStats',
+            'Include the annotation statistics of each dataset, when known',
+            required=False,
+            default=False,
+            dataType='boolean',
+        )
     )
     def list_datasets(
         self,
@@ -195,6 +203,7 @@ class DatasetResource(Resource):
         sort,
         published: bool,
         shared: bool,
+        annotationStats: bool,
     ):
         return crud_dataset.list_datasets(
             self.getCurrentUser(),
@@ -203,6 +212,7 @@ class DatasetResource(Resource):
             limit,
             offset,
             sort,
+            annotationStats,
         )
 
     @access.user
@@ -300,6 +310,19 @@ class DatasetResource(Resource):
     def get_frame_metadata_sources(self, folder):
         return crud_dataset.load_frame_metadata_sources(folder, self.getCurrentUser())
 
+    @access.user
+    @autoDescribeRoute(
+        Description(
+            "Track, detection and per-type counts and the annotated frame range "
+            "at the newest revision"
+        )
+        .modelParam("id", level=AccessType.READ, **DatasetModelParam)
+        .param('set', 'Custom annotation set', required=False, default=None)
+    )
+    def get_annotation_stats(self, folder, set: Optional[str]):
+        crud.verify_dataset(folder)
+        return crud_annotation.get_annotation_stats(folder, set)
+
     @access.public(scope=TokenScope.DATA_READ, cookie=True)
     @autoDescribeRoute(
         Description("Export all selected datasets")
@@ -8,7 +8,7 @@ from girder.models.folder import Folder
 from girder.models.item import Item
 from girder.models.token import Token
 
-from dive_utils import asbool, fromMeta
+from dive_utils import asbool, fromMeta, transforms
 from dive_utils.constants import DatasetMarker, FPSMarker, MarkForPostProcess, TypeMarker
 from dive_utils.types import PipelineDescription, PipelineParams, TrainingModelTuneArgs
 
@@ -29,6 +29,8 @@ class RpcResource(Resource):
         self.route("POST", ("convert_dive", ":id"), self.convert_dive)
         self.route("POST", ("convert_large_image", ":id"), self.convert_large_image)
         self.route("POST", ("batch_postprocess", ":id"), self.batch_postprocess)
+        self.route("POST", ("compact_annotations", ":id"), self.compact_annotations)
+        self.route("POST", ("transform_annotations", ":id"), self.transform_annotations)
 
     @access.user
     @autoDescribeRoute(
@@ -326,3 +328,60 @@ class RpcResource(Resource):
             subFolder['meta']['MarkForPostProcess'] = False
             Folder().save(subFolder)
             crud_rpc.postprocess(self.getCurrentUser(), subFolder, skipJobs, skipTranscoding)
+
+    @access.user
+    @autoDescribeRoute(
+        Description(
+            "Permanently remove annotation history outside a retention policy. "
+            "Defaults to the server retention policy when no rule is given."
+        )
+        .modelParam(
+            "id",
+            description="Dataset folder to compact",
+            model=Folder,
+            level=AccessType.ADMIN,
+        )
+        .param(
+            "keepRevisions",
+            "Keep the last N revisions readable",
+            paramType="formData",
+            dataType="integer",
+            default=None,
+            required=False,
+        )
+        .param(
+            "keepDays",
+            "Keep revisions newer than this many days readable",
+            paramType="formData",
+            dataType="number",
+            default=None,
+            required=False,
+        )
+    )
+    def compact_annotations(self, folder, keepRevisions, keepDays):
+        return crud_rpc.compact_annotations(self.getCurrentUser(), folder, keepRevisions, keepDays)
+
+    @access.user
+    @autoDescribeRoute(
+        Description(
+            "Apply transforms to every annotation of a dataset and save the result as a "
+            "new revision, in a background job which is returned. Transforms are "
+            "renameType (types, to), offsetFrames (offset), transformBounds (scale, "
+            "translate) and renameAttribute (belongs, name, to), applied in order."
+        )
+        .modelParam(
+            "id",
+            description="Dataset folder to transform",
+            model=Folder,
+            level=AccessType.WRITE,
+        )
+        .jsonParam(
+            "body",
+            "Object with a list of transforms and an optional annotation set",
+            paramType="body",
+            requireObject=True,
+        )
+    )
+    def transform_annotations(self, folder, body):
+        args = crud.get_validated_model(transforms.AnnotationTransformArgs, **body)
+        return crud_rpc.transform_annotations(self.getCurrentUser(), folder, args)
@@ -26,6 +26,67 @@ def run_batch_postprocess_job(job_id: str):
     batch_postprocess_task(job)
 
 
+@app.task(queue='local', acks_late=True, ignore_result=True)
+def run_annotation_compaction_job(job_id: str):
+    """
+    Compact the annotation history of one dataset for an existing Girder job document.
+
+    Compaction deletes in idempotent batches, so a redelivered task resumes the work.
+    """
+    from girder_jobs.models.job import Job
+
+    from dive_server.crud_annotation import compaction_job
+
+    job = Job().load(job_id, force=True)
+    compaction_job(job)
+
+
+@app.task(queue='local', acks_late=True, ignore_result=True)
+def run_annotation_revert_job(job_id: str):
+    """
+    Revert the annotations of one dataset for an existing Girder job document.
+
+    A redelivered task finds nothing left to change once the revert has been saved.
+    """
+    from girder_jobs.models.job import Job
+
+    from dive_server.crud_annotation import revert_job
+
+    job = Job().load(job_id, force=True)
+    revert_job(job)
+
+
+@app.task(queue='local', acks_late=True, ignore_result=True)
+def run_annotation_transform_job(job_id: str):
+    """
+    Transform the annotations of one dataset for an existing Girder job document.
+
+    A redelivered task fails instead of transforming twice, because the revision
+    it was scheduled against is no longer the newest once the transform is saved.
+    """
+    from girder_jobs.models.job import Job
+
+    from dive_server.crud_annotation import transform_job
+
+    job = Job().load(job_id, force=True)
+    transform_job(job)
+
+
+@app.task(queue='local', acks_late=True, ignore_result=True)
+def delete_dataset_annotations(dataset_id: str):
+    """
+    Remove the annotations and revisions of a deleted dataset folder.
+
+    Bound to folder removal by ``dive_server.event.cleanup_dataset_annotations`` so that
+    deleting a dataset with millions of detections does not block the request.
+    """
+    from bson.objectid import ObjectId
+
+    from dive_server.crud_annotation import delete_annotations
+
+    delete_annotations(ObjectId(dataset_id))
+
+
 @app.task(queue='local', acks_late=True, ignore_result=True)
 def import_assetstore_path_async(
     assetstore_id: str,
@@ -23,7 +23,7 @@ class PydanticObjectId(str):
 class GeoJSONGeometry(BaseModel):
     type: str
     # support point, line, or polygon,
-    coordinates: Union[List[float], List[List[float]], List[List[List[float]]]]
+    coordinates: Union[List[List[List[float]]], List[List[float]], List[float]]
 
 
 class GeoJSONFeature(BaseModel):
@@ -130,6 +130,31 @@ class TrackItemSchema(Track):
     set: Optional[str]
     rev_created: int = 0
     rev_deleted: Optional[int]
+    # Revisions of the dataset snapshots this record belongs to
+    snapshot: Optional[List[int]]
+    # Features are stored in TrackChunkSchema documents instead of on the track
+    chunked: Optional[bool]
+    # Hash of the annotation content, for skipping saves that change nothing
+    hash: Optional[str]
+    # Never live: hides the base dataset's version of a track deleted in a clone
+    mask: Optional[bool]
+    # Number of features, for annotation statistics of chunked and packed tracks
+    detections: Optional[int]
+
+
+class TrackChunkSchema(BaseModel):
+    """A frame range of the features of a chunked track"""
+
+    dataset: PydanticObjectId
+    set: Optional[str]
+    id: int
+    chunk: int
+    begin: int
+    end: int
+    features: List[Feature] = Field(default_factory=lambda: [])
+    rev_created: int = 0
+    rev_deleted: Optional[int]
+    snapshot: Optional[List[int]]
 
 
 class GroupItemSchema(Group):
@@ -137,6 +162,21 @@ class GroupItemSchema(Group):
     set: Optional[str]
     rev_created: int = 0
     rev_deleted: Optional[int]
+    snapshot: Optional[List[int]]
+    hash: Optional[str]
+    mask: Optional[bool]
+
+
+class AnnotationStats(BaseModel):
+    """Summary of the live tracks of a dataset or annotation set at one revision"""
+
+    tracks: int = 0
+    # Features stored on all tracks
+    detections: int = 0
+    # Number of tracks by their highest-score type, sorted by type
+    types: List[Tuple[str, int]] = Field(default_factory=list)
+    firstFrame: Optional[int]
+    lastFrame: Optional[int]
 
 
 class RevisionLog(BaseModel):
@@ -149,6 +189,38 @@ class RevisionLog(BaseModel):
     created: datetime = Field(default_factory=datetime.utcnow)
     description: Optional[str]
     set: Optional[str]
+    # Annotation statistics of the set after this revision
+    stats: Optional[AnnotationStats]
+
+
+class RevisionHead(BaseModel):
+    dataset: PydanticObjectId
+    set: Optional[str]
+    # Highest revision whose log entry has been written
+    head: int = 0
+    # Highest revision number handed out to a save, committed or not
+    allocated: int = 0
+    # Highest revision saved to the main set, on the dataset document only
+    main_head: Optional[int]
+    # Revisions with a materialized snapshot, see crud_annotation.take_snapshot
+    snapshots: List[int] = Field(default_factory=list)
+    # Oldest revision still readable after history compaction
+    compacted: int = 0
+    # Copy-on-write clones read the records of base_dataset at base_revision that
+    # they have not replaced themselves
+    base_dataset: Optional[PydanticObjectId]
+    base_revision: Optional[int]
+    # Whether labelSummaryItem holds the label counts of every set of the dataset
+    labels_counted: bool = False
+
+
+class LabelCount(BaseModel):
+    """Number of live tracks in a set of a dataset whose highest-score label is label"""
+
+    dataset: PydanticObjectId
+    set: Optional[str]
+    label: str
+    count: int = 0
 
 
 class NumericAttributeOptions(BaseModel):
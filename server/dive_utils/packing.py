@@ -0,0 +1,106 @@
+"""
+Packed storage for track features.
+
+Dense tracker output stores one subdocument per frame, which is slow to decode and
+several times larger than the numbers it holds.  A packed track keeps frames and
+bounds as little-endian int32 arrays in BSON binary fields, keyframe/interpolate as
+one flag byte per feature, and everything else in a sparse table keyed by index.
+"""
+
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+PACKED = 'packed'
+FEATURES = 'features'
+
+_INT32 = np.dtype('<i4')
+_INT32_RANGE = (np.iinfo(_INT32).min, np.iinfo(_INT32).max)
+# Tri-state flags (absent, False, True) take two bits each
+_FLAG_SHIFT = {'keyframe': 0, 'interpolate': 2}
+
+
+def _encode_flag(value: Optional[bool]) -> int:
+    if value is None:
+        return 0
+    return 2 if value else 1
+
+
+def _decode_flag(bits: int) -> Optional[bool]:
+    if bits == 0:
+        return None
+    return bits == 2
+
+
+def can_pack(features: List[Dict[str, Any]]) -> bool:
+    """Packing is lossless only for 4-integer bounds and frames that fit in int32"""
+    low, high = _INT32_RANGE
+    for feature in features:
+        bounds = feature.get('bounds')
+        if bounds is None or len(bounds) != 4:
+            return False
+        for value in (feature['frame'], *bounds):
+            if type(value) is not int or not low <= value <= high:
+                return False
+        for flag in _FLAG_SHIFT:
+            if not isinstance(feature.get(flag), (bool, type(None))):
+                return False
+    return True
+
+
+def pack_features(features: List[Dict[str, Any]]) -> Dict[str, Any]:
+    frames = np.fromiter((f['frame'] for f in features), dtype=_INT32, count=len(features))
+    bounds = np.array([f['bounds'] for f in features], dtype=_INT32).reshape(-1)
+    flags = np.zeros(len(features), dtype=np.uint8)
+    sparse = []
+    for index, feature in enumerate(features):
+        extra = {}
+        for key, value in feature.items():
+            if key in _FLAG_SHIFT:
+                flags[index] |= _encode_flag(value) << _FLAG_SHIFT[key]
+            elif key not in ('frame', 'bounds') and value is not None and value != {}:
+                extra[key] = value
+        if extra:
+            sparse.append({'index': index, **extra})
+    return {
+        'count': len(features),
+        'frames': frames.tobytes(),
+        'bounds': bounds.tobytes(),
+        'flags': flags.tobytes(),
+        'sparse': sparse,
+    }
+
+
+def unpack_features(packed: Dict[str, Any]) -> List[Dict[str, Any]]:
+    frames = np.frombuffer(packed['frames'], dtype=_INT32).tolist()
+    bounds = np.frombuffer(packed['bounds'], dtype=_INT32).reshape(-1, 4).tolist()
+    flags = np.frombuffer(packed['flags'], dtype=np.uint8).tolist()
+    features: List[Dict[str, Any]] = []
+    for frame, box, flag in zip(frames, bounds, flags):
+        feature: Dict[str, Any] = {'frame': frame, 'bounds': box, 'attributes': {}}
+        for key, shift in _FLAG_SHIFT.items():
+            value = _decode_flag((flag >> shift) & 3)
+            if value is not None:
+                feature[key] = value
+        features.append(feature)
+    for extra in packed['sparse']:
+        extra = dict(extra)
+        features[extra.pop('index')].update(extra)
+    return features
+
+
+def pack_track(track: Dict[str, Any], min_features: int) -> Dict[str, Any]:
+    """Replace the features of a long track with their packed form, in place"""
+    features = track.get(FEATURES) or []
+    if min_features and len(features) >= min_features and can_pack(features):
+        track[PACKED] = pack_features(features)
+        del track[FEATURES]
+    return track
+
+
+def unpack_track(track: Dict[str, Any]) -> Dict[str, Any]:
+    """Restore the JSON shape of a track read from the database, in place"""
+    packed = track.pop(PACKED, None)
+    if packed is not None:
+        track[FEATURES] = unpack_features(packed)
+    return track
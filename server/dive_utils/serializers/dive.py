@@ -1,5 +1,5 @@
 import math
-from typing import Any, Optional
+from typing import Any, Callable, Dict, Optional, Tuple
 
 from dive_utils import constants, models, types
 
@@ -20,6 +20,55 @@ def frame_rate_from_dive(data: Any) -> Optional[float]:
     return None
 
 
+# Field order and defaults of the models, so trusted output matches .dict(exclude_none=True)
+_TRACK_FIELDS = tuple(models.Track.__fields__)
+_GROUP_FIELDS = tuple(models.Group.__fields__)
+_FEATURE_FIELDS = tuple(models.Feature.__fields__)
+_ANNOTATION_DEFAULTS: Dict[str, Callable] = {
+    'confidencePairs': list,
+    'attributes': dict,
+    'features': list,
+}
+_FEATURE_DEFAULTS: Dict[str, Callable] = {'attributes': dict}
+
+
+def _pick(doc: dict, fields: Tuple[str, ...], defaults: Dict[str, Callable]) -> dict:
+    picked = {}
+    for key in fields:
+        if key in doc:
+            value = doc[key]
+        elif key in defaults:
+            value = defaults[key]()
+        else:
+            continue
+        if value is not None:
+            picked[key] = value
+    return picked
+
+
+def serialize_track(doc: dict) -> dict:
+    """
+    Convert a stored track document to DIVE json without validating it again.
+
+    Only for documents that were validated when they were written; the output matches
+    ``models.Track(**doc).dict(exclude_none=True)`` with lists in place of tuples.
+    """
+    track = _pick(doc, _TRACK_FIELDS, _ANNOTATION_DEFAULTS)
+    track['features'] = [
+        _pick(feature, _FEATURE_FIELDS, _FEATURE_DEFAULTS) for feature in track['features']
+    ]
+    return track
+
+
+def serialize_group(doc: dict) -> dict:
+    """Convert a stored group document to DIVE json without validating it again"""
+    group = _pick(doc, _GROUP_FIELDS, _ANNOTATION_DEFAULTS)
+    group['members'] = {
+        key: {'ranges': member['ranges']} for key, member in group['members'].items()
+    }
+    return group
+
+
 def migrate(jsonData: Any) -> types.DIVEAnnotationSchema:
     """Migrate and validate a dictionary to make sure it's a DIVE json schema'd file"""
     if not isinstance(jsonData, dict):
@@ -12,6 +12,9 @@ import yaml
 
 from dive_utils import constants, models, types
 
+# The libyaml loader when PyYAML was built with it, many times faster on large files
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
 
 class KPFType(TypedDict):
     cset3: Mapping[str, float]
@@ -75,7 +78,7 @@ def get_default_kpf_data() -> KPFData:
 def load(input: str) -> KPFData:
     """Load from files into formal data structures"""
     kpf_data = get_default_kpf_data()
-    parsed = yaml.safe_load(input)
+    parsed = yaml.load(input, Loader=SafeLoader)
     for row in parsed:
         if 'types' in row:
             kpf_data['types'].append(cast(KPFType, row['types']))
@@ -118,6 +121,12 @@ def convert(kpf_data: KPFData) -> Tuple[types.DIVEAnnotationSchema, dict]:
         ).dict(),
     }
 
+    # The timespans of each actor in every activity, gathered in one pass
+    actorRanges: Dict[int, List[int]] = defaultdict(list)
+    for activity in kpf_data['activities']:
+        for actor in activity['actors']:
+            actorRanges[actor['id1']].extend(t for ts in actor['timespan'] for t in ts['tsr0'])
+
     for actorId in kpf_data['actor_geom_map'].keys():
         activities = kpf_data['actor_activity_map'][actorId]
         actorType = kpf_data['actor_type_map'][actorId]
@@ -125,12 +134,7 @@ def convert(kpf_data: KPFData) -> Tuple[types.DIVEAnnotationSchema, dict]:
             'activityIds': ' '.join([str(a['id2']) for a in activities]),
             'srcStatus': ' '.join([str(a['src_status']) for a in activities]),
         }
-        allActorInstances = [
-            actor for act in activities for actor in act['actors'] if actor['id1'] == actorId
-        ]
-        allRanges = [
-            t for actor in allActorInstances for ts in actor['timespan'] for t in ts['tsr0']
-        ]
+        allRanges = actorRanges.get(actorId, [])
         begin = min(allRanges)
         end = max(allRanges)
         features: List[dict] = []
@@ -156,24 +160,25 @@ def convert(kpf_data: KPFData) -> Tuple[types.DIVEAnnotationSchema, dict]:
             }
         ).dict(exclude_none=True)
 
-        for activity in kpf_data['activities']:
-            all_ranges = list(flatten([a['tsr0'] for a in activity['timespan']]))
-            confidence_pairs = list(activity['act2'].items())
-            begin = min(all_ranges)
-            end = max(all_ranges)
-            members: Dict[int, dict] = {}
-            for actor in activity['actors']:
-                members[actor['id1']] = {
-                    'ranges': [a['tsr0'] for a in actor['timespan']],
-                }
-            groups[str(activity['id2'])] = models.Group(
-                begin=begin,
-                end=end,
-                members=members,
-                id=activity['id2'],
-                confidencePairs=confidence_pairs,
-                attributes={},
-            ).dict(exclude_none=True)
+    # Activities become groups once, provided there are tracks for them to group
+    for activity in kpf_data['activities'] if tracks else []:
+        all_ranges = list(flatten([a['tsr0'] for a in activity['timespan']]))
+        confidence_pairs = list(activity['act2'].items())
+        begin = min(all_ranges)
+        end = max(all_ranges)
+        members: Dict[int, dict] = {}
+        for actor in activity['actors']:
+            members[actor['id1']] = {
+                'ranges': [a['tsr0'] for a in actor['timespan']],
+            }
+        groups[str(activity['id2'])] = models.Group(
+            begin=begin,
+            end=end,
+            members=members,
+            id=activity['id2'],
+            confidencePairs=confidence_pairs,
+            attributes={},
+        ).dict(exclude_none=True)
 
     return {
         'tracks': dict(sorted(tracks.items())),
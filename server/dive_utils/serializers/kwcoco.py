@@ -5,9 +5,14 @@ This module intentionally accepts the COCO base schema while also handling
 KWCOCO-compatible extensions when they are present.
 """
 
+import contextlib
 import functools
+import heapq
+import json
 import math
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+import re
+import tempfile
+from typing import Any, Callable, Dict, Generator, Iterable, Iterator, List, Optional, Tuple
 
 from dive_utils import constants, strNumericCompare, types
 from dive_utils.models import CocoMetadata, Feature, Track
@@ -265,6 +270,147 @@ def is_coco_json(coco: Dict[str, Any]):
     return all(key in coco for key in keys)
 
 
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class _JsonText:
+    """Reads the values of a JSON document from chunks of its text, one at a time"""
+
+    def __init__(self, chunks: Iterable[str]):
+        self._chunks = iter(chunks)
+        self._text = ''
+        self._pos = 0
+        self._decoder = json.JSONDecoder()
+
+    def _read(self) -> bool:
+        """Append at least as much text as is left unread, False at the end of the text"""
+        unread = self._text[self._pos :]
+        parts = [unread]
+        size = 0
+        for chunk in self._chunks:
+            parts.append(chunk)
+            size += len(chunk)
+            # Growing geometrically keeps retrying a value that spans chunks linear
+            if size and size >= len(unread):
+                break
+        self._text = ''.join(parts)
+        self._pos = 0
+        return size > 0
+
+    def _error(self, message: str) -> json.JSONDecodeError:
+        return json.JSONDecodeError(message, self._text, self._pos)
+
+    def peek(self) -> str:
+        """The next character that is not whitespace, empty at the end of the text"""
+        while True:
+            self._pos = _JSON_WHITESPACE.match(self._text, self._pos).end()  # type: ignore
+            if self._pos < len(self._text):
+                return self._text[self._pos]
+            if not self._read():
+                return ''
+
+    def expect(self, character: str) -> None:
+        if self.peek() != character:
+            raise self._error(f'Expecting {character!r} delimiter')
+        self._pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._text, self._pos)
+            except json.JSONDecodeError:
+                if self._read():
+                    continue
+                raise
+            # A number at the end of the text read so far may go on in the next chunk
+            if end < len(self._text) or not self._read():
+                self._pos = end
+                return value
+
+    def array(self) -> Iterator[Any]:
+        """The elements of an array, decoded as they are reached"""
+        self.expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ']':
+                self._pos += 1
+                return
+            self.expect(',')
+
+    def members(self) -> Iterator[str]:
+        """The keys of an object.  The value of each must be read before the next key."""
+        self.expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                raise self._error('Expecting property name enclosed in double quotes')
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == '}':
+                self._pos += 1
+                return
+            self.expect(',')
+
+    def end(self) -> None:
+        if self.peek():
+            raise self._error('Extra data')
+
+
+class StreamedAnnotations:
+    """
+    The annotations array of a COCO file left in the file, decoded one annotation
+    at a time each time it is iterated.
+    """
+
+    def __init__(self, open_text: Callable[[], Iterable[str]], count: int):
+        self._open_text = open_text
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[dict]:
+        reader = _JsonText(self._open_text())
+        for key in reader.members():
+            if key == 'annotations':
+                yield from reader.array()
+                return
+            reader.value()
+
+
+def read_coco_json(open_text: Callable[[], Iterable[str]]) -> Any:
+    """
+    The JSON document of a file, read a chunk of text at a time.
+
+    The annotations of a COCO document, the bulk of large files, are not kept: they
+    are read from the file again whenever they are iterated, see StreamedAnnotations.
+    Any other document is returned as json.loads would.
+
+    :param open_text: returns the text of the file from the start each time it is called
+    """
+    reader = _JsonText(open_text())
+    if reader.peek() != '{':
+        return json.loads(''.join(open_text()))
+    document: Dict[str, Any] = {}
+    for key in reader.members():
+        if key == 'annotations' and reader.peek() == '[':
+            document[key] = StreamedAnnotations(open_text, sum(1 for _ in reader.array()))
+        else:
+            document[key] = reader.value()
+    reader.end()
+    annotations = document.get('annotations')
+    if isinstance(annotations, StreamedAnnotations) and not is_coco_json(document):
+        document['annotations'] = list(annotations)
+    return document
+
+
 def annotation_info(annotation: dict, meta: CocoMetadata) -> Tuple[int, str, int, List[int]]:
     # these fields will always exist
     annotation_id = annotation['id']
@@ -397,7 +543,8 @@ def load_coco_metadata(coco: Dict[str, Any]) -> CocoMetadata:
     datasetInfo = (coco.get('info') or {}).get('dive_dataset_info') or {}
 
     # check if annotations have track IDs
-    has_track_id = annotations and 'track_id' in annotations[0]
+    first_annotation = next(iter(annotations), None)
+    has_track_id = first_annotation is not None and 'track_id' in first_annotation
     # if any videos exist, can assume the images have frame indices
     is_video = len(videos) > 0
 
@@ -434,15 +581,52 @@ def load_coco_metadata(coco: Dict[str, Any]) -> CocoMetadata:
     )
 
 
+# Annotations sorted in memory at once before spilling sorted runs to disk
+COCO_SORT_RUN_ANNOTATIONS = 1 << 16
+
+
+def _spill(annotations: List[dict], stack: contextlib.ExitStack) -> Iterator[dict]:
+    """Write annotations to a temporary file and read them back"""
+    spill = stack.enter_context(tempfile.TemporaryFile('w+', encoding='utf-8'))
+    for annotation in annotations:
+        spill.write(json.dumps(annotation))
+        spill.write('\n')
+    spill.seek(0)
+    return (json.loads(line) for line in spill)
+
+
+def _sort_annotations(
+    annotations: Iterable[dict], key: Callable[[dict], Any], run_size: int
+) -> Generator[dict, None, None]:
+    """sorted(annotations, key=key), in runs of run_size spilled to temporary files and merged"""
+    with contextlib.ExitStack() as stack:
+        runs: List[Iterator[dict]] = []
+        run: List[dict] = []
+        for annotation in annotations:
+            run.append(annotation)
+            if len(run) == run_size:
+                run.sort(key=key)
+                runs.append(_spill(run, stack))
+                run = []
+        run.sort(key=key)
+        # Merging prefers earlier runs on ties, so the order is the stable sort's
+        yield from heapq.merge(*runs, iter(run), key=key)
+
+
 def load_coco_as_tracks_and_attributes(
     coco: Dict[str, Any],
+    run_size: int = COCO_SORT_RUN_ANNOTATIONS,
 ) -> Tuple[types.DIVEAnnotationSchema, types.Attributes, types.Warnings, types.DatasetInfo]:
     """Convert KWCOCO json to DIVE json tracks.
 
     Returns (annotations, attributes, warnings, dataset_info); dataset_info is empty when the
     file carries no ``info.dive_dataset_info`` block.
+
+    The annotations are only iterated, so they may be StreamedAnnotations from
+    read_coco_json.  They are sorted in runs of run_size spilled to temporary files, and
+    tracks are assembled as plain dicts rather than models.
     """
-    tracks: Dict[int, Track] = {}
+    tracks: Dict[int, Dict[str, Any]] = {}
     metadata_attributes: types.Attributes = {}
     test_vals: Dict[str, Dict[str, int]] = {}
     warnings: types.Warnings = []
@@ -459,12 +643,13 @@ def load_coco_as_tracks_and_attributes(
     # Process each logical track in frame order so confidence pairs describe its
     # temporal endpoint regardless of annotation order in the source file.  COCO
     # annotation IDs make equal-frame selection deterministic as well.
-    annotations = sorted(
+    annotations = _sort_annotations(
         annotations,
-        key=lambda annotation: (
+        lambda annotation: (
             meta.images[annotation['image_id']]['frame_index'],
             annotation['id'],
         ),
+        run_size,
     )
 
     malformed_extension = False
@@ -498,16 +683,24 @@ def load_coco_as_tracks_and_attributes(
         trackId, _, frame, _ = annotation_info(annotation, meta)
 
         if trackId not in tracks:
-            tracks[trackId] = Track(begin=frame, end=frame, id=trackId)
+            # The fields of Track.dict(exclude_none=True), in order
+            tracks[trackId] = {
+                'begin': feature.frame,
+                'end': feature.frame,
+                'id': trackId,
+                'confidencePairs': [],
+                'attributes': {},
+                'features': [],
+            }
 
         track = tracks[trackId]
-        track.begin = min(frame, track.begin)
-        track.end = max(track.end, frame)
-        track.features.append(feature)
-        track.confidencePairs = confidence_pairs
+        track['begin'] = min(frame, track['begin'])
+        track['end'] = max(track['end'], frame)
+        track['features'].append(feature.dict(exclude_none=True))
+        track['confidencePairs'] = list(confidence_pairs)
 
         for key, val in track_attributes.items():
-            track.attributes[key] = val
+            track['attributes'][key] = val
             viame.create_attributes(metadata_attributes, test_vals, 'track', key, val)
         for key, val in attributes.items():
             viame.create_attributes(metadata_attributes, test_vals, 'detection', key, val)
@@ -516,9 +709,7 @@ def load_coco_as_tracks_and_attributes(
     viame.calculate_attribute_types(metadata_attributes, test_vals)
 
     converted: types.DIVEAnnotationSchema = {
-        'tracks': {
-            str(trackId): track.dict(exclude_none=True) for trackId, track in tracks.items()
-        },
+        'tracks': {str(trackId): track for trackId, track in tracks.items()},
         'groups': {},
         'version': constants.AnnotationsCurrentVersion,
     }
@@ -533,15 +724,15 @@ def load_coco_as_tracks_and_attributes(
     return converted, metadata_attributes, warnings, meta.datasetInfo
 
 
-def _feature_to_segmentation(feature: Feature) -> List[List[float]]:
+def _feature_to_segmentation(feature: Dict[str, Any]) -> List[List[float]]:
     """Convert DIVE polygon geometry to COCO segmentation format."""
     segmentation: List[List[float]] = []
-    if not feature.geometry:
+    if not feature.get('geometry'):
         return segmentation
-    for geo_feature in feature.geometry.features:
-        if geo_feature.geometry.type != 'Polygon':
+    for geo_feature in feature['geometry']['features']:
+        if geo_feature['geometry']['type'] != 'Polygon':
             continue
-        coordinates = geo_feature.geometry.coordinates
+        coordinates = geo_feature['geometry']['coordinates']
         if not coordinates or not coordinates[0]:
             continue
         flat_coords: List[float] = []
@@ -552,18 +743,18 @@ def _feature_to_segmentation(feature: Feature) -> List[List[float]]:
     return segmentation
 
 
-def _feature_to_keypoints(feature: Feature) -> Tuple[List[float], int]:
+def _feature_to_keypoints(feature: Dict[str, Any]) -> Tuple[List[float], int]:
     """Extract head/tail keypoints from DIVE geometry in COCO format."""
-    if not feature.geometry:
+    if not feature.get('geometry'):
         return [], 0
     points: Dict[str, List[float]] = {}
-    for geo_feature in feature.geometry.features:
-        if geo_feature.geometry.type != 'Point':
+    for geo_feature in feature['geometry']['features']:
+        if geo_feature['geometry']['type'] != 'Point':
             continue
-        key = geo_feature.properties.get('key')
+        key = geo_feature['properties'].get('key')
         if key not in ('head', 'tail'):
             continue
-        coords = geo_feature.geometry.coordinates
+        coords = geo_feature['geometry']['coordinates']
         if not isinstance(coords, list) or len(coords) < 2:
             continue
         points[key] = [coords[0], coords[1], 2]
@@ -579,6 +770,151 @@ def _feature_to_keypoints(feature: Feature) -> Tuple[List[float], int]:
     return keypoints, count
 
 
+class _CocoExport:
+    """
+    Categories and images of a COCO export, gathered in a first pass over the tracks,
+    from which the annotations of each track are built in a second pass.
+
+    Tracks are validated track documents: stored tracks, or ``Track.dict()``.
+    """
+
+    def __init__(
+        self,
+        image_filename: Callable[[int], Optional[str]],
+        typeHierarchy: Optional[Dict[str, str]],
+        fps: Optional[float],
+    ):
+        self.image_filename = image_filename
+        self.typeHierarchy = typeHierarchy or {}
+        self.emit_video = (
+            isinstance(fps, (int, float))
+            and not isinstance(fps, bool)
+            and math.isfinite(fps)
+            and fps > 0
+        )
+        self.categories: Dict[str, int] = {}
+        self.images: Dict[int, dict] = {}
+
+    def _add_category_name(self, name: str) -> None:
+        if name not in self.categories:
+            self.categories[name] = len(self.categories) + 1
+
+    def _exported_features(self, track: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        if not track['confidencePairs']:
+            return
+        for feature in track['features']:
+            if feature.get('bounds') and self.image_filename(feature['frame']) is not None:
+                yield feature
+
+    def gather(self, tracks: Iterable[Dict[str, Any]]) -> None:
+        """First pass: needs only the confidencePairs, frames and bounds of each track"""
+        for track in tracks:
+            for name, _confidence in track['confidencePairs']:
+                self._add_category_name(name)
+            for feature in self._exported_features(track):
+                frame = feature['frame']
+                image_id = frame + 1
+                if image_id not in self.images:
+                    image_doc: Dict[str, Any] = {
+                        'id': image_id,
+                        'file_name': self.image_filename(frame),
+                        'frame_index': frame,
+                    }
+                    if self.emit_video:
+                        image_doc['video_id'] = 1
+                    self.images[image_id] = image_doc
+        for name in sorted(self.typeHierarchy.keys()):
+            self._add_category_name(name)
+        for name in sorted(set(self.typeHierarchy.values())):
+            self._add_category_name(name)
+
+    def track_fields(self, track: Dict[str, Any]) -> Dict[str, Any]:
+        """Annotation fields shared by every feature of a track, computed once per track"""
+        pairs = track['confidencePairs']
+        # KWCOCO probability vectors align with document category order.
+        prob = [0.0] * len(self.categories)
+        for name, confidence in pairs:
+            prob[self.categories[name] - 1] = confidence
+        class_name, score = max(pairs, key=lambda x: x[1])
+        return {
+            'category_id': self.categories[class_name],
+            'score': score,
+            'prob': prob,
+            # Preserve sparse membership and explicit zero confidence without
+            # requiring consumers to infer it from a dense probability vector.
+            'dive_confidence_pairs': [list(pair) for pair in pairs],
+        }
+
+    def annotations(
+        self, track: Dict[str, Any], shared: Dict[str, Any], first_id: int
+    ) -> Iterator[Dict[str, Any]]:
+        """Second pass: the annotations of one track, numbered from first_id"""
+        annotation_id = first_id
+        for feature in self._exported_features(track):
+            x1, y1, x2, y2 = feature['bounds']
+            width = max(0, x2 - x1)
+            height = max(0, y2 - y1)
+            segmentation = _feature_to_segmentation(feature)
+            keypoints, num_keypoints = _feature_to_keypoints(feature)
+            annotation = {
+                'id': annotation_id,
+                'image_id': feature['frame'] + 1,
+                'category_id': shared['category_id'],
+                'bbox': [x1, y1, width, height],
+                'area': width * height,
+                # Single-instance polygon export; DIVE does not emit crowd RLE (iscrowd: 1).
+                'iscrowd': 0,
+                'score': shared['score'],
+                'prob': shared['prob'],
+                'dive_confidence_pairs': shared['dive_confidence_pairs'],
+            }
+            # Keep a stable object identity across frames when track data exists.
+            annotation['track_id'] = track['id']
+            if feature.get('attributes'):
+                annotation['dive_detection_attributes'] = feature['attributes']
+            if track.get('attributes'):
+                annotation['dive_track_attributes'] = track['attributes']
+            if feature.get('notes'):
+                annotation['dive_notes'] = feature['notes']
+            if segmentation:
+                annotation['segmentation'] = segmentation
+            if keypoints:
+                annotation['keypoints'] = keypoints
+                annotation['num_keypoints'] = num_keypoints
+            yield annotation
+            annotation_id += 1
+
+    def header(self, dataset_name: str, datasetInfo: Optional[types.DatasetInfo]) -> Dict[str, Any]:
+        info: Dict[str, Any] = {
+            'description': f'DIVE export for {dataset_name}',
+            'dive_extensions': [
+                'dive_detection_attributes',
+                'dive_track_attributes',
+                'dive_notes',
+                'dive_confidence_pairs',
+            ],
+        }
+        if datasetInfo:
+            info['dive_dataset_info'] = datasetInfo
+            info['dive_extensions'].append('dive_dataset_info')
+        return info
+
+    def footer(self, dataset_name: str, fps: Optional[float]) -> Dict[str, Any]:
+        categories_doc: List[dict] = []
+        for class_name, category_id in self.categories.items():
+            category: Dict[str, Any] = {'id': category_id, 'name': class_name}
+            parent = self.typeHierarchy.get(class_name)
+            if parent is not None:
+                category['supercategory'] = parent
+            # When keypoints are exported, publish the category labels explicitly.
+            category['keypoints'] = ['head', 'tail']
+            categories_doc.append(category)
+        footer: Dict[str, Any] = {'categories': categories_doc}
+        if self.emit_video:
+            footer['videos'] = [{'id': 1, 'name': dataset_name, 'annotation_fps': float(fps)}]
+        return footer
+
+
 def export_dive_as_coco(
     tracks: Iterable[dict],
     image_filenames: Dict[int, str],
@@ -605,118 +941,63 @@ def export_dive_as_coco(
             imports. Callers should pass this only for video datasets; image
             sequences omit ``videos`` so re-import does not treat them as video.
     """
-    parsed_tracks = [Track(**track_doc) for track_doc in tracks]
-    category_names: List[str] = []
-
-    def add_category_name(name: str) -> None:
-        if name not in category_names:
-            category_names.append(name)
-
-    for track in parsed_tracks:
-        for name, _confidence in track.confidencePairs:
-            add_category_name(name)
-    for name in sorted((typeHierarchy or {}).keys()):
-        add_category_name(name)
-    for name in sorted(set((typeHierarchy or {}).values())):
-        add_category_name(name)
-
-    categories = {name: index + 1 for index, name in enumerate(category_names)}
+    parsed_tracks = [Track(**track_doc).dict() for track_doc in tracks]
+    export = _CocoExport(image_filenames.get, typeHierarchy, fps)
+    export.gather(parsed_tracks)
     coco_annotations: List[dict] = []
-    images: Dict[int, dict] = {}
-    annotation_id = 1
-    emit_video = (
-        isinstance(fps, (int, float))
-        and not isinstance(fps, bool)
-        and math.isfinite(fps)
-        and fps > 0
-    )
-
     for track in parsed_tracks:
-        for feature in track.features:
-            if feature.frame not in image_filenames:
-                continue
-            if not feature.bounds:
-                continue
-            if not track.confidencePairs:
-                continue
-            class_name, score = max(track.confidencePairs, key=lambda x: x[1])
-            category_id = categories[class_name]
-            x1, y1, x2, y2 = feature.bounds
-            width = max(0, x2 - x1)
-            height = max(0, y2 - y1)
-            image_id = feature.frame + 1
-            image_doc: Dict[str, Any] = {
-                'id': image_id,
-                'file_name': image_filenames[feature.frame],
-                'frame_index': feature.frame,
-            }
-            if emit_video:
-                image_doc['video_id'] = 1
-            images.setdefault(image_id, image_doc)
-            segmentation = _feature_to_segmentation(feature)
-            keypoints, num_keypoints = _feature_to_keypoints(feature)
-            annotation = {
-                'id': annotation_id,
-                'image_id': image_id,
-                'category_id': category_id,
-                'bbox': [x1, y1, width, height],
-                'area': width * height,
-                # Single-instance polygon export; DIVE does not emit crowd RLE (iscrowd: 1).
-                'iscrowd': 0,
-                'score': score,
-                # KWCOCO probability vectors align with document category order.
-                'prob': [dict(track.confidencePairs).get(name, 0.0) for name in category_names],
-                # Preserve sparse membership and explicit zero confidence without
-                # requiring consumers to infer it from a dense probability vector.
-                'dive_confidence_pairs': [list(pair) for pair in track.confidencePairs],
-            }
-            # Keep a stable object identity across frames when track data exists.
-            annotation['track_id'] = track.id
-            if feature.attributes:
-                annotation['dive_detection_attributes'] = feature.attributes
-            if track.attributes:
-                annotation['dive_track_attributes'] = track.attributes
-            if feature.notes:
-                annotation['dive_notes'] = feature.notes
-            if segmentation:
-                annotation['segmentation'] = segmentation
-            if keypoints:
-                annotation['keypoints'] = keypoints
-                annotation['num_keypoints'] = num_keypoints
-            coco_annotations.append(annotation)
-            annotation_id += 1
-
-    categories_doc: List[dict] = []
-    for class_name, category_id in categories.items():
-        category: Dict[str, Any] = {'id': category_id, 'name': class_name}
-        parent = (typeHierarchy or {}).get(class_name)
-        if parent is not None:
-            category['supercategory'] = parent
-        # When keypoints are exported, publish the category labels explicitly.
-        category['keypoints'] = ['head', 'tail']
-        categories_doc.append(category)
-
-    info: Dict[str, Any] = {
-        'description': f'DIVE export for {dataset_name}',
-        'dive_extensions': [
-            'dive_detection_attributes',
-            'dive_track_attributes',
-            'dive_notes',
-            'dive_confidence_pairs',
-        ],
-    }
-    if datasetInfo:
-        info['dive_dataset_info'] = datasetInfo
-        info['dive_extensions'].append('dive_dataset_info')
-
-    coco: Dict[str, Any] = {
-        'info': info,
-        'images': list(images.values()),
+        if track['confidencePairs']:
+            shared = export.track_fields(track)
+            for annotation in export.annotations(track, shared, len(coco_annotations) + 1):
+                coco_annotations.append({**annotation, 'prob': list(annotation['prob'])})
+    return {
+        'info': export.header(dataset_name, datasetInfo),
+        'images': list(export.images.values()),
         'annotations': coco_annotations,
-        'categories': categories_doc,
+        **export.footer(dataset_name, fps),
     }
-    if emit_video:
-        coco['videos'] = [
-            {'id': 1, 'name': dataset_name, 'annotation_fps': float(fps)}
-        ]
-    return coco
+
+
+def stream_dive_as_coco(
+    summary_tracks: Iterable[dict],
+    tracks: Iterable[dict],
+    image_filename: Callable[[int], Optional[str]],
+    dataset_name: str,
+    datasetInfo: Optional[types.DatasetInfo] = None,
+    typeHierarchy: Optional[Dict[str, str]] = None,
+    fps: Optional[float] = None,
+    chunk_size: int = 1 << 16,
+) -> Generator[str, None, None]:
+    """
+    Stream the JSON text of ``export_dive_as_coco`` in chunks of about chunk_size.
+
+    Tracks are read in two passes that must list the same tracks in the same order:
+    summary_tracks only needs their confidencePairs and the frame and bounds of their
+    features, to gather categories and images, and tracks are the stored track
+    documents the annotations are written from.  image_filename names the image of a
+    frame, None for frames left out of the export.  Only one chunk is held in memory.
+    """
+    export = _CocoExport(image_filename, typeHierarchy, fps)
+    export.gather(summary_tracks)
+    images = ', '.join(json.dumps(image) for image in export.images.values())
+    buffer = [
+        f'{{"info": {json.dumps(export.header(dataset_name, datasetInfo))}, '
+        f'"images": [{images}], "annotations": ['
+    ]
+    size = len(buffer[0])
+    annotation_id = 1
+    for track in tracks:
+        if not track['confidencePairs']:
+            continue
+        shared = export.track_fields(track)
+        for annotation in export.annotations(track, shared, annotation_id):
+            text = json.dumps(annotation)
+            buffer.append(text if annotation_id == 1 else f', {text}')
+            size += len(text)
+            annotation_id += 1
+            if size >= chunk_size:
+                yield ''.join(buffer)
+                buffer = []
+                size = 0
+    buffer.append('], ' + json.dumps(export.footer(dataset_name, fps))[1:])
+    yield ''.join(buffer)
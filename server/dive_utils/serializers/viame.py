@@ -2,13 +2,28 @@
 VIAME Fish format deserializer
 """
 
+import contextlib
 import csv
 import datetime
+import heapq
 import io
 import json
 import os
 import re
-from typing import Any, Dict, Generator, List, Optional, Tuple, Union
+import tempfile
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 from dive_utils import constants, types
 from dive_utils.models import Feature, Track, interpolate
@@ -170,6 +185,35 @@ def add_hole_to_polygon(features: Dict[str, Any], coords: List[Any], key=''):
             break
 
 
+# The rest of an extra column after its prefix, like '(kp)' or '(atr)'
+_TEXT_PATTERN = re.compile(r' (.*?)\s(.+)')
+_COLUMN_PATTERNS = {
+    '(kp)': re.compile(r' (head|tail) (-?[0-9]+\.*-?[0-9]*) (-?[0-9]+\.*-?[0-9]*)'),
+    '(atr)': _TEXT_PATTERN,
+    '(trk-atr)': _TEXT_PATTERN,
+    '(note)': re.compile(r'\s*(.+)'),
+}
+_POINTS_PATTERN = re.compile(r'\s*((?:-?[0-9]+\.*-?[0-9]*\s*)+)')
+_UNSIGNED_INTEGERS = str.maketrans('', '', '0123456789 ')
+
+
+def _parse_points(column: str, start: int) -> Optional[List[List[float]]]:
+    """[x, y] points of a (poly) or (hole) column, None if it has no coordinates"""
+    text = column[start:]
+    if text.translate(_UNSIGNED_INTEGERS):
+        # Signs, decimals or other text: only the leading run of numbers counts
+        match = _POINTS_PATTERN.match(text)
+        if match is None:
+            return None
+        text = match[1]
+    values = list(map(float, text.split()))
+    if not values:
+        return None
+    if len(values) % 2:
+        raise ValueError(f'Polygon has an odd number of coordinates: {text.strip()}')
+    return [[x, y] for x, y in zip(values[::2], values[1::2])]
+
+
 def _parse_row(row: List[str]) -> Tuple[Dict, Dict, Dict, List, List]:
     """
     Parse a single CSV line into its composite track and detection parts
@@ -187,60 +231,39 @@ def _parse_row(row: List[str]) -> Tuple[Dict, Dict, Dict, List, List]:
     head_tail = []
     start = 9 + len(sorted_confidence_pairs) * 2
 
-    for j in range(start, len(row)):
-        # (kp) head x y
-        head_regex = re.match(r"^\(kp\) head (-?[0-9]+\.*-?[0-9]*) (-?[0-9]+\.*-?[0-9]*)", row[j])
-        if head_regex:
-            point = [float(head_regex[1]), float(head_regex[2])]
-            head_tail.append(point)
-            create_geoJSONFeature(features, 'Point', point, 'head')
+    last_polygon_key: Optional[str] = None
 
-        # (kp) tail x y
-        tail_regex = re.match(r"^\(kp\) tail (-?[0-9]+\.*-?[0-9]*) (-?[0-9]+\.*-?[0-9]*)", row[j])
-        if tail_regex:
-            point = [float(tail_regex[1]), float(tail_regex[2])]
-            head_tail.append(point)
-            create_geoJSONFeature(features, 'Point', point, 'tail')
-
-        # (atr) text
-        atr_regex = re.match(r"^\(atr\) (.*?)\s(.+)", row[j])
-        if atr_regex:
-            attributes[atr_regex[1]] = _deduceType(atr_regex[2])
-
-        # (trk-atr) text
-        trk_regex = re.match(r"^\(trk-atr\) (.*?)\s(.+)", row[j])
-        if trk_regex:
-            track_attributes[trk_regex[1]] = _deduceType(trk_regex[2])
-
-        # (poly) x1 y1 x2 y2 ... - polygon (multiple allowed, auto-keyed internally)
-        # (hole) x1 y1 x2 y2 ... - hole in the most recent polygon
-        poly_regex = re.match(r"^\(poly\)\s*((?:-?[0-9]+\.*-?[0-9]*\s*)+)", row[j])
-        if poly_regex:
-            temp = [float(x) for x in poly_regex.group(1).split()]
-            coords = [[temp[i], temp[i + 1]] for i in range(0, len(temp), 2)]
-            # Create new polygon with auto-generated key
-            create_geoJSONFeature(features, 'Polygon', coords, auto_key=True)
-
-        # (hole) x1 y1 x2 y2 ... - hole in the most recent polygon
-        hole_regex = re.match(r"^\(hole\)\s*((?:-?[0-9]+\.*-?[0-9]*\s*)+)", row[j])
-        if hole_regex:
-            temp = [float(x) for x in hole_regex.group(1).split()]
-            coords = [[temp[i], temp[i + 1]] for i in range(0, len(temp), 2)]
-            # Add hole to the most recent polygon (last one added)
-            if "geometry" in features and features["geometry"]["features"]:
-                polygons = [
-                    f
-                    for f in features["geometry"]["features"]
-                    if f["geometry"]["type"] == "Polygon"
-                ]
-                if polygons:
-                    last_poly_key = polygons[-1]["properties"]["key"]
-                    add_hole_to_polygon(features, coords, last_poly_key)
+    for column in row[start:]:
+        prefix = column[: column.find(')') + 1]
+        if prefix == '(poly)' or prefix == '(hole)':
+            coords = _parse_points(column, len(prefix))
+            if coords is None:
+                continue
+            if prefix == '(poly)':
+                # (poly) x1 y1 x2 y2 ... - polygon (multiple allowed, auto-keyed internally)
+                last_polygon_key = create_geoJSONFeature(features, 'Polygon', coords, auto_key=True)
+            elif last_polygon_key is not None:
+                # (hole) x1 y1 x2 y2 ... - hole in the most recent polygon
+                add_hole_to_polygon(features, coords, last_polygon_key)
+            continue
 
-        # (note) text
-        note_regex = re.match(r"^\(note\)\s*(.+)", row[j])
-        if note_regex:
-            notes.append(note_regex[1])
+        pattern = _COLUMN_PATTERNS.get(prefix)
+        if pattern is None:
+            continue
+        match = pattern.match(column, len(prefix))
+        if match is None:
+            continue
+        if prefix == '(kp)':
+            # (kp) head x y, (kp) tail x y
+            point = [float(match[2]), float(match[3])]
+            head_tail.append(point)
+            create_geoJSONFeature(features, 'Point', point, match[1])
+        elif prefix == '(atr)':
+            attributes[match[1]] = _deduceType(match[2])
+        elif prefix == '(trk-atr)':
+            track_attributes[match[1]] = _deduceType(match[2])
+        else:
+            notes.append(match[1])
 
     if len(head_tail) == 2:
         create_geoJSONFeature(features, 'LineString', head_tail, 'HeadTails')
@@ -385,8 +408,59 @@ def parse_metadata_row(row: List[str]) -> Dict[str, Any]:
     return metadata
 
 
+# Rows sorted in memory at once before spilling sorted runs to disk
+CSV_SORT_RUN_ROWS = 1 << 18
+
+
+def _in_frame_order(rows: Iterable[List[str]]) -> bool:
+    previous = (0, 0)
+    for row in rows:
+        key = custom_sort(row)
+        if key < previous:
+            return False
+        previous = key
+    return True
+
+
+def _spill(rows: List[List[str]], stack: contextlib.ExitStack) -> Iterator[List[str]]:
+    """Write rows to a temporary file and read them back"""
+    spill = stack.enter_context(tempfile.TemporaryFile('w+', newline='', encoding='utf-8'))
+    csv.writer(spill).writerows(rows)
+    spill.seek(0)
+    return csv.reader(spill)
+
+
+def sort_csv_rows(
+    open_rows: Callable[[], Iterable[str]], run_size: int = CSV_SORT_RUN_ROWS
+) -> Generator[List[str], None, None]:
+    """
+    Parsed rows of a VIAME CSV file in the order of custom_sort, without holding the
+    whole file in memory.
+
+    :param open_rows: returns the string rows of the file from the start each time it
+        is called.  A file already in frame order is read twice: once to check the
+        order, then once more as it is.  Any other file is sorted in runs of run_size
+        rows, spilled to temporary files and merged.
+    """
+    if _in_frame_order(csv.reader(open_rows())):
+        yield from csv.reader(open_rows())
+        return
+    with contextlib.ExitStack() as stack:
+        runs: List[Iterator[List[str]]] = []
+        run: List[List[str]] = []
+        for row in csv.reader(open_rows()):
+            run.append(row)
+            if len(run) == run_size:
+                run.sort(key=custom_sort)
+                runs.append(_spill(run, stack))
+                run = []
+        run.sort(key=custom_sort)
+        # Merging prefers earlier runs on ties, so the order is the stable sort's
+        yield from heapq.merge(*runs, iter(run), key=custom_sort)
+
+
 def load_csv_as_tracks_and_attributes(
-    rows: List[str],
+    rows: Iterable[str],
     imageMap: Optional[Dict[str, int]] = None,
 ) -> Tuple[
     types.DIVEAnnotationSchema, types.Attributes, types.Warnings, Optional[str], types.DatasetInfo
@@ -397,14 +471,29 @@ def load_csv_as_tracks_and_attributes(
     :param rows: string rows of a VIAME CSV file
     :param imageMap: map of image names to frame numbers.  keys do NOT include file extension
     """
-    reader = csv.reader(row for row in rows)
+    return load_sorted_csv_as_tracks_and_attributes(
+        sorted(csv.reader(rows), key=custom_sort), imageMap
+    )
+
+
+def load_sorted_csv_as_tracks_and_attributes(
+    sortedlist: Iterable[List[str]],
+    imageMap: Optional[Dict[str, int]] = None,
+) -> Tuple[
+    types.DIVEAnnotationSchema, types.Attributes, types.Warnings, Optional[str], types.DatasetInfo
+]:
+    """
+    Convert parsed VIAME CSV rows, already in the order of custom_sort, to json tracks.
+    Rows are consumed as they are read, see sort_csv_rows.
+    """
     tracks: Dict[int, Track] = {}
     metadata_attributes: types.Attributes = {}
     test_vals: Dict[str, Dict[str, int]] = {}
     multiFrameTracks = False
     missingImages: List[str] = []
     foundImages: List[Dict[str, Any]] = []  # {image:str, frame: int, csvFrame: int}
-    sortedlist = sorted(reader, key=custom_sort)
+    seenImages: Set[Tuple[str, int, int]] = set()
+    maxFeatureFrames: Dict[int, int] = {}
     warnings: types.Warnings = []
     fps = None
     datasetInfo: types.DatasetInfo = {}
@@ -435,21 +524,20 @@ def load_csv_as_tracks_and_attributes(
             foundFrame = expectedFrameNumber
             if expectedFrameNumber is None:
                 foundFrame = -1
-            foundImage = {'image': imageName, 'frame': foundFrame, 'csvFrame': feature.frame}
-            hasImageAlready = foundImage in foundImages
-            if foundFrame != -1 and not hasImageAlready:
-                foundImages.append(foundImage)
+            imageKey = (imageName, foundFrame, feature.frame)
+            if foundFrame != -1 and imageKey not in seenImages:
+                seenImages.add(imageKey)
+                foundImages.append(
+                    {'image': imageName, 'frame': foundFrame, 'csvFrame': feature.frame}
+                )
             if expectedFrameNumber is None:
                 missingImages.append(imageFile)
 
         if trackId not in tracks:
             tracks[trackId] = Track(begin=feature.frame, end=feature.frame, id=trackId)
         else:
-            track = tracks[trackId]
             multiFrameTracks = True
-            maxFeatureFrame = float('-inf')
-            for subFeature in track.features:
-                maxFeatureFrame = max(maxFeatureFrame, subFeature.frame)
+            maxFeatureFrame = maxFeatureFrames[trackId]
             if feature.frame < maxFeatureFrame:
                 # trackId was already in tracks, so the track consists of multiple frames
                 raise ValueError(
@@ -465,6 +553,7 @@ def load_csv_as_tracks_and_attributes(
         track.begin = min(feature.frame, track.begin)
         track.end = max(track.end, feature.frame)
         track.features.append(feature)
+        maxFeatureFrames[trackId] = max(feature.frame, maxFeatureFrames.get(trackId, feature.frame))
         track.confidencePairs = confidence_pairs
 
         for key, val in track_attributes.items():
@@ -579,6 +668,37 @@ def load_csv_as_tracks_and_attributes(
     return annotations, metadata_attributes, warnings, fps, datasetInfo
 
 
+def _export_pairs(
+    confidence_pairs, excludeBelowThreshold: bool, thresholds: Dict[str, float], typeFilter
+) -> list:
+    """The confidence pairs a track exports, highest confidence first"""
+    if excludeBelowThreshold:
+        default_threshold = thresholds.get('default', 0)
+        confidence_pairs = [
+            pair
+            for pair in confidence_pairs
+            if pair[1] >= thresholds.get(pair[0], default_threshold)
+        ]
+    if typeFilter:
+        confidence_pairs = [pair for pair in confidence_pairs if pair[0] in typeFilter]
+    return sorted(confidence_pairs, key=lambda item: item[1], reverse=True)
+
+
+def _export_length(attributes: Dict[str, Any], fishLength: Optional[float]) -> Optional[float]:
+    """Length exported for a detection: its length attribute, else its fishLength"""
+    length: Optional[float] = None
+    if 'length' in attributes:
+        try:
+            candidate = float(attributes['length'])
+            if candidate == candidate:  # not NaN
+                length = candidate
+        except (TypeError, ValueError):
+            length = None
+    if length is None:
+        length = fishLength
+    return length if length is not None and length == length else None
+
+
 def export_tracks_as_csv(
     track_iterator,
     excludeBelowThreshold=False,
@@ -589,6 +709,7 @@ def export_tracks_as_csv(
     typeFilter=None,
     revision=None,
     datasetInfo: Optional[types.DatasetInfo] = None,
+    trusted=False,
 ) -> Generator[str, None, None]:
     """
     Export track json to a CSV format.
@@ -602,6 +723,9 @@ def export_tracks_as_csv(
     :param typeFilter: set of track types to only export if not empty
     :param datasetInfo: per-dataset station metadata; emitted as a nested ``dataset_info`` JSON
         entry on the ``# metadata`` line when non-empty (omitted entirely when empty/absent)
+    :param trusted: tracks are stored documents that were validated when written,
+        so format them directly without validating them again.  Rows are then yielded
+        in chunks of about CSV_CHUNK_SIZE rather than one at a time.
     """
     if thresholds is None:
         thresholds = {}
@@ -620,24 +744,25 @@ def export_tracks_as_csv(
             metadata["dataset_info"] = datasetInfo
         writeHeader(writer, metadata)
 
+    if trusted:
+        yield from _export_stored_tracks_as_csv(
+            track_iterator,
+            csvFile.getvalue(),
+            excludeBelowThreshold,
+            thresholds,
+            filenames,
+            fps,
+            typeFilter,
+        )
+        return
+
     for t in track_iterator:
         track = Track(**t)
-        confidence_pairs = track.confidencePairs
-        if excludeBelowThreshold:
-            default_threshold = thresholds.get('default', 0)
-            confidence_pairs = [
-                pair
-                for pair in confidence_pairs
-                if pair[1] >= thresholds.get(pair[0], default_threshold)
-            ]
-        if typeFilter:
-            confidence_pairs = [pair for pair in confidence_pairs if pair[0] in typeFilter]
-        if not confidence_pairs:
-            continue
-
-        sorted_confidence_pairs = sorted(
-            confidence_pairs, key=lambda item: item[1], reverse=True
+        sorted_confidence_pairs = _export_pairs(
+            track.confidencePairs, excludeBelowThreshold, thresholds, typeFilter
         )
+        if not sorted_confidence_pairs:
+            continue
 
         for index, keyframe in enumerate(track.features):
             features = [keyframe]
@@ -651,20 +776,8 @@ def export_tracks_as_csv(
 
             for feature in features:
                 attributes = dict(feature.attributes or {})
-                attr_length: Optional[float] = None
-                if 'length' in attributes:
-                    try:
-                        candidate = float(attributes['length'])
-                        if candidate == candidate:
-                            attr_length = candidate
-                    except (TypeError, ValueError):
-                        attr_length = None
-                resolved_length = attr_length if attr_length is not None else feature.fishLength
-                export_length = (
-                    resolved_length
-                    if resolved_length is not None and resolved_length == resolved_length
-                    else -1
-                )
+                resolved_length = _export_length(attributes, feature.fishLength)
+                export_length = resolved_length if resolved_length is not None else -1
 
                 columns = [
                     track.id,
@@ -685,7 +798,7 @@ def export_tracks_as_csv(
                 for pair in sorted_confidence_pairs:
                     columns.extend(list(pair))
 
-                if resolved_length is not None and resolved_length == resolved_length:
+                if resolved_length is not None:
                     attributes['length'] = resolved_length
 
                 if attributes:
@@ -741,3 +854,136 @@ def export_tracks_as_csv(
                 csvFile.seek(0)
                 csvFile.truncate(0)
     yield csvFile.getvalue()
+
+
+CSV_CHUNK_SIZE = 1 << 16
+# Fields csv.writer quotes with its default dialect
+_CSV_QUOTED = re.compile(r'[,"\r\n]')
+
+
+def _csv_field(text: str) -> str:
+    if _CSV_QUOTED.search(text):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def _frame_column(fps, filenames) -> Callable[[int], str]:
+    """Column 2 of the rows of a frame, formatted once per frame"""
+    columns: Dict[int, str] = {}
+
+    def column(frame: int) -> str:
+        text = columns.get(frame)
+        if text is None:
+            text = ''
+            if fps is not None and fps > 0:
+                text = format_timestamp(fps, frame)
+            elif filenames and frame < len(filenames):
+                text = _csv_field(filenames[frame])
+            columns[frame] = text
+        return text
+
+    return column
+
+
+def _interpolated_bounds(a: Dict[str, Any], b: Dict[str, Any]) -> Iterator[Tuple[int, List[int]]]:
+    """Frames and bounds strictly between two keyframes, as ``models.interpolate`` has them"""
+    if b['frame'] <= a['frame']:
+        raise ValueError('b.frame must be larger than a.frame')
+    frame_range = b['frame'] - a['frame']
+    for frame in range(1, frame_range):
+        delta = frame / frame_range
+        inverse_delta = 1 - delta
+        yield a['frame'] + frame, [
+            round((abox * inverse_delta) + (bbox * delta))
+            for (abox, bbox) in zip(a['bounds'], b['bounds'])
+        ]
+
+
+def _geometry_columns(geometry: Optional[Dict[str, Any]]) -> str:
+    if not geometry or geometry['type'] != 'FeatureCollection':
+        return ''
+    columns = []
+    for item in geometry['features']:
+        shape = item['geometry']
+        if shape['type'] == 'Polygon':
+            # The outer ring, then its holes
+            for index, ring in enumerate(shape['coordinates']):
+                points = ' '.join(str(round(x)) for point in ring for x in point)
+                columns.append(f',(poly) {points}' if index == 0 else f',(hole) {points}')
+        elif shape['type'] == 'Point':
+            x, y = shape['coordinates'][:2]
+            key = item['properties']['key']
+            columns.append(',' + _csv_field(f'(kp) {key} {round(x)} {round(y)}'))
+    return ''.join(columns)
+
+
+def _export_stored_tracks_as_csv(
+    track_iterator,
+    header: str,
+    excludeBelowThreshold: bool,
+    thresholds: Dict[str, float],
+    filenames,
+    fps,
+    typeFilter,
+) -> Generator[str, None, None]:
+    """
+    The rows of ``export_tracks_as_csv`` for stored track documents, formatted directly
+    from the documents and yielded in chunks of about CSV_CHUNK_SIZE.
+    """
+    frame_column = _frame_column(fps, filenames)
+    chunk = [header]
+    size = len(header)
+    for track in track_iterator:
+        pairs = _export_pairs(
+            track.get('confidencePairs') or [], excludeBelowThreshold, thresholds, typeFilter
+        )
+        if not pairs:
+            continue
+        # Text shared by every row of the track
+        track_id = track['id']
+        confidence = pairs[0][1]
+        pair_columns = ''.join(f',{_csv_field(name)},{value}' for name, value in pairs)
+        track_columns = ''.join(
+            ',' + _csv_field(f'(trk-atr) {key} {valueToString(val)}')
+            for key, val in (track.get('attributes') or {}).items()
+        )
+        interpolated_columns = f',{confidence},-1{pair_columns}{track_columns}\r\n'
+
+        features = track.get('features') or []
+        last = len(features) - 1
+        for index, feature in enumerate(features):
+            frame = feature['frame']
+            bounds = ''.join(f',{x}' for x in feature['bounds'])
+            attributes = feature.get('attributes') or {}
+            length = _export_length(attributes, feature.get('fishLength'))
+            if length is not None:
+                attributes = {**attributes, 'length': length}
+            row = [
+                f'{track_id},{frame_column(frame)},{frame}{bounds},{confidence},',
+                '-1' if length is None else str(length),
+                pair_columns,
+                *(
+                    ',' + _csv_field(f'(atr) {key} {valueToString(val)}')
+                    for key, val in attributes.items()
+                ),
+                track_columns,
+                _geometry_columns(feature.get('geometry')),
+                *(',' + _csv_field(f'(note) {note}') for note in feature.get('notes') or []),
+                '\r\n',
+            ]
+            text = ''.join(row)
+            chunk.append(text)
+            size += len(text)
+
+            if feature.get('interpolate') and index < last:
+                for frame, interpolated in _interpolated_bounds(feature, features[index + 1]):
+                    bounds = ''.join(f',{x}' for x in interpolated)
+                    text = f'{track_id},{frame_column(frame)},{frame}{bounds}{interpolated_columns}'
+                    chunk.append(text)
+                    size += len(text)
+
+            if size >= CSV_CHUNK_SIZE:
+                yield ''.join(chunk)
+                chunk = []
+                size = 0
+    yield ''.join(chunk)
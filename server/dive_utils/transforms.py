@@ -0,0 +1,174 @@
+"""
+Declarative edits applied to every annotation of a dataset.
+
+Each transform rewrites the JSON shape of a track or group in place and reports
+whether it changed anything, so callers only write the annotations it touched.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from pydantic import BaseModel, Field, validator
+from typing_extensions import Literal
+
+
+class RenameType(BaseModel):
+    """Rename types, merging them when several are renamed to the same type"""
+
+    op: Literal['renameType']
+    types: List[str]
+    to: str
+
+
+class OffsetFrames(BaseModel):
+    op: Literal['offsetFrames']
+    offset: int
+
+
+class TransformBounds(BaseModel):
+    """Scale then translate bounds, geometry and head/tail points"""
+
+    op: Literal['transformBounds']
+    scale: Tuple[float, float] = (1, 1)
+    translate: Tuple[float, float] = (0, 0)
+
+    @validator('scale')
+    @classmethod
+    def validateScale(cls, v: Tuple[float, float]):
+        if v[0] <= 0 or v[1] <= 0:
+            raise ValueError('scale must be positive')
+        return v
+
+
+class RenameAttribute(BaseModel):
+    op: Literal['renameAttribute']
+    belongs: Literal['track', 'detection']
+    name: str
+    to: str
+
+
+Transform = Union[RenameType, OffsetFrames, TransformBounds, RenameAttribute]
+
+
+class AnnotationTransformArgs(BaseModel):
+    transforms: List[Transform] = Field(..., min_items=1)
+    set: Optional[str]
+
+
+def _rename_type(annotation: Dict[str, Any], transform: RenameType) -> bool:
+    pairs = annotation.get('confidencePairs') or []
+    renamed = set(transform.types)
+    if not any(pair[0] in renamed for pair in pairs):
+        return False
+    merged: Dict[str, float] = {}
+    for name, confidence in pairs:
+        name = transform.to if name in renamed else name
+        merged[name] = max(confidence, merged.get(name, confidence))
+    # Highest confidence first, as the client and the exporters expect
+    annotation['confidencePairs'] = sorted(
+        ([name, confidence] for name, confidence in merged.items()), key=lambda pair: -pair[1]
+    )
+    return True
+
+
+def _offset_frames(annotation: Dict[str, Any], transform: OffsetFrames) -> bool:
+    offset = transform.offset
+    if not offset:
+        return False
+    if annotation.get('begin') is not None and annotation['begin'] + offset < 0:
+        raise ValueError(
+            f'id={annotation["id"]} begin={annotation["begin"]} would move before frame 0'
+        )
+    for key in ('begin', 'end'):
+        if annotation.get(key) is not None:
+            annotation[key] += offset
+    for feature in annotation.get('features') or []:
+        feature['frame'] += offset
+    for member in (annotation.get('members') or {}).values():
+        member['ranges'] = [[start + offset, end + offset] for start, end in member['ranges']]
+    return True
+
+
+def _transform_points(coordinates: Any, scale: Tuple[float, float], translate) -> list:
+    """Map the [x, y] points of a GeoJSON coordinates array of any depth"""
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        x, y, *rest = coordinates
+        return [x * scale[0] + translate[0], y * scale[1] + translate[1], *rest]
+    return [_transform_points(c, scale, translate) for c in coordinates]
+
+
+def _transform_bounds(annotation: Dict[str, Any], transform: TransformBounds) -> bool:
+    scale, translate = transform.scale, transform.translate
+    if tuple(scale) == (1, 1) and tuple(translate) == (0, 0):
+        return False
+    for feature in annotation.get('features') or []:
+        if feature.get('bounds'):
+            x1, y1, x2, y2 = feature['bounds']
+            feature['bounds'] = [
+                round(x1 * scale[0] + translate[0]),
+                round(y1 * scale[1] + translate[1]),
+                round(x2 * scale[0] + translate[0]),
+                round(y2 * scale[1] + translate[1]),
+            ]
+        for key in ('head', 'tail'):
+            if feature.get(key):
+                feature[key] = _transform_points(feature[key], scale, translate)
+        for geometry in (feature.get('geometry') or {}).get('features') or []:
+            shape = geometry['geometry']
+            shape['coordinates'] = _transform_points(shape['coordinates'], scale, translate)
+    return bool(annotation.get('features'))
+
+
+def _rename_attribute(annotation: Dict[str, Any], transform: RenameAttribute) -> bool:
+    if transform.belongs == 'track':
+        holders = [annotation.get('attributes')]
+    else:
+        holders = [feature.get('attributes') for feature in annotation.get('features') or []]
+    changed = False
+    for attributes in holders:
+        if attributes and transform.name in attributes:
+            attributes[transform.to] = attributes.pop(transform.name)
+            changed = True
+    return changed
+
+
+_TRACK_TRANSFORMS = {
+    'renameType': _rename_type,
+    'offsetFrames': _offset_frames,
+    'transformBounds': _transform_bounds,
+    'renameAttribute': _rename_attribute,
+}
+# Group types and attributes are separate from track types and attributes
+_GROUP_TRANSFORMS = {'offsetFrames': _offset_frames}
+
+
+def transform_track(track: Dict[str, Any], transforms: List[Transform]) -> bool:
+    """Apply transforms to a track in place, True if it changed"""
+    changed = False
+    for transform in transforms:
+        changed = _TRACK_TRANSFORMS[transform.op](track, transform) or changed
+    return changed
+
+
+def transform_group(group: Dict[str, Any], transforms: List[Transform]) -> bool:
+    """Apply the transforms that concern groups to a group in place, True if it changed"""
+    changed = False
+    for transform in transforms:
+        apply = _GROUP_TRANSFORMS.get(transform.op)
+        if apply is not None:
+            changed = apply(group, transform) or changed
+    return changed
+
+
+def describe(transforms: List[Transform]) -> str:
+    """Revision log description of transforms"""
+    parts = []
+    for transform in transforms:
+        if isinstance(transform, RenameType):
+            parts.append(f'rename types {", ".join(transform.types)} to {transform.to}')
+        elif isinstance(transform, OffsetFrames):
+            parts.append(f'offset frames by {transform.offset}')
+        elif isinstance(transform, TransformBounds):
+            parts.append(f'scale bounds by {transform.scale}, translate by {transform.translate}')
+        else:
+            parts.append(f'rename {transform.belongs} attribute {transform.name} to {transform.to}')
+    return 'Transform: ' + '; '.join(parts)
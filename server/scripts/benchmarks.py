@@ -0,0 +1,145 @@
+"""
+Micro-benchmarks for annotation serialization on synthetic data.
+
+Each benchmark times the reference implementation against the fast path on the same
+input and checks that both produce the same output before reporting.
+"""
+
+import json
+import random
+import time
+import tracemalloc
+from typing import Any, Callable, Dict
+
+from bson.objectid import ObjectId
+import click
+
+from dive_utils import models
+from dive_utils.serializers import dive, kwcoco, viame
+
+
+def stored_tracks(track_count: int, track_length: int, types: int = 10, seed: int = 0):
+    """Track documents shaped like the ones read back from the trackItem collection"""
+    rng = random.Random(seed)
+    dataset = ObjectId()
+    tracks = []
+    for id in range(track_count):
+        begin = rng.randint(0, 1000)
+        features = []
+        for frame in range(begin, begin + track_length):
+            x, y = rng.randint(0, 1800), rng.randint(0, 1000)
+            features.append(
+                {
+                    'frame': frame,
+                    'bounds': [x, y, x + rng.randint(10, 120), y + rng.randint(10, 120)],
+                    'attributes': {},
+                    'keyframe': True,
+                    'interpolate': False,
+                }
+            )
+        tracks.append(
+            {
+                '_id': ObjectId(),
+                'dataset': dataset,
+                'rev_created': 1,
+                'id': id,
+                'begin': begin,
+                'end': begin + track_length - 1,
+                'confidencePairs': [[f'type_{rng.randrange(types)}', rng.random()]],
+                'attributes': {},
+                'features': features,
+            }
+        )
+    return tracks
+
+
+def best_of(repeat: int, func: Callable[[], Any]) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def compare(label: str, repeat: int, cases: Dict[str, Callable[[], Any]]) -> Dict[str, float]:
+    """Run each case, require identical results, and report timings relative to the first"""
+    # Compare as json, where tuples and lists are the same
+    results = [json.dumps(func()) for func in cases.values()]
+    if any(result != results[0] for result in results[1:]):
+        raise click.ClickException(f'{label}: implementations disagree')
+    timings = {name: best_of(repeat, func) for name, func in cases.items()}
+    reference = next(iter(timings.values()))
+    click.echo(label)
+    for name, seconds in timings.items():
+        click.echo(f'  {name:<12} {seconds * 1000:10.1f} ms  {reference / seconds:6.1f}x')
+    return timings
+
+
+def peak_memory(func: Callable[[], Any]) -> int:
+    """Peak bytes allocated while running func, beyond its input"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def serialize(track_count: int, track_length: int, repeat: int) -> Dict[str, float]:
+    """Stored documents to DIVE json: pydantic validation against the trusted serializer"""
+    tracks = stored_tracks(track_count, track_length)
+    return compare(
+        f'serialize {track_count} tracks x {track_length} features',
+        repeat,
+        {
+            'pydantic': lambda: [models.Track(**t).dict(exclude_none=True) for t in tracks],
+            'trusted': lambda: [dive.serialize_track(t) for t in tracks],
+        },
+    )
+
+
+def export_csv(track_count: int, track_length: int, repeat: int) -> Dict[str, float]:
+    """Stored documents to VIAME CSV, validating each track or formatting it directly"""
+    tracks = stored_tracks(track_count, track_length)
+    filenames = [f'{frame:06d}.png' for frame in range(1000 + track_length)]
+    timings = {}
+    for column, options in (('image names', {'filenames': filenames}), ('timestamps', {'fps': 30})):
+
+        def run(trusted: bool) -> str:
+            rows = viame.export_tracks_as_csv(tracks, header=False, trusted=trusted, **options)
+            return ''.join(rows)
+
+        results = compare(
+            f'VIAME CSV export {track_count} tracks x {track_length} features, {column}',
+            repeat,
+            {'pydantic': lambda: run(False), 'trusted': lambda: run(True)},
+        )
+        timings.update({f'{name} ({column})': seconds for name, seconds in results.items()})
+    return timings
+
+
+def export_coco(track_count: int, track_length: int, repeat: int) -> Dict[str, float]:
+    """Stored documents to COCO json, as one document or streamed in two passes"""
+    tracks = stored_tracks(track_count, track_length)
+    image_filenames = {frame: f'{frame:06d}.png' for frame in range(1000 + track_length)}
+
+    def document() -> str:
+        return json.dumps(kwcoco.export_dive_as_coco(tracks, image_filenames, 'benchmark'))
+
+    def stream() -> str:
+        chunks = kwcoco.stream_dive_as_coco(tracks, tracks, image_filenames.get, 'benchmark')
+        return ''.join(chunks)
+
+    def drain() -> None:
+        for _ in kwcoco.stream_dive_as_coco(tracks, tracks, image_filenames.get, 'benchmark'):
+            pass
+
+    timings = compare(
+        f'COCO export {track_count} tracks x {track_length} features',
+        repeat,
+        {'document': document, 'streamed': stream},
+    )
+    for name, func in (('document', document), ('streamed', drain)):
+        click.echo(f'  {name:<12} {peak_memory(func) / (1 << 20):10.1f} MB peak')
+    return timings
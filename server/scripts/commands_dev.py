@@ -10,7 +10,7 @@ import os
 import click
 from girder_client import GirderClient
 
-from scripts import cli, generateLargeDataset
+from scripts import benchmarks, cli, generateLargeDataset
 
 
 def get_girder_client() -> GirderClient:
@@ -61,3 +61,30 @@ def generate_dataset(
         width,
         height,
     )
+
+
+@cli.group(name='benchmark', help="Time annotation serialization on synthetic data")
+@click.option('--tracks', default=1000, help='Number of Tracks')
+@click.option('--track_length', default=200, help='Features per Track')
+@click.option('--repeat', default=3, help='Best of this many runs')
+@click.pass_context
+def benchmark(ctx, tracks, track_length, repeat):
+    ctx.obj = {'track_count': tracks, 'track_length': track_length, 'repeat': repeat}
+
+
+@benchmark.command(name='serialize', help="Stored tracks to DIVE json")
+@click.pass_obj
+def benchmark_serialize(options):
+    benchmarks.serialize(**options)
+
+
+@benchmark.command(name='export-csv', help="Stored tracks to VIAME CSV")
+@click.pass_obj
+def benchmark_export_csv(options):
+    benchmarks.export_csv(**options)
+
+
+@benchmark.command(name='export-coco', help="Stored tracks to COCO json")
+@click.pass_obj
+def benchmark_export_coco(options):
+    benchmarks.export_coco(**options)
@@ -9,8 +9,15 @@ from scripts import cli
 def migrate_server(dry_run, limit):
     """
     Migration script is idempotent.
+
+    Counts the labels of datasets saved before label summaries existed, which the
+    label library leaves out until then.
     """
-    pass
+    from dive_server.crud_annotation import count_legacy_labels
+
+    counted = count_legacy_labels(limit=limit, dry_run=dry_run)
+    verb = 'would count' if dry_run else 'counted'
+    click.echo(f'{verb} the labels of {len(counted)} datasets')
 
 
 if __name__ == "__main__":
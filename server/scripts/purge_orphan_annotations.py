@@ -0,0 +1,58 @@
+import click
+
+from scripts import cli
+
+
+@cli.command(name="purge-orphan-annotations")
+@click.option('--dry-run', is_flag=True)
+@click.option('--batch-size', type=click.INT, default=1000)
+def purge_orphan_annotations(dry_run, batch_size):
+    """
+    Delete annotations and revisions whose dataset folder no longer exists.
+
+    Datasets deleted before annotation cleanup was bound to folder removal left
+    their records behind.  The sweep is idempotent.
+    """
+    from girder.models.folder import Folder
+
+    from dive_server.crud_annotation import (
+        DATASET,
+        GroupItem,
+        LabelSummaryItem,
+        RevisionHeadItem,
+        RevisionLogItem,
+        TrackChunkItem,
+        TrackItem,
+        delete_annotations,
+    )
+
+    dataset_ids = set()
+    for model in (
+        TrackItem(),
+        TrackChunkItem(),
+        GroupItem(),
+        RevisionLogItem(),
+        RevisionHeadItem(),
+        LabelSummaryItem(),
+    ):
+        for result in model.collection.aggregate([{'$group': {'_id': f'${DATASET}'}}]):
+            dataset_ids.add(result['_id'])
+    existing = set()
+    candidates = list(dataset_ids)
+    for start in range(0, len(candidates), batch_size):
+        chunk = candidates[start : start + batch_size]
+        for folder in Folder().find({'_id': {'$in': chunk}}, fields=['_id']):
+            existing.add(folder['_id'])
+
+    orphans = dataset_ids - existing
+    click.echo(f'Found {len(orphans)} orphaned datasets out of {len(dataset_ids)}')
+    for dataset_id in orphans:
+        if dry_run:
+            click.echo(f'would purge {dataset_id}')
+            continue
+        removed = delete_annotations(dataset_id, batch_size=batch_size)
+        click.echo(f'purged {dataset_id}: {removed}')
+
+
+if __name__ == "__main__":
+    purge_orphan_annotations()
@@ -0,0 +1,173 @@
+"""In-memory stand-in for the subset of pymongo used by the annotation collections."""
+
+from copy import deepcopy
+import itertools
+from types import SimpleNamespace
+
+import pymongo
+
+_MISSING = object()
+_ids = itertools.count()
+
+
+def _compare(value, operator, operand):
+    if operator == '$exists':
+        return (value is not _MISSING) == operand
+    if operator == '$in':
+        if isinstance(value, list):
+            return any(v in operand for v in value)
+        return value in operand
+    if operator == '$nin':
+        return not _compare(value, '$in', operand)
+    if operator == '$ne':
+        return not _compare(value, '$eq', operand)
+    if operator == '$elemMatch':
+        if not isinstance(value, list):
+            return False
+        # Array elements are matched by position, like the '0' in {'0': 'fish'}
+        return any(
+            matches(dict(enumerate(v)) if isinstance(v, list) else v, _positions(operand))
+            for v in value
+            if isinstance(v, (dict, list))
+        )
+    if operator == '$eq':
+        if isinstance(value, list) and not isinstance(operand, list):
+            return operand in value
+        return (None if value is _MISSING else value) == operand
+    if value is _MISSING or value is None:
+        return False
+    values = value if isinstance(value, list) else [value]
+    checks = {
+        '$gt': lambda v: v > operand,
+        '$gte': lambda v: v >= operand,
+        '$lt': lambda v: v < operand,
+        '$lte': lambda v: v <= operand,
+    }
+    return any(checks[operator](v) for v in values)
+
+
+def _positions(query: dict) -> dict:
+    """Key array positions as ints, to match elements converted by dict(enumerate())"""
+    converted = {}
+    for key, condition in query.items():
+        if key in ('$and', '$or'):
+            converted[key] = [_positions(q) for q in condition]
+        else:
+            converted[int(key) if key.isdigit() else key] = condition
+    return converted
+
+
+def matches(doc: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        if key == '$and':
+            if not all(matches(doc, q) for q in condition):
+                return False
+        elif key == '$or':
+            if not any(matches(doc, q) for q in condition):
+                return False
+        elif isinstance(condition, dict) and condition and next(iter(condition)).startswith('$'):
+            value = doc.get(key, _MISSING)
+            if not all(_compare(value, op, operand) for op, operand in condition.items()):
+                return False
+        elif not _compare(doc.get(key, _MISSING), '$eq', condition):
+            return False
+    return True
+
+
+def apply_update(doc: dict, update: dict):
+    for field, value in update.get('$set', {}).items():
+        doc[field] = value
+    for field in update.get('$unset', {}):
+        doc.pop(field, None)
+    for field, value in update.get('$inc', {}).items():
+        doc[field] = doc.get(field, 0) + value
+    for field, value in update.get('$max', {}).items():
+        doc[field] = max(doc.get(field, value), value)
+    for field, value in update.get('$min', {}).items():
+        doc[field] = min(doc.get(field, value), value)
+    for field, value in update.get('$addToSet', {}).items():
+        existing = doc.setdefault(field, [])
+        if value not in existing:
+            existing.append(value)
+    for field, condition in update.get('$pull', {}).items():
+        if field in doc:
+            if isinstance(condition, dict):
+                doc[field] = [v for v in doc[field] if not matches({'v': v}, {'v': condition})]
+            else:
+                doc[field] = [v for v in doc[field] if v != condition]
+
+
+class FakeCollection:
+    """Holds documents and evaluates queries like a pymongo collection."""
+
+    def __init__(self, docs=()):
+        self.docs = []
+        self.insert_many(docs)
+
+    def insert_many(self, docs):
+        for doc in docs:
+            doc = deepcopy(doc)
+            doc.setdefault('_id', next(_ids))
+            self.docs.append(doc)
+
+    def find(self, query=None, projection=None, sort=None, limit=0, **_kwargs):
+        found = [deepcopy(doc) for doc in self.docs if matches(doc, query or {})]
+        for key, direction in reversed(sort or []):
+            found.sort(key=lambda doc: doc.get(key), reverse=direction < 0)
+        return found[:limit] if limit else found
+
+    def find_one(self, query=None, projection=None, sort=None):
+        found = self.find(query, sort=sort)
+        return found[0] if found else None
+
+    def distinct(self, key, query=None):
+        values = []
+        for doc in self.find(query):
+            if key in doc and doc[key] not in values:
+                values.append(doc[key])
+        return values
+
+    def count_documents(self, query):
+        return len(self.find(query))
+
+    def update_one(self, query, update, upsert=False):
+        for doc in self.docs:
+            if matches(doc, query):
+                apply_update(doc, update)
+                return SimpleNamespace(modified_count=1)
+        if upsert:
+            doc = {k: v for k, v in query.items() if not k.startswith('$')}
+            apply_update(doc, update)
+            self.insert_many([doc])
+        return SimpleNamespace(modified_count=0)
+
+    def update_many(self, query, update):
+        modified = 0
+        for doc in self.docs:
+            if matches(doc, query):
+                apply_update(doc, update)
+                modified += 1
+        return SimpleNamespace(modified_count=modified)
+
+    def bulk_write(self, operations, ordered=True):
+        result = {'nInserted': 0, 'nModified': 0}
+        for operation in operations:
+            if isinstance(operation, pymongo.InsertOne):
+                self.insert_many([operation._doc])
+                result['nInserted'] += 1
+            elif isinstance(operation, pymongo.UpdateOne):
+                modified = self.update_one(
+                    operation._filter, operation._doc, upsert=bool(operation._upsert)
+                ).modified_count
+                result['nModified'] += modified
+            elif isinstance(operation, pymongo.UpdateMany):
+                modified = self.update_many(operation._filter, operation._doc).modified_count
+                result['nModified'] += modified
+            else:
+                raise NotImplementedError(type(operation))
+        return SimpleNamespace(bulk_api_result=result)
+
+    def delete_many(self, query):
+        before = len(self.docs)
+        self.docs = [doc for doc in self.docs if not matches(doc, query)]
+        return SimpleNamespace(deleted_count=before - len(self.docs))
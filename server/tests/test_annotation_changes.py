@@ -0,0 +1,92 @@
+from unittest.mock import MagicMock, patch
+
+from fake_mongo import FakeCollection
+from girder.exceptions import RestException
+import pytest
+
+from dive_server import crud_annotation
+from dive_server.crud_annotation import (
+    DATASET,
+    HEAD,
+    IDENTIFIER,
+    REVISION_CREATED,
+    REVISION_DELETED,
+    SNAPSHOTS,
+)
+
+DATASET_FOLDER = {'_id': 'dataset-id'}
+
+
+def track(identifier, created, deleted=None):
+    doc = {
+        IDENTIFIER: identifier,
+        DATASET: 'dataset-id',
+        REVISION_CREATED: created,
+        'begin': 0,
+        'end': 0,
+        'confidencePairs': [],
+        'attributes': {},
+        'features': [],
+    }
+    if deleted is not None:
+        doc[REVISION_DELETED] = deleted
+    return doc
+
+
+def model_over(cls, collection):
+    model = object.__new__(cls)
+    model.collection = collection
+    model.find = lambda query=None, sort=None, **kwargs: collection.find(query, sort=sort)
+    return model
+
+
+@pytest.fixture
+def annotations():
+    # Revision 1 creates 0-3, revision 2 updates 1 and deletes 2, revision 3 creates 4
+    # and deletes 0, revision 4 creates 5 and deletes it again in revision 5.
+    tracks = FakeCollection(
+        [
+            track(0, 1, 3),
+            track(1, 1, 2),
+            track(1, 2),
+            track(2, 1, 2),
+            track(3, 1),
+            track(4, 3),
+            track(5, 4, 5),
+        ]
+    )
+    heads = MagicMock()
+    heads.get.return_value = {HEAD: 5, SNAPSHOTS: []}
+    heads.head.return_value = 5
+    track_model = model_over(crud_annotation.TrackItem, tracks)
+    group_model = model_over(crud_annotation.GroupItem, FakeCollection())
+    with (
+        patch('dive_server.crud_annotation.RevisionHeadItem', return_value=heads),
+        patch('dive_server.crud_annotation.LabelSummaryItem'),
+        patch('dive_server.crud_annotation.TrackItem', return_value=track_model),
+        patch('dive_server.crud_annotation.GroupItem', return_value=group_model),
+    ):
+        yield heads
+
+
+def changed(since):
+    changes = crud_annotation.get_changes(DATASET_FOLDER, since)
+    upserted = [t['id'] for t in changes['tracks']['upserted']]
+    return upserted, changes['tracks']['deleted']
+
+
+def test_changes_since_revision(annotations):
+    assert changed(0) == ([1, 3, 4], [0, 2, 5])
+    assert changed(1) == ([1, 4], [0, 2, 5])
+    assert changed(2) == ([4], [0, 5])
+    assert changed(4) == ([], [5])
+    changes = crud_annotation.get_changes(DATASET_FOLDER, 5)
+    assert changes['revision'] == 5
+    assert changes['tracks'] == {'upserted': [], 'deleted': []}
+    assert changes['groups'] == {'upserted': [], 'deleted': []}
+
+
+def test_changes_before_compaction_are_refused(annotations):
+    annotations.require_readable.side_effect = RestException('compacted')
+    with pytest.raises(RestException):
+        crud_annotation.get_changes(DATASET_FOLDER, 0)
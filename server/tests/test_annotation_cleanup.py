@@ -0,0 +1,57 @@
+from contextlib import ExitStack
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from fake_mongo import FakeCollection
+
+from dive_server import crud_annotation, event
+from dive_server.crud_annotation import DATASET, IDENTIFIER
+
+
+def model_over(cls, name, collection):
+    model = object.__new__(cls)
+    model.name = name
+    model.collection = collection
+    return model
+
+
+def test_delete_annotations_removes_only_the_dataset():
+    docs = [{DATASET: dataset, IDENTIFIER: i} for dataset in ('gone', 'kept') for i in range(5)]
+    collections = {
+        name: FakeCollection(docs)
+        for name in (
+            'trackItem',
+            'trackChunkItem',
+            'groupItem',
+            'revisionLogItem',
+            'revisionHeadItem',
+            'labelSummaryItem',
+        )
+    }
+    classes = (
+        'TrackItem',
+        'TrackChunkItem',
+        'GroupItem',
+        'RevisionLogItem',
+        'RevisionHeadItem',
+        'LabelSummaryItem',
+    )
+    with ExitStack() as stack:
+        for cls, (name, collection) in zip(classes, collections.items()):
+            model = model_over(getattr(crud_annotation, cls), name, collection)
+            stack.enter_context(patch(f'dive_server.crud_annotation.{cls}', return_value=model))
+        removed = crud_annotation.delete_annotations('gone', batch_size=2)
+
+    assert removed == {name: 5 for name in collections}
+    for collection in collections.values():
+        assert {doc[DATASET] for doc in collection.docs} == {'kept'}
+
+
+@patch('dive_tasks.local_tasks.delete_dataset_annotations')
+def test_cleanup_runs_only_for_datasets(delete_task):
+    event.cleanup_dataset_annotations(SimpleNamespace(info={'_id': 'plain', 'meta': {}}))
+    delete_task.delay.assert_not_called()
+
+    dataset = {'_id': 'dataset-id', 'meta': {'annotate': True}}
+    event.cleanup_dataset_annotations(SimpleNamespace(info=dataset))
+    delete_task.delay.assert_called_once_with('dataset-id')
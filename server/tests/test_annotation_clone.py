@@ -0,0 +1,185 @@
+from unittest.mock import MagicMock, patch
+
+from bson.objectid import ObjectId
+from fake_mongo import FakeCollection
+import pytest
+
+from dive_server import crud_annotation
+from dive_server.crud_annotation import (
+    BASE_DATASET,
+    BASE_REVISION,
+    DATASET,
+    HEAD,
+    IDENTIFIER,
+    REVISION_CREATED,
+    REVISION_DELETED,
+    SNAPSHOTS,
+)
+
+SOURCE = {'_id': ObjectId()}
+CLONE = {'_id': ObjectId()}
+USER = {'login': 'user', '_id': ObjectId()}
+
+
+def make_track(id, x=0):
+    return {
+        'id': id,
+        'begin': 0,
+        'end': 0,
+        'confidencePairs': [['fish', 1.0]],
+        'attributes': {},
+        'features': [{'frame': 0, 'bounds': [x, 0, 10, 10]}],
+    }
+
+
+def stored(track, dataset, created, deleted=None):
+    doc = {**track, DATASET: dataset['_id'], REVISION_CREATED: created}
+    doc[crud_annotation.HASH] = crud_annotation.content_hash(track)
+    if deleted is not None:
+        doc[REVISION_DELETED] = deleted
+    return doc
+
+
+def model_over(cls, collection):
+    model = object.__new__(cls)
+    model.collection = collection
+
+    def find(query=None, offset=0, limit=0, sort=None, fields=None):
+        return collection.find(query, sort=sort)[offset:][: limit or None]
+
+    model.find = find
+    return model
+
+
+@pytest.fixture
+def tracks():
+    # Source revision 1 creates tracks 1-3, revision 3 deletes 2 and creates 4
+    collection = FakeCollection(
+        [
+            stored(make_track(1), SOURCE, 1),
+            stored(make_track(2), SOURCE, 1, 3),
+            stored(make_track(3), SOURCE, 1),
+            stored(make_track(4), SOURCE, 3),
+        ]
+    )
+    states = {
+        SOURCE['_id']: {HEAD: 3, SNAPSHOTS: []},
+        CLONE['_id']: {HEAD: 0, SNAPSHOTS: []},
+    }
+    heads = MagicMock()
+    heads.get.side_effect = lambda folder, set=None: states[folder['_id']]
+    heads.head.side_effect = lambda folder, set=None: states[folder['_id']][HEAD]
+    heads.allocate.side_effect = lambda folder: states[folder['_id']][HEAD] + 1
+
+    def commit(folder, revision, set=None, lease=None):
+        states[folder['_id']][HEAD] = revision
+
+    def set_base(folder, base, revision):
+        states[folder['_id']].update({BASE_DATASET: base['_id'], BASE_REVISION: revision})
+
+    heads.commit.side_effect = commit
+    heads.set_base.side_effect = set_base
+    heads.clear_base.side_effect = lambda folder: states[folder['_id']].pop(BASE_DATASET)
+    track_model = model_over(crud_annotation.TrackItem, collection)
+    chunk_model = model_over(crud_annotation.TrackChunkItem, FakeCollection())
+    group_model = model_over(crud_annotation.GroupItem, FakeCollection())
+    with (
+        patch('dive_server.crud_annotation.RevisionHeadItem', return_value=heads),
+        patch('dive_server.crud_annotation.LabelSummaryItem'),
+        patch(
+            'dive_server.crud_annotation.RevisionLogItem',
+            **{'return_value.latest_entry.return_value': None},
+        ),
+        patch('dive_server.crud_annotation.TrackItem', return_value=track_model),
+        patch('dive_server.crud_annotation.TrackChunkItem', return_value=chunk_model),
+        patch('dive_server.crud_annotation.GroupItem', return_value=group_model),
+    ):
+        yield collection
+
+
+def visible(revision=None, **kwargs):
+    listed = crud_annotation.TrackItem().list(CLONE, revision=revision, **kwargs)
+    return [(track[IDENTIFIER], track['features'][0]['bounds'][0]) for track in listed]
+
+
+def test_clone_reads_base_and_stores_only_edits(tracks):
+    crud_annotation.clone_annotations(SOURCE, CLONE, USER, revision=2)
+    assert not [doc for doc in tracks.docs if doc[DATASET] == CLONE['_id']]
+    assert visible() == [(1, 0), (2, 0), (3, 0)]
+
+    result = crud_annotation.save_annotations(
+        CLONE, USER, upsert_tracks=[make_track(1, x=5), make_track(3)], delete_tracks=[2]
+    )
+    assert result == {'updated': 1, 'deleted': 1}
+    assert len([doc for doc in tracks.docs if doc[DATASET] == CLONE['_id']]) == 2
+
+    assert visible() == [(1, 5), (3, 0)]
+    assert visible(revision=0) == [(1, 0), (2, 0), (3, 0)]
+    assert visible(limit=1, offset=1) == [(3, 0)]
+    assert visible(limit=1, after=1) == [(3, 0)]
+    assert crud_annotation.TrackItem().count(CLONE) == 2
+
+
+def test_materialized_clone_reads_the_same(tracks):
+    crud_annotation.clone_annotations(SOURCE, CLONE, USER, revision=2)
+    crud_annotation.save_annotations(CLONE, USER, upsert_tracks=[make_track(1, x=5)])
+    crud_annotation.save_annotations(CLONE, USER, delete_tracks=[2])
+    before = {revision: visible(revision) for revision in range(3)}
+
+    crud_annotation.materialize_base(CLONE)
+    tracks.docs = [doc for doc in tracks.docs if doc[DATASET] == CLONE['_id']]
+    assert {revision: visible(revision) for revision in range(3)} == before
+
+
+def test_materialized_clone_reads_its_snapshots_the_same(tracks):
+    states = crud_annotation.RevisionHeadItem().get
+
+    def add_snapshot(folder, revision):
+        states(folder)[SNAPSHOTS].append(revision)
+        return []
+
+    crud_annotation.RevisionHeadItem().add_snapshot.side_effect = add_snapshot
+    crud_annotation.clone_annotations(SOURCE, CLONE, USER, revision=2)
+    crud_annotation.save_annotations(CLONE, USER, upsert_tracks=[make_track(1, x=5)])
+    crud_annotation.take_snapshot(CLONE, 1)
+    crud_annotation.save_annotations(CLONE, USER, delete_tracks=[2])
+    crud_annotation.take_snapshot(CLONE, 2)
+    before = {revision: visible(revision) for revision in range(3)}
+    assert before[1] == [(1, 5), (2, 0), (3, 0)]
+
+    crud_annotation.materialize_base(CLONE)
+    tracks.docs = [doc for doc in tracks.docs if doc[DATASET] == CLONE['_id']]
+    assert states(CLONE)[SNAPSHOTS] == [1, 2]
+    assert {revision: visible(revision) for revision in range(3)} == before
+
+
+def test_clone_with_many_replaced_ids_reads_in_bounded_batches(tracks):
+    tracks.insert_many(stored(make_track(id), SOURCE, 3) for id in range(10, 510))
+    crud_annotation.clone_annotations(SOURCE, CLONE, USER)
+    edited = range(10, 500, 2)
+    crud_annotation.save_annotations(
+        CLONE,
+        USER,
+        upsert_tracks=[make_track(id, x=5) for id in edited],
+        delete_tracks=list(range(11, 500, 2)),
+    )
+    largest = []
+    find = tracks.find
+
+    def spy(query=None, *args, **kwargs):
+        ids = (query or {}).get(IDENTIFIER)
+        if isinstance(ids, dict):
+            largest.append(len(ids.get('$in', ids.get('$nin', []))))
+        return find(query, *args, **kwargs)
+
+    with (
+        patch.object(crud_annotation.TrackItem(), 'REPLACED_READ_BATCH', 100),
+        patch.object(tracks, 'find', side_effect=spy),
+        patch.object(tracks, 'distinct', side_effect=AssertionError('distinct')),
+    ):
+        expected = [(1, 0), (3, 0), (4, 0)] + [(id, 5) for id in edited]
+        expected += [(id, 0) for id in range(500, 510)]
+        assert visible() == expected
+        assert visible(limit=3, offset=246) == expected[246:249]
+        assert crud_annotation.TrackItem().count(CLONE) == len(expected)
+    assert max(largest) <= 100
@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta
+import random
+from unittest.mock import MagicMock, patch
+
+from fake_mongo import FakeCollection
+import pytest
+
+from dive_server import crud_annotation
+from dive_server.crud_annotation import (
+    DATASET,
+    IDENTIFIER,
+    REVISION,
+    REVISION_CREATED,
+    REVISION_DELETED,
+    SET,
+)
+
+DATASET_FOLDER = {'_id': 'dataset-id', 'name': 'dataset'}
+HEAD = 30
+
+
+def make_history(seed=0):
+    rng = random.Random(seed)
+    docs = []
+    for revision in range(1, HEAD + 1):
+        for identifier in rng.sample(range(10), 3):
+            for doc in docs:
+                if doc[IDENTIFIER] == identifier and REVISION_DELETED not in doc:
+                    doc[REVISION_DELETED] = revision
+            docs.append({IDENTIFIER: identifier, DATASET: 'dataset-id', REVISION_CREATED: revision})
+    return docs
+
+
+def live_ids(docs, head):
+    return sorted(
+        doc[IDENTIFIER]
+        for doc in docs
+        if doc[REVISION_CREATED] <= head and doc.get(REVISION_DELETED, head + 1) > head
+    )
+
+
+def model_over(cls, collection):
+    model = object.__new__(cls)
+    model.collection = collection
+    model.find = lambda query, sort=None, **kwargs: collection.find(query, sort=sort)
+    model.findOne = lambda query, sort=None: collection.find_one(query, sort=sort)
+    return model
+
+
+@pytest.fixture
+def history():
+    now = datetime.utcnow()
+    tracks = FakeCollection(make_history())
+    log = FakeCollection(
+        {
+            DATASET: 'dataset-id',
+            REVISION: revision,
+            SET: 'alt' if revision % 10 == 0 else '',
+            'additions': 3,
+            'deletions': 3,
+            'description': 'save',
+            'created': now - timedelta(days=HEAD - revision),
+        }
+        for revision in range(1, HEAD + 1)
+    )
+    heads = MagicMock()
+    heads.head.return_value = HEAD
+    track_model = model_over(crud_annotation.TrackItem, tracks)
+    chunk_model = model_over(crud_annotation.TrackChunkItem, FakeCollection())
+    group_model = model_over(crud_annotation.GroupItem, FakeCollection())
+    log_model = model_over(crud_annotation.RevisionLogItem, log)
+    with (
+        patch('dive_server.crud_annotation.RevisionHeadItem', return_value=heads),
+        patch('dive_server.crud_annotation.LabelSummaryItem'),
+        patch('dive_server.crud_annotation.TrackItem', return_value=track_model),
+        patch('dive_server.crud_annotation.TrackChunkItem', return_value=chunk_model),
+        patch('dive_server.crud_annotation.GroupItem', return_value=group_model),
+        patch('dive_server.crud_annotation.RevisionLogItem', return_value=log_model),
+    ):
+        yield tracks, log, heads
+
+
+def test_retention_revision(history):
+    assert crud_annotation.retention_revision(DATASET_FOLDER, keep_revisions=5) == 26
+    assert crud_annotation.retention_revision(DATASET_FOLDER, keep_revisions=0) == HEAD
+    assert crud_annotation.retention_revision(DATASET_FOLDER, keep_revisions=100) == 0
+    assert crud_annotation.retention_revision(DATASET_FOLDER, keep_days=3.5) == 27
+    # The rule that keeps more history wins
+    assert (
+        crud_annotation.retention_revision(DATASET_FOLDER, keep_revisions=10, keep_days=3.5) == 21
+    )
+    with pytest.raises(ValueError):
+        crud_annotation.retention_revision(DATASET_FOLDER)
+
+
+def test_compaction_keeps_retained_revisions_intact(history):
+    tracks, log, heads = history
+    expected = {head: live_ids(tracks.docs, head) for head in range(20, HEAD + 1)}
+    progress = MagicMock()
+
+    stats = crud_annotation.compact_annotations(
+        DATASET_FOLDER, keep_revisions=11, batch_size=4, progress=progress
+    )
+
+    assert stats['retainFrom'] == 20
+    heads.compact.assert_called_once_with(DATASET_FOLDER, 20)
+    assert all(doc.get(REVISION_DELETED, HEAD + 1) > 20 for doc in tracks.docs)
+    assert stats['tracksRemoved'] > 0 and stats['groupsRemoved'] == 0
+    assert progress.call_args.args == (stats['tracksRemoved'],)
+    for head, ids in expected.items():
+        assert live_ids(tracks.docs, head) == ids
+
+    # Entries up to revision 20 collapse into the newest entry of each set
+    revisions = sorted(entry[REVISION] for entry in log.docs)
+    assert revisions == [19, 20] + list(range(21, HEAD + 1))
+    assert stats['revisionsSquashed'] == 18
+    squashed = {entry[REVISION]: entry for entry in log.docs}
+    assert squashed[20]['additions'] == 6
+    assert squashed[19]['additions'] == 18 * 3
+    assert squashed[19]['description'] == 'save (squashed 18 revisions)'
+
+
+def test_compaction_is_resumable(history):
+    tracks, _log, _heads = history
+    first = crud_annotation.compact_annotations(DATASET_FOLDER, keep_revisions=11)
+    remaining = len(tracks.docs)
+    second = crud_annotation.compact_annotations(DATASET_FOLDER, keep_revisions=11)
+    assert first['tracksRemoved'] > 0
+    assert second['tracksRemoved'] == 0
+    assert len(tracks.docs) == remaining
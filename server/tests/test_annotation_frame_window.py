@@ -0,0 +1,34 @@
+from fake_mongo import FakeCollection
+
+from dive_server.crud_annotation import BEGIN, END, IDENTIFIER, TrackItem
+
+TRACKS = [
+    {IDENTIFIER: 0, BEGIN: 0, END: 9},
+    {IDENTIFIER: 1, BEGIN: 10, END: 19},
+    {IDENTIFIER: 2, BEGIN: 5, END: 25},
+    {IDENTIFIER: 3, BEGIN: 30, END: 30},
+]
+
+
+def window_ids(frame_start, frame_end):
+    found = FakeCollection(TRACKS).find(TrackItem.frame_window(frame_start, frame_end))
+    return sorted(doc[IDENTIFIER] for doc in found)
+
+
+def test_frame_window_overlap():
+    assert window_ids(None, None) == [0, 1, 2, 3]
+    assert window_ids(9, 10) == [0, 1, 2]
+    assert window_ids(20, 29) == [2]
+    assert window_ids(26, None) == [3]
+    assert window_ids(None, 4) == [0]
+    assert window_ids(31, 40) == []
+
+
+def test_frame_window_fields():
+    assert TrackItem.frame_window_fields(None, None) == TrackItem.PROJECT_FIELDS
+    fields = TrackItem.frame_window_fields(10, None)
+    assert fields['features']['$filter']['cond'] == {'$and': [{'$gte': ['$$feature.frame', 10]}]}
+    fields = TrackItem.frame_window_fields(10, 20)
+    assert fields['features']['$filter']['input'] == '$features'
+    assert fields['features']['$filter']['cond']['$and'][1] == {'$lte': ['$$feature.frame', 20]}
+    assert fields['_id'] == 0 and fields[IDENTIFIER] == 1
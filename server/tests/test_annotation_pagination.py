@@ -0,0 +1,106 @@
+from unittest.mock import MagicMock, patch
+
+from fake_mongo import FakeCollection
+from girder.exceptions import RestException
+import pymongo
+import pytest
+
+from dive_server import crud_annotation
+from dive_server.crud_annotation import (
+    COUNT_ESTIMATED,
+    COUNT_EXACT,
+    COUNT_NONE,
+    DATASET,
+    HEAD,
+    IDENTIFIER,
+    REVISION,
+    REVISION_CREATED,
+    SET,
+    SNAPSHOTS,
+)
+
+DATASET_FOLDER = {'_id': 'dataset-id'}
+
+
+def model_over(cls, collection):
+    model = object.__new__(cls)
+    model.collection = collection
+
+    def find(query=None, offset=0, limit=0, sort=None, fields=None):
+        return collection.find(query, sort=sort)[offset:][: limit or None]
+
+    model.find = find
+    return model
+
+
+@pytest.fixture
+def annotations():
+    tracks = FakeCollection(
+        {IDENTIFIER: i, DATASET: 'dataset-id', REVISION_CREATED: 1, SET: None} for i in range(23)
+    )
+    log = FakeCollection(
+        {DATASET: 'dataset-id', REVISION: i, SET: 'alt' if i % 2 else ''} for i in range(1, 11)
+    )
+    heads = MagicMock()
+    heads.get.return_value = {HEAD: 10, SNAPSHOTS: []}
+    heads.head.return_value = 12
+    track_model = model_over(crud_annotation.TrackItem, tracks)
+    log_model = model_over(crud_annotation.RevisionLogItem, log)
+    with (
+        patch('dive_server.crud_annotation.RevisionHeadItem', return_value=heads),
+        patch('dive_server.crud_annotation.TrackItem', return_value=track_model),
+        patch('dive_server.crud_annotation.RevisionLogItem', return_value=log_model),
+    ):
+        yield
+
+
+def test_continuation_token_roundtrip():
+    token = crud_annotation.encode_continuation(41)
+    assert crud_annotation.decode_continuation(token) == 41
+    with pytest.raises(RestException):
+        crud_annotation.decode_continuation('not a token')
+
+
+def test_keyset_requires_sort_on_key():
+    assert crud_annotation.keyset_filter([(IDENTIFIER, 1)], IDENTIFIER, 5) == {
+        IDENTIFIER: {'$gt': 5}
+    }
+    assert crud_annotation.keyset_filter([(REVISION, pymongo.DESCENDING)], REVISION, 5) == {
+        REVISION: {'$lt': 5}
+    }
+    with pytest.raises(RestException):
+        crud_annotation.keyset_filter([('name', 1)], IDENTIFIER, 5)
+
+
+def test_track_pages_follow_continuation(annotations):
+    seen, after, pages = [], None, 0
+    while True:
+        cursor = crud_annotation.TrackItem().list(DATASET_FOLDER, limit=5, after=after)
+        page, token = crud_annotation.paginate(cursor, 5, IDENTIFIER)
+        seen.extend(doc[IDENTIFIER] for doc in page)
+        pages += 1
+        if token is None:
+            break
+        after = crud_annotation.decode_continuation(token)
+    assert seen == list(range(23))
+    assert pages == 5
+    assert crud_annotation.TrackItem().count(DATASET_FOLDER) == 23
+
+
+def test_revision_log_pages_and_counts(annotations):
+    log = crud_annotation.RevisionLogItem()
+    cursor, total = log.list(DATASET_FOLDER, limit=4)
+    page, token = crud_annotation.paginate(cursor, 4, REVISION)
+    assert [entry[REVISION] for entry in page] == [10, 9, 8, 7]
+    assert total == 10
+
+    cursor, total = log.list(
+        DATASET_FOLDER, limit=4, after=crud_annotation.decode_continuation(token), count=COUNT_NONE
+    )
+    assert [entry[REVISION] for entry in cursor] == [6, 5, 4, 3]
+    assert total is None
+
+    # The estimate comes from the head counter, but sets still need a real count
+    assert log.list(DATASET_FOLDER, count=COUNT_ESTIMATED)[1] == 12
+    assert log.list(DATASET_FOLDER, set='alt', count=COUNT_ESTIMATED)[1] == 5
+    assert log.list(DATASET_FOLDER, before=6, count=COUNT_EXACT)[1] == 6
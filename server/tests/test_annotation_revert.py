@@ -0,0 +1,156 @@
+from unittest.mock import MagicMock, patch
+
+from bson.objectid import ObjectId
+from fake_mongo import FakeCollection
+import pytest
+
+from dive_server import crud_annotation
+from dive_server.crud_annotation import HASH, HEAD, IDENTIFIER, REVISION_CREATED, SNAPSHOTS
+
+DATASET_FOLDER = {'_id': ObjectId()}
+USER = {'login': 'user', '_id': ObjectId()}
+
+
+def make_track(id, x=0):
+    return {
+        'id': id,
+        'begin': 0,
+        'end': 0,
+        'confidencePairs': [['fish', 1.0]],
+        'attributes': {},
+        'features': [{'frame': 0, 'bounds': [x, 0, 10, 10]}],
+    }
+
+
+def model_over(cls, collection):
+    model = object.__new__(cls)
+    model.collection = collection
+
+    def find(query=None, offset=0, limit=0, sort=None, fields=None):
+        return collection.find(query, sort=sort)[offset:][: limit or None]
+
+    model.find = find
+    return model
+
+
+@pytest.fixture
+def history():
+    tracks = FakeCollection()
+    state = {HEAD: 0, SNAPSHOTS: []}
+    heads = MagicMock()
+    heads.get.return_value = state
+    heads.head.side_effect = lambda folder, set=None: state[HEAD]
+    heads.allocate.side_effect = lambda folder: state[HEAD] + 1
+    heads.commit.side_effect = lambda folder, revision, set=None, lease=None: state.update(
+        {HEAD: revision}
+    )
+    log = MagicMock()
+    log.latest_entry.return_value = None
+    track_model = model_over(crud_annotation.TrackItem, tracks)
+    chunk_model = model_over(crud_annotation.TrackChunkItem, FakeCollection())
+    group_model = model_over(crud_annotation.GroupItem, FakeCollection())
+    with (
+        patch('dive_server.crud_annotation.RevisionHeadItem', return_value=heads),
+        patch('dive_server.crud_annotation.LabelSummaryItem'),
+        patch('dive_server.crud_annotation.RevisionLogItem', return_value=log),
+        patch('dive_server.crud_annotation.TrackItem', return_value=track_model),
+        patch('dive_server.crud_annotation.TrackChunkItem', return_value=chunk_model),
+        patch('dive_server.crud_annotation.GroupItem', return_value=group_model),
+    ):
+        save = crud_annotation.save_annotations
+        # 1: tracks 1-4, 2: edit 1 and delete 2, 3: add 5, edit 3 and set 4 back to its old value
+        save(DATASET_FOLDER, USER, upsert_tracks=[make_track(id) for id in range(1, 5)])
+        save(DATASET_FOLDER, USER, upsert_tracks=[make_track(1, x=1)], delete_tracks=[2])
+        save(
+            DATASET_FOLDER,
+            USER,
+            upsert_tracks=[make_track(5), make_track(3, x=3), make_track(4, x=4)],
+        )
+        save(DATASET_FOLDER, USER, upsert_tracks=[make_track(4)])
+        yield tracks, state, log
+
+
+def visible(revision=None):
+    listed = crud_annotation.TrackItem().list(DATASET_FOLDER, revision=revision)
+    return [(track[IDENTIFIER], track['features'][0]['bounds'][0]) for track in listed]
+
+
+def test_revert_writes_only_changed_records(history):
+    tracks, state, log = history
+    earlier = {revision: visible(revision) for revision in range(1, 5)}
+    progress = MagicMock()
+
+    result = crud_annotation.revert_annotations(
+        DATASET_FOLDER, USER, 1, batch_size=1, progress=progress
+    )
+
+    # Track 1 and 3 are restored, 2 comes back, 5 is removed, 4 already matches
+    assert result == {'updated': 3, 'deleted': 3}
+    assert state[HEAD] == 5
+    assert visible() == visible(1) == [(1, 0), (2, 0), (3, 0), (4, 0)]
+    assert progress.call_args.args == (3,)
+    created = [doc for doc in tracks.docs if doc[REVISION_CREATED] == 5]
+    assert sorted(doc[IDENTIFIER] for doc in created) == [1, 2, 3]
+    assert all(doc[HASH] for doc in created)
+    # History is kept: every earlier revision still reads the same
+    assert {revision: visible(revision) for revision in range(1, 5)} == earlier
+    assert earlier[2] == [(1, 1), (3, 0), (4, 0)]
+    # Each batch was written into the one logged revision
+    assert log.create.call_count == 5
+    entry = log.create.call_args.args[0]
+    assert entry.description == 'Revert to revision 1'
+    assert entry.revision == 5
+
+
+def test_revert_failure_removes_written_batches(history):
+    tracks, state, log = history
+    count = len(tracks.docs)
+    progress = MagicMock(side_effect=[None, RuntimeError('interrupted')])
+
+    with pytest.raises(RuntimeError):
+        crud_annotation.revert_annotations(DATASET_FOLDER, USER, 1, batch_size=1, progress=progress)
+
+    assert len(tracks.docs) == count
+    assert not any(doc.get('rev_deleted') == 5 for doc in tracks.docs)
+    assert log.create.call_count == 4
+    assert crud_annotation.revert_annotations(DATASET_FOLDER, USER, 1) == {
+        'updated': 3,
+        'deleted': 3,
+    }
+
+
+def test_revert_to_current_state_is_a_noop(history):
+    tracks, state, _log = history
+    count = len(tracks.docs)
+    crud_annotation.revert_annotations(DATASET_FOLDER, USER, 1)
+    assert crud_annotation.revert_annotations(DATASET_FOLDER, USER, 1) == {
+        'updated': 0,
+        'deleted': 0,
+    }
+    assert crud_annotation.revert_annotations(DATASET_FOLDER, USER, 5) == {
+        'updated': 0,
+        'deleted': 0,
+    }
+    assert state[HEAD] == 5
+    assert len(tracks.docs) == count + 3
+
+
+def test_revert_compares_versions_under_the_write_lease(history):
+    heads = crud_annotation.RevisionHeadItem()
+    heads.reset_mock()
+    live_versions = crud_annotation._live_versions
+    held = []
+
+    def spy(*args):
+        held.append(heads.acquire.called and not heads.release.called)
+        return live_versions(*args)
+
+    with patch('dive_server.crud_annotation._live_versions', side_effect=spy):
+        crud_annotation.revert_annotations(DATASET_FOLDER, USER, 1, batch_size=1)
+
+    # No save can land between reading the live versions and writing over them
+    assert held and all(held)
+    heads.acquire.assert_called_once()
+    # Renewed before each of the three restores, the one removal and the commit
+    assert heads.renew.call_count == 5
+    heads.release.assert_called_once()
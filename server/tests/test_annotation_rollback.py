@@ -1,4 +1,4 @@
-from unittest.mock import patch
+from unittest.mock import call, patch
 
 from dive_server import crud_annotation
 from dive_server.crud_annotation import (
@@ -7,31 +7,47 @@ from dive_server.crud_annotation import (
     REVISION,
     REVISION_CREATED,
     REVISION_DELETED,
+    SNAPSHOT,
 )
 
 
+@patch('dive_server.crud_annotation.LabelSummaryItem')
+@patch('dive_server.crud_annotation.RevisionHeadItem')
 @patch('dive_server.crud_annotation.GroupItem')
+@patch('dive_server.crud_annotation.TrackChunkItem')
 @patch('dive_server.crud_annotation.TrackItem')
 @patch('dive_server.crud_annotation.RevisionLogItem')
-def test_rollback_issues_correct_queries(revision_log, track_item, group_item):
+def test_rollback_issues_correct_queries(
+    revision_log, track_item, track_chunk_item, group_item, revision_head, label_summary
+):
     """Records are removed by rev_created, but restored by rev_deleted."""
+    revision_head.return_value.get.return_value = {}
     crud_annotation.rollback({'_id': 'dataset-id'}, 4)
 
     revision_log.return_value.removeWithQuery.assert_called_once_with(
         {DATASET: 'dataset-id', REVISION: {'$gt': 4}}
     )
 
-    for model in (track_item, group_item):
+    for model in (track_item, track_chunk_item, group_item):
         model.return_value.removeWithQuery.assert_called_once_with(
             {DATASET: 'dataset-id', REVISION_CREATED: {'$gt': 4}}
         )
         # Restoring must select tombstoned records by REVISION_DELETED.  Selecting
         # them by REVISION_CREATED (the original defect) only matches records that
-        # removeWithQuery already dropped, so nothing is ever un-deleted.
-        model.return_value.update.assert_called_once_with(
-            {DATASET: 'dataset-id', REVISION_DELETED: {'$gt': 4}},
-            {'$unset': {REVISION_DELETED: ""}},
-        )
+        # removeWithQuery already dropped, so nothing is ever un-deleted.  Snapshots
+        # taken after the target revision are then dropped from surviving records.
+        assert model.return_value.update.call_args_list == [
+            call(
+                {DATASET: 'dataset-id', REVISION_DELETED: {'$gt': 4}},
+                {'$unset': {REVISION_DELETED: ""}},
+            ),
+            call(
+                {DATASET: 'dataset-id', SNAPSHOT: {'$gt': 4}},
+                {'$pull': {SNAPSHOT: {'$gt': 4}}},
+            ),
+        ]
+    revision_head.return_value.reset.assert_called_once_with({'_id': 'dataset-id'}, 4)
+    label_summary.return_value.add.assert_called_once_with({'_id': 'dataset-id'}, {})
 
 
 class FakeCollection:
@@ -83,10 +99,22 @@ class FakeCollection:
         )
 
 
+@patch('dive_server.crud_annotation.acquire_write_lease')
+@patch('dive_server.crud_annotation.LabelSummaryItem')
+@patch('dive_server.crud_annotation.RevisionHeadItem')
 @patch('dive_server.crud_annotation.GroupItem')
+@patch('dive_server.crud_annotation.TrackChunkItem')
 @patch('dive_server.crud_annotation.TrackItem')
 @patch('dive_server.crud_annotation.RevisionLogItem')
-def test_rollback_restored_track_survives_next_save(revision_log, track_item, _group_item):
+def test_rollback_restored_track_survives_next_save(
+    revision_log,
+    track_item,
+    _track_chunk_item,
+    _group_item,
+    _revision_head,
+    _label_summary,
+    _acquire_write_lease,
+):
     """
     A track deleted after the rollback target must stay restored once further
     edits are made.
@@ -0,0 +1,176 @@
+import itertools
+from unittest.mock import MagicMock, patch
+
+from bson.objectid import ObjectId
+from fake_mongo import FakeCollection
+from girder.exceptions import RestException
+import pytest
+
+from dive_server import crud_annotation
+from dive_server.crud_annotation import (
+    ALLOCATED,
+    DATASET,
+    HASH,
+    HEAD,
+    IDENTIFIER,
+    REVISION_CREATED,
+    REVISION_DELETED,
+)
+
+DATASET_FOLDER = {'_id': ObjectId()}
+USER = {'login': 'user', '_id': ObjectId()}
+
+
+def make_track(id, x=0):
+    return {
+        'id': id,
+        'begin': 0,
+        'end': 1,
+        'confidencePairs': [['fish', 1.0]],
+        'attributes': {},
+        'features': [
+            {'frame': 0, 'bounds': [x, 0, 10, 10]},
+            {'frame': 1, 'bounds': [x, 0, 10, 10], 'keyframe': None},
+        ],
+    }
+
+
+def model_over(cls, collection):
+    model = object.__new__(cls)
+    model.collection = collection
+    return model
+
+
+@pytest.fixture
+def store():
+    tracks = FakeCollection()
+    heads = MagicMock()
+    heads.allocate.side_effect = itertools.count(1)
+    heads.get.return_value = {}
+    log = MagicMock()
+    log.latest_entry.return_value = None
+    with (
+        patch('dive_server.crud_annotation.RevisionHeadItem', return_value=heads),
+        patch('dive_server.crud_annotation.LabelSummaryItem'),
+        patch('dive_server.crud_annotation.RevisionLogItem', return_value=log),
+        patch(
+            'dive_server.crud_annotation.TrackItem',
+            return_value=model_over(crud_annotation.TrackItem, tracks),
+        ),
+        patch(
+            'dive_server.crud_annotation.TrackChunkItem',
+            return_value=model_over(crud_annotation.TrackChunkItem, FakeCollection()),
+        ),
+        patch(
+            'dive_server.crud_annotation.GroupItem',
+            return_value=model_over(crud_annotation.GroupItem, FakeCollection()),
+        ),
+    ):
+        yield tracks, heads, log
+
+
+def save(tracks, **kwargs):
+    return crud_annotation.save_annotations(DATASET_FOLDER, USER, upsert_tracks=tracks, **kwargs)
+
+
+def test_content_hash_ignores_storage_fields_and_none():
+    track = make_track(1)
+    stored = {**make_track(1), 'dataset': 'x', REVISION_CREATED: 4, 'set': None}
+    del stored['features'][1]['keyframe']
+    assert crud_annotation.content_hash(track) == crud_annotation.content_hash(stored)
+    assert crud_annotation.content_hash(track) != crud_annotation.content_hash(make_track(1, 5))
+
+
+def test_unchanged_upserts_write_nothing(store):
+    tracks, heads, log = store
+    assert save([make_track(1), make_track(2)]) == {'updated': 2, 'deleted': 0}
+    snapshot = [dict(doc) for doc in tracks.docs]
+
+    assert save([make_track(1), make_track(2)]) == {'updated': 0, 'deleted': 0}
+    assert save([make_track(1), make_track(2)], overwrite=True) == {'updated': 0, 'deleted': 0}
+    assert tracks.docs == snapshot
+    assert heads.allocate.call_count == 1
+    assert log.create.call_count == 1
+
+
+def test_only_real_changes_are_counted(store):
+    tracks, _heads, log = store
+    save([make_track(1), make_track(2), make_track(3)])
+
+    # Overwrite import: 1 unchanged, 2 changed, 3 gone
+    result = save([make_track(1), make_track(2, x=5)], overwrite=True)
+    assert result == {'updated': 1, 'deleted': 2}
+    assert log.create.call_args.args[0].additions == 1
+    live = {doc[IDENTIFIER]: doc for doc in tracks.docs if REVISION_DELETED not in doc}
+    assert sorted(live) == [1, 2]
+    assert live[1][REVISION_CREATED] == 1 and live[2][REVISION_CREATED] == 2
+    assert live[2][HASH] == crud_annotation.content_hash(make_track(2, x=5))
+
+    # Deleting an id that is not live is a no-op as well
+    assert crud_annotation.save_annotations(DATASET_FOLDER, USER, delete_tracks=[3]) == {
+        'updated': 0,
+        'deleted': 0,
+    }
+
+
+def test_overwrite_expires_ids_without_listing_the_unchanged(store):
+    tracks, _heads, _log = store
+    save([make_track(id) for id in range(1, 201)])
+    bulk_write = tracks.bulk_write
+    queried = []
+
+    def spy(operations, ordered=True):
+        queried.extend(
+            operation._filter for operation in operations if hasattr(operation, '_filter')
+        )
+        return bulk_write(operations, ordered=ordered)
+
+    kept = [make_track(id) for id in range(1, 151)] + [make_track(151, x=5)]
+    with patch.object(tracks, 'bulk_write', side_effect=spy):
+        assert save(kept, overwrite=True) == {'updated': 1, 'deleted': 50}
+    # One live version per expiry, never the unchanged ids of the whole import
+    assert all(sorted(query) == ['_id', REVISION_DELETED] for query in queried)
+    assert len(queried) == 50
+    live = sorted(doc[IDENTIFIER] for doc in tracks.docs if REVISION_DELETED not in doc)
+    assert live == list(range(1, 152))
+
+
+def test_save_fails_when_what_it_read_was_replaced(store):
+    tracks, _heads, log = store
+    save([make_track(1)])
+    plan = crud_annotation.RevisionWrite.plan
+
+    def replaced_after_read(self, collection, upsert_list, delete_list):
+        planned = plan(self, collection, upsert_list, delete_list)
+        # A writer that lost its lease replaces the track between the read and the write
+        if collection.collection is tracks:
+            tracks.update_many(
+                {REVISION_DELETED: {'$exists': False}}, {'$set': {REVISION_DELETED: 9}}
+            )
+            tracks.insert_many(
+                [{**make_track(1, x=9), DATASET: DATASET_FOLDER['_id'], REVISION_CREATED: 9}]
+            )
+        return planned
+
+    with patch.object(crud_annotation.RevisionWrite, 'plan', replaced_after_read):
+        with pytest.raises(RestException) as error:
+            save([make_track(1, x=5)])
+    assert error.value.code == 409
+    live = [doc for doc in tracks.docs if REVISION_DELETED not in doc]
+    assert [doc[REVISION_CREATED] for doc in live] == [9]
+    assert log.create.call_count == 1
+
+
+def test_next_writer_discards_an_unpublished_revision(store):
+    tracks, heads, _log = store
+    save([make_track(1), make_track(2)])
+    # A writer whose lease expired replaced track 1 in revision 2 and never committed it
+    tracks.update_many({IDENTIFIER: 1}, {'$set': {REVISION_DELETED: 2}})
+    tracks.insert_many(
+        [{**make_track(1, x=5), DATASET: DATASET_FOLDER['_id'], REVISION_CREATED: 2}]
+    )
+    heads.get.return_value = {HEAD: 1, ALLOCATED: 2}
+
+    crud_annotation.acquire_write_lease(DATASET_FOLDER)
+    assert len(tracks.docs) == 2
+    assert all(doc[REVISION_CREATED] == 1 and REVISION_DELETED not in doc for doc in tracks.docs)
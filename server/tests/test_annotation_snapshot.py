@@ -0,0 +1,113 @@
+import random
+from unittest.mock import MagicMock, patch
+
+from fake_mongo import FakeCollection
+import pytest
+
+from dive_server import crud_annotation
+from dive_server.crud_annotation import (
+    DATASET,
+    HEAD,
+    IDENTIFIER,
+    REVISION_CREATED,
+    REVISION_DELETED,
+    SNAPSHOT,
+    SNAPSHOTS,
+)
+
+DATASET_FOLDER = {'_id': 'dataset-id'}
+
+
+def make_history(revisions=40, ids=12, seed=0):
+    """Random sequence of upserts and deletes, stored the way save_annotations() does."""
+    rng = random.Random(seed)
+    docs = []
+    for revision in range(1, revisions + 1):
+        for identifier in rng.sample(range(ids), 3):
+            for doc in docs:
+                if doc[IDENTIFIER] == identifier and REVISION_DELETED not in doc:
+                    doc[REVISION_DELETED] = revision
+            if rng.random() < 0.8:
+                docs.append(
+                    {IDENTIFIER: identifier, DATASET: 'dataset-id', REVISION_CREATED: revision}
+                )
+    return docs
+
+
+def live_ids(docs, head):
+    return sorted(
+        doc[IDENTIFIER]
+        for doc in docs
+        if doc[REVISION_CREATED] <= head and doc.get(REVISION_DELETED, head + 1) > head
+    )
+
+
+def model_over(collection):
+    model = object.__new__(crud_annotation.TrackItem)
+    model.collection = collection
+    model.find = lambda query, **kwargs: collection.find(query)
+    return model
+
+
+@pytest.fixture
+def annotations():
+    tracks = FakeCollection(make_history())
+    state = {HEAD: 40, SNAPSHOTS: []}
+    heads = MagicMock()
+    heads.get.return_value = state
+
+    def add_snapshot(_folder, revision):
+        state[SNAPSHOTS].append(revision)
+        return []
+
+    heads.add_snapshot.side_effect = add_snapshot
+    track_model = model_over(tracks)
+    chunk_model = model_over(FakeCollection())
+    group_model = model_over(FakeCollection())
+    with (
+        patch('dive_server.crud_annotation.RevisionHeadItem', return_value=heads),
+        patch('dive_server.crud_annotation.LabelSummaryItem'),
+        patch('dive_server.crud_annotation.TrackItem', return_value=track_model),
+        patch('dive_server.crud_annotation.TrackChunkItem', return_value=chunk_model),
+        patch('dive_server.crud_annotation.GroupItem', return_value=group_model),
+    ):
+        yield tracks, state
+
+
+def test_snapshot_reads_match_full_scan(annotations):
+    tracks, state = annotations
+    expected = {head: live_ids(tracks.docs, head) for head in range(41)}
+
+    crud_annotation.take_snapshot(DATASET_FOLDER, 15)
+    crud_annotation.take_snapshot(DATASET_FOLDER, 30)
+    assert state[SNAPSHOTS] == [15, 30]
+
+    for head in range(41):
+        listed = crud_annotation.TrackItem().list(DATASET_FOLDER, revision=head)
+        assert sorted(doc[IDENTIFIER] for doc in listed) == expected[head]
+    # Head reads start from the newest snapshot
+    listed = crud_annotation.TrackItem().list(DATASET_FOLDER)
+    assert sorted(doc[IDENTIFIER] for doc in listed) == expected[40]
+
+
+def test_snapshot_marks_only_records_live_at_revision(annotations):
+    tracks, _state = annotations
+    crud_annotation.take_snapshot(DATASET_FOLDER, 20)
+    members = sorted(doc[IDENTIFIER] for doc in tracks.docs if 20 in doc.get(SNAPSHOT, []))
+    assert members == live_ids(tracks.docs, 20)
+
+
+def test_snapshot_interval(monkeypatch):
+    monkeypatch.delenv('DIVE_ANNOTATION_SNAPSHOT_INTERVAL', raising=False)
+    assert crud_annotation.snapshot_interval() == 0
+    monkeypatch.setenv('DIVE_ANNOTATION_SNAPSHOT_INTERVAL', '25')
+    assert crud_annotation.snapshot_interval() == 25
+    monkeypatch.setenv('DIVE_ANNOTATION_SNAPSHOT_INTERVAL', 'often')
+    assert crud_annotation.snapshot_interval() == 0
+
+
+def test_nearest_snapshot():
+    assert crud_annotation.nearest_snapshot([], 5) is None
+    assert crud_annotation.nearest_snapshot([10, 20], 5) is None
+    assert crud_annotation.nearest_snapshot([10, 20], 19) == 10
+    assert crud_annotation.nearest_snapshot([10, 20], 20) == 20
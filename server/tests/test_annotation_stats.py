@@ -0,0 +1,153 @@
+from unittest.mock import MagicMock, patch
+
+from bson.objectid import ObjectId
+from fake_mongo import FakeCollection
+import pytest
+
+from dive_server import crud_annotation
+from dive_server.crud_annotation import DETECTIONS, HEAD, REVISION, SNAPSHOTS, STATS
+
+DATASET_FOLDER = {'_id': ObjectId()}
+USER = {'login': 'user', '_id': ObjectId()}
+
+
+def make_track(id, begin, end, label=None):
+    return {
+        'id': id,
+        'begin': begin,
+        'end': end,
+        'confidencePairs': [[label, 1.0]] if label else [],
+        'attributes': {},
+        'features': [{'frame': frame, 'bounds': [0, 0, 10, 10]} for frame in sorted({begin, end})],
+    }
+
+
+def model_over(cls, collection):
+    model = object.__new__(cls)
+    model.collection = collection
+
+    def find(query=None, offset=0, limit=0, sort=None, fields=None):
+        return collection.find(query, sort=sort)[offset:][: limit or None]
+
+    model.find = find
+    model.findOne = lambda query, sort=None: collection.find_one(query, sort=sort)
+    model.create = lambda item: collection.insert_many([item.dict()])
+    return model
+
+
+@pytest.fixture
+def store():
+    tracks = FakeCollection()
+    log = FakeCollection()
+    state = {HEAD: 0, SNAPSHOTS: []}
+    heads = MagicMock()
+    heads.get.return_value = state
+    heads.head.side_effect = lambda folder, set=None: state[HEAD]
+    heads.allocate.side_effect = lambda folder: state[HEAD] + 1
+    heads.commit.side_effect = lambda folder, revision, set=None, lease=None: state.update(
+        {HEAD: revision}
+    )
+    with (
+        patch('dive_server.crud_annotation.RevisionHeadItem', return_value=heads),
+        patch('dive_server.crud_annotation.LabelSummaryItem'),
+        patch(
+            'dive_server.crud_annotation.RevisionLogItem',
+            return_value=model_over(crud_annotation.RevisionLogItem, log),
+        ),
+        patch(
+            'dive_server.crud_annotation.TrackItem',
+            return_value=model_over(crud_annotation.TrackItem, tracks),
+        ),
+        patch(
+            'dive_server.crud_annotation.TrackChunkItem',
+            return_value=model_over(crud_annotation.TrackChunkItem, FakeCollection()),
+        ),
+        patch(
+            'dive_server.crud_annotation.GroupItem',
+            return_value=model_over(crud_annotation.GroupItem, FakeCollection()),
+        ),
+    ):
+        yield tracks, log
+
+
+def current(set=None):
+    """Logged statistics, checked against a full recount"""
+    stats = crud_annotation.get_annotation_stats(DATASET_FOLDER, set)
+    # Stored as arrays, like the database would return them
+    stats['types'] = [list(pair) for pair in stats['types']]
+    recount = crud_annotation.annotation_stats(DATASET_FOLDER, set=set)
+    assert stats == {REVISION: stats[REVISION], **recount}
+    return stats
+
+
+def test_saves_keep_statistics(store):
+    save = crud_annotation.save_annotations
+    assert current() == {
+        REVISION: 0,
+        'tracks': 0,
+        'detections': 0,
+        'types': [],
+        'firstFrame': None,
+        'lastFrame': None,
+    }
+    save(
+        DATASET_FOLDER,
+        USER,
+        upsert_tracks=[
+            make_track(1, 0, 10, 'fish'),
+            make_track(2, 5, 5, 'fish'),
+            make_track(3, 2, 30, 'ray'),
+            make_track(4, 3, 4),
+        ],
+    )
+    assert current() == {
+        REVISION: 1,
+        'tracks': 4,
+        'detections': 7,
+        'types': [['fish', 2], ['ray', 1]],
+        'firstFrame': 0,
+        'lastFrame': 30,
+    }
+
+    # Removing the tracks at either end of the range reads it again
+    save(
+        DATASET_FOLDER,
+        USER,
+        upsert_tracks=[make_track(1, 1, 10, 'ray')],
+        delete_tracks=[3],
+    )
+    assert current()['types'] == [['fish', 1], ['ray', 1]]
+    assert (current()['firstFrame'], current()['lastFrame']) == (1, 10)
+
+    save(DATASET_FOLDER, USER, upsert_tracks=[make_track(1, 7, 7, 'shark')], set='alt')
+    assert current('alt')['tracks'] == 1
+    assert current()[REVISION] == 2
+
+    save(DATASET_FOLDER, USER, upsert_tracks=[make_track(5, 8, 9, 'eel')], overwrite=True)
+    assert current() == {
+        REVISION: 4,
+        'tracks': 1,
+        'detections': 2,
+        'types': [['eel', 1]],
+        'firstFrame': 8,
+        'lastFrame': 9,
+    }
+    assert current('alt')['types'] == [['shark', 1]]
+
+
+def test_stats_of_older_revisions_are_computed_once(store):
+    tracks, log = store
+    crud_annotation.save_annotations(DATASET_FOLDER, USER, upsert_tracks=[make_track(1, 0, 3)])
+    # Revisions saved before statistics were logged, with tracks lacking feature counts
+    for entry in log.docs:
+        del entry[STATS]
+    for track in tracks.docs:
+        del track[DETECTIONS]
+
+    assert current()['detections'] == 2
+    assert log.docs[0][STATS]['detections'] == 2
+
+    crud_annotation.save_annotations(
+        DATASET_FOLDER, USER, upsert_tracks=[make_track(2, 4, 4)], delete_tracks=[1]
+    )
+    assert current()['detections'] == 1
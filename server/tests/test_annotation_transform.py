@@ -0,0 +1,298 @@
+from unittest.mock import MagicMock, patch
+
+from bson.objectid import ObjectId
+from fake_mongo import FakeCollection
+import pytest
+
+from dive_server import crud_annotation
+from dive_server.crud_annotation import HEAD, SNAPSHOTS
+from dive_utils import transforms
+
+DATASET_FOLDER = {'_id': ObjectId(), 'name': 'dataset'}
+USER = {'login': 'user', '_id': ObjectId()}
+
+
+def make_track(id, *pairs, begin=2):
+    return {
+        'id': id,
+        'begin': begin,
+        'end': begin + 1,
+        'confidencePairs': [list(pair) for pair in pairs],
+        'attributes': {'color': 'red'},
+        'features': [
+            {
+                'frame': begin,
+                'bounds': [10, 20, 30, 40],
+                'attributes': {'length': 3},
+                'head': [10, 20],
+                'geometry': {
+                    'type': 'FeatureCollection',
+                    'features': [
+                        {
+                            'type': 'Feature',
+                            'properties': {'key': ''},
+                            'geometry': {'type': 'Polygon', 'coordinates': [[[10, 20], [30, 40]]]},
+                        }
+                    ],
+                },
+            },
+            {'frame': begin + 1, 'bounds': [0, 0, 5, 5]},
+        ],
+    }
+
+
+def parse(*transform_list):
+    return transforms.AnnotationTransformArgs(transforms=list(transform_list)).transforms
+
+
+def test_rename_type_merges_confidence():
+    track = make_track(1, ('fish', 0.4), ('scallop', 0.3), ('sole', 0.6))
+    changed = transforms.transform_track(
+        track, parse({'op': 'renameType', 'types': ['sole', 'fish'], 'to': 'flatfish'})
+    )
+    assert changed
+    assert track['confidencePairs'] == [['flatfish', 0.6], ['scallop', 0.3]]
+    assert not transforms.transform_track(
+        track, parse({'op': 'renameType', 'types': ['ray'], 'to': 'fish'})
+    )
+
+
+def test_geometry_transforms():
+    track = make_track(1, ('fish', 1.0))
+    transforms.transform_track(
+        track,
+        parse(
+            {'op': 'offsetFrames', 'offset': 3},
+            {'op': 'transformBounds', 'scale': [0.5, 2], 'translate': [1, 0]},
+            {'op': 'renameAttribute', 'belongs': 'detection', 'name': 'length', 'to': 'size'},
+            {'op': 'renameAttribute', 'belongs': 'track', 'name': 'color', 'to': 'colour'},
+        ),
+    )
+    first, second = track['features']
+    assert (track['begin'], track['end']) == (5, 6)
+    assert [first['frame'], second['frame']] == [5, 6]
+    assert first['bounds'] == [6, 40, 16, 80]
+    assert second['bounds'] == [1, 0, 4, 10]
+    assert first['head'] == [6, 40]
+    polygon = first['geometry']['features'][0]['geometry']['coordinates']
+    assert polygon == [[[6, 40], [16, 80]]]
+    assert first['attributes'] == {'size': 3}
+    assert track['attributes'] == {'colour': 'red'}
+
+    group = {'id': 1, 'begin': 2, 'end': 4, 'members': {'1': {'ranges': [[2, 4]]}}}
+    assert transforms.transform_group(group, parse({'op': 'offsetFrames', 'offset': -2}))
+    assert group['members']['1']['ranges'] == [[0, 2]]
+    with pytest.raises(ValueError):
+        transforms.transform_track(track, parse({'op': 'offsetFrames', 'offset': -6}))
+
+
+def model_over(cls, collection):
+    model = object.__new__(cls)
+    model.collection = collection
+
+    def find(query=None, offset=0, limit=0, sort=None, fields=None):
+        return collection.find(query, sort=sort)[offset:][: limit or None]
+
+    model.find = find
+    return model
+
+
+@pytest.fixture
+def store():
+    tracks = FakeCollection()
+    state = {HEAD: 0, SNAPSHOTS: []}
+    heads = MagicMock()
+    heads.get.return_value = state
+    heads.head.side_effect = lambda folder, set=None: state[HEAD]
+    heads.set_head.side_effect = lambda folder, set=None: state[HEAD]
+    heads.allocate.side_effect = lambda folder: state[HEAD] + 1
+    heads.commit.side_effect = lambda folder, revision, set=None, lease=None: state.update(
+        {HEAD: revision}
+    )
+    log = MagicMock()
+    log.latest_entry.return_value = None
+    with (
+        patch('dive_server.crud_annotation.RevisionHeadItem', return_value=heads),
+        patch('dive_server.crud_annotation.LabelSummaryItem'),
+        patch('dive_server.crud_annotation.RevisionLogItem', return_value=log),
+        patch(
+            'dive_server.crud_annotation.TrackItem',
+            return_value=model_over(crud_annotation.TrackItem, tracks),
+        ),
+        patch(
+            'dive_server.crud_annotation.TrackChunkItem',
+            return_value=model_over(crud_annotation.TrackChunkItem, FakeCollection()),
+        ),
+        patch(
+            'dive_server.crud_annotation.GroupItem',
+            return_value=model_over(crud_annotation.GroupItem, FakeCollection()),
+        ),
+    ):
+        yield tracks, log
+
+
+def test_transform_saves_changed_tracks_as_one_revision(store):
+    _tracks, log = store
+    crud_annotation.save_annotations(
+        DATASET_FOLDER,
+        USER,
+        upsert_tracks=[make_track(1, ('fish', 1.0)), make_track(2, ('ray', 1.0))],
+    )
+    rename = parse({'op': 'renameType', 'types': ['fish'], 'to': 'cod'})
+    result = crud_annotation.transform_annotations(DATASET_FOLDER, USER, rename)
+
+    assert result == {'updated': 1, 'deleted': 1}
+    assert log.create.call_args.args[0].description == 'Transform: rename types fish to cod'
+    types = {
+        track['id']: track['confidencePairs'][0][0]
+        for track in crud_annotation.TrackItem().list(DATASET_FOLDER)
+    }
+    assert types == {1: 'cod', 2: 'ray'}
+
+
+def test_transform_writes_batches_into_one_revision(store):
+    tracks, log = store
+    crud_annotation.save_annotations(
+        DATASET_FOLDER, USER, upsert_tracks=[make_track(id, ('fish', 1.0)) for id in range(5)]
+    )
+    heads = crud_annotation.RevisionHeadItem()
+    rename = parse({'op': 'renameType', 'types': ['fish'], 'to': 'cod'})
+    result = crud_annotation.transform_annotations(DATASET_FOLDER, USER, rename, batch_size=2)
+
+    assert result == {'updated': 5, 'deleted': 5}
+    assert heads.allocate.call_count == 2
+    assert log.create.call_count == 2
+    assert {track['rev_created'] for track in tracks.find({'rev_deleted': {'$exists': False}})} == {
+        2
+    }
+    types = [
+        track['confidencePairs'][0][0] for track in crud_annotation.TrackItem().list(DATASET_FOLDER)
+    ]
+    assert types == ['cod'] * 5
+
+
+def test_transform_failure_removes_written_batches(store):
+    tracks, log = store
+    crud_annotation.save_annotations(
+        DATASET_FOLDER, USER, upsert_tracks=[make_track(id, ('fish', 1.0)) for id in range(5)]
+    )
+    rename = parse({'op': 'renameType', 'types': ['fish'], 'to': 'cod'})
+    transform_track = transforms.transform_track
+
+    def fail_last(track, transform_list):
+        if track['id'] == 4:
+            raise ValueError('transform failed')
+        return transform_track(track, transform_list)
+
+    with patch('dive_server.crud_annotation.transforms.transform_track', side_effect=fail_last):
+        with pytest.raises(ValueError):
+            crud_annotation.transform_annotations(DATASET_FOLDER, USER, rename, batch_size=2)
+
+    assert log.create.call_count == 1
+    assert tracks.find({'rev_created': 2}) == []
+    assert tracks.find({'rev_deleted': 2}) == []
+    # A later save must not publish the aborted batches
+    crud_annotation.save_annotations(DATASET_FOLDER, USER, upsert_tracks=[make_track(9)])
+    types = {
+        track['id']: track['confidencePairs'][0][0]
+        for track in crud_annotation.TrackItem().list(DATASET_FOLDER)
+        if track['confidencePairs']
+    }
+    assert types == {id: 'fish' for id in range(5)}
+
+
+def test_transform_job_refuses_stale_revision(store):
+    _tracks, log = store
+    crud_annotation.save_annotations(DATASET_FOLDER, USER, upsert_tracks=[make_track(1)])
+    job = {
+        'userId': USER['_id'],
+        'kwargs': {
+            'folderId': str(DATASET_FOLDER['_id']),
+            'args': {'transforms': [{'op': 'offsetFrames', 'offset': 1}]},
+            'revision': 0,
+            'setHead': 0,
+        },
+    }
+    with (
+        patch('dive_server.crud_annotation.Folder') as folder,
+        patch('dive_server.crud_annotation.User') as users,
+        patch('dive_server.crud_annotation.Job') as jobs,
+    ):
+        folder.return_value.load.return_value = DATASET_FOLDER
+        users.return_value.load.return_value = USER
+        with pytest.raises(crud_annotation.RestException):
+            crud_annotation.transform_job(job)
+    assert log.create.call_count == 1
+    assert [track['begin'] for track in crud_annotation.TrackItem().list(DATASET_FOLDER)] == [2]
+    heads = crud_annotation.RevisionHeadItem()
+    assert heads.release.call_count == heads.acquire.call_count == 2
+    assert jobs.return_value.updateJob.call_args.kwargs['status'] == (
+        crud_annotation.JobStatus.ERROR
+    )
+
+
+def test_transform_job_ignores_saves_to_other_sets(store):
+    crud_annotation.save_annotations(DATASET_FOLDER, USER, upsert_tracks=[make_track(1)])
+    heads = crud_annotation.RevisionHeadItem()
+    job = {
+        'userId': USER['_id'],
+        'kwargs': {
+            'folderId': str(DATASET_FOLDER['_id']),
+            'args': {'transforms': [{'op': 'offsetFrames', 'offset': 1}]},
+            'revision': 1,
+            'setHead': 1,
+        },
+    }
+    # A later save to another set moved the dataset head, not the main set head
+    crud_annotation.save_annotations(DATASET_FOLDER, USER, upsert_tracks=[make_track(2)], set='alt')
+    heads.set_head.side_effect = lambda folder, set=None: 1
+    assert heads.head(DATASET_FOLDER) == 2
+    with (
+        patch('dive_server.crud_annotation.Folder') as folder,
+        patch('dive_server.crud_annotation.User') as users,
+        patch('dive_server.crud_annotation.Job') as jobs,
+    ):
+        folder.return_value.load.return_value = DATASET_FOLDER
+        users.return_value.load.return_value = USER
+        crud_annotation.transform_job(job)
+    assert jobs.return_value.updateJob.call_args.kwargs['status'] == (
+        crud_annotation.JobStatus.SUCCESS
+    )
+    tracks = crud_annotation.TrackItem().list(DATASET_FOLDER)
+    assert [track['begin'] for track in tracks] == [3]
+
+
+def test_transform_holds_the_write_lease_across_batches(store):
+    _tracks, _log = store
+    crud_annotation.save_annotations(
+        DATASET_FOLDER, USER, upsert_tracks=[make_track(id, ('fish', 1.0)) for id in range(5)]
+    )
+    heads = crud_annotation.RevisionHeadItem()
+    heads.reset_mock()
+    rename = parse({'op': 'renameType', 'types': ['fish'], 'to': 'cod'})
+    crud_annotation.transform_annotations(DATASET_FOLDER, USER, rename, set_head=1, batch_size=2)
+
+    calls = [name for name, _args, _kwargs in heads.method_calls]
+    # The set head is checked and the revision read only once no other save can land
+    assert calls.index('acquire') < calls.index('set_head') < calls.index('head')
+    # Renewed before each of the three batches and the commit
+    assert calls.count('renew') == 4
+    assert calls.index('commit') < calls.index('release')
+
+
+def test_transform_that_lost_its_lease_writes_nothing(store):
+    tracks, _log = store
+    crud_annotation.save_annotations(
+        DATASET_FOLDER, USER, upsert_tracks=[make_track(id, ('fish', 1.0)) for id in range(5)]
+    )
+    heads = crud_annotation.RevisionHeadItem()
+    lost = crud_annotation.RestException('The annotation write lease expired', code=409)
+    # The lease expired while the first batch was written, and another writer took it
+    heads.renew.side_effect = [None, lost]
+    rename = parse({'op': 'renameType', 'types': ['fish'], 'to': 'cod'})
+    with pytest.raises(crud_annotation.RestException):
+        crud_annotation.transform_annotations(DATASET_FOLDER, USER, rename, batch_size=2)
+
+    heads.commit.assert_called_once()
+    assert tracks.find({'rev_created': 2}) == []
+    assert tracks.find({'rev_deleted': 2}) == []
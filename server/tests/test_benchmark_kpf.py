@@ -0,0 +1,64 @@
+"""
+Timing of MEVA KPF loading and conversion on a synthetic annotation set.
+
+Excluded from the unit tests; run with ``tox -e testbenchmark``.
+"""
+
+import time
+from typing import Dict
+
+import pytest
+
+from dive_utils.serializers import kpf
+
+pytestmark = pytest.mark.benchmark
+
+ACTORS_PER_ACTIVITY = 2
+TRACK_LENGTH = 20
+
+
+def meva_kpf(actor_count: int) -> str:
+    """Types, keyframe geometry and activities of actors, laid out like a MEVA KPF set"""
+    rows = []
+    for actor in range(actor_count):
+        rows.append(f'- {{ types: {{ id1: {actor}, cset3: {{ person: 1.0 }} }} }}')
+    for actor in range(actor_count):
+        for frame in range(actor, actor + TRACK_LENGTH):
+            rows.append(
+                f'- {{ geom: {{ id1: {actor}, id0: {actor * TRACK_LENGTH + frame}, ts0: {frame}, '
+                f'g0: {frame} 20 {frame + 30} 40, keyframe: true }} }}'
+            )
+    for activity in range(actor_count // ACTORS_PER_ACTIVITY):
+        actors = range(activity * ACTORS_PER_ACTIVITY, (activity + 1) * ACTORS_PER_ACTIVITY)
+        timespans = ', '.join(
+            f'{{ id1: {actor}, timespan: [{{ tsr0: [{actor}, {actor + TRACK_LENGTH - 1}] }}] }}'
+            for actor in actors
+        )
+        rows.append(
+            f'- {{ act: {{ act2: {{ person_talks_to_person: 1.0 }}, id2: {activity}, '
+            f'timespan: [{{ tsr0: [{actors[0]}, {actors[-1] + TRACK_LENGTH - 1}] }}], '
+            f'src_status: active, actors: [{timespans}] }} }}'
+        )
+    return '\n'.join(rows)
+
+
+def test_kpf_conversion_scales_linearly():
+    per_actor: Dict[int, float] = {}
+    for actor_count in (500, 5_000):
+        text = meva_kpf(actor_count)
+        start = time.perf_counter()
+        kpf_data = kpf.load(text)
+        loaded = time.perf_counter()
+        annotations, _ = kpf.convert(kpf_data)
+        converted = time.perf_counter()
+        per_actor[actor_count] = (converted - loaded) / actor_count
+        print(
+            f'{actor_count:>6} actors load {loaded - start:6.2f} s '
+            f'convert {converted - loaded:6.2f} s {per_actor[actor_count] * 1e6:6.1f} us/actor'
+        )
+        assert len(annotations['tracks']) == actor_count
+        assert len(annotations['groups']) == actor_count // ACTORS_PER_ACTIVITY
+        assert annotations['tracks']['1']['begin'] == 1
+        assert annotations['tracks']['1']['end'] == TRACK_LENGTH
+    # Converting every activity once per actor would be ten times slower per actor
+    assert per_actor[5_000] < 3 * per_actor[500]
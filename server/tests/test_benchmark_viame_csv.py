@@ -0,0 +1,78 @@
+"""
+Timing of VIAME CSV parsing on synthetic tracker output.
+
+Excluded from the unit tests; run with ``tox -e testbenchmark``.
+"""
+
+import csv
+import random
+import time
+from typing import Dict, List, Tuple
+
+import pytest
+
+from dive_utils.serializers import viame
+
+pytestmark = pytest.mark.benchmark
+
+CONCURRENT_TRACKS = 10
+
+
+def tracker_csv(row_count: int) -> Tuple[List[str], Dict[str, int]]:
+    """Rows of tracks that last the whole sequence, with the image map of the sequence"""
+    frames = row_count // CONCURRENT_TRACKS
+    rows = [
+        f'{track},img_{frame:07d}.png,{frame},1,2,11,12,0.9,-1,fish,0.9'
+        for frame in range(frames)
+        for track in range(CONCURRENT_TRACKS)
+    ]
+    return rows, {f'img_{frame:07d}': frame for frame in range(frames)}
+
+
+def test_csv_import_scales_linearly():
+    per_row: Dict[int, float] = {}
+    for row_count in (10_000, 100_000, 1_000_000):
+        rows, imageMap = tracker_csv(row_count)
+        start = time.perf_counter()
+        annotations, _, warnings, _, _ = viame.load_csv_as_tracks_and_attributes(rows, imageMap)
+        seconds = time.perf_counter() - start
+        per_row[row_count] = seconds / row_count
+        print(f'{row_count:>9} rows {seconds:8.2f} s {per_row[row_count] * 1e6:6.1f} us/row')
+        assert len(annotations['tracks']) == CONCURRENT_TRACKS
+        assert warnings == []
+    # Sorting the rows is n log n; rescanning tracks or images would be orders of magnitude off
+    assert per_row[1_000_000] < 3 * per_row[10_000]
+
+
+def polygon_row(rng: random.Random, track: int, frame: int) -> str:
+    """A segmentation row: polygons with holes, keypoints, attributes and a note"""
+
+    def ring(points: int) -> str:
+        return ' '.join(str(rng.randint(0, 2000)) for _ in range(2 * points))
+
+    columns = [f'{track},img_{frame:07d}.png,{frame},1,2,300,400,0.9,-1,fish,0.9,scallop,0.2']
+    for _ in range(3):
+        columns += [f'(poly) {ring(rng.randint(20, 200))}', f'(hole) {ring(8)}']
+    columns += ['(kp) head 10 20', '(kp) tail 30 40', '(atr) occluded true', '(note) reviewed']
+    return ','.join(columns)
+
+
+def test_polygon_row_parsing():
+    rng = random.Random(0)
+    rows = [polygon_row(rng, index % 10, index // 10) for index in range(2_000)]
+    start = time.perf_counter()
+    annotations, *_ = viame.load_csv_as_tracks_and_attributes(rows)
+    seconds = time.perf_counter() - start
+    print(f'{len(rows)} polygon rows {seconds:6.2f} s {seconds / len(rows) * 1e6:6.1f} us/row')
+
+    parsed = [next(csv.reader([row])) for row in rows[:1000]]
+    start = time.perf_counter()
+    for row in parsed:
+        viame._parse_row(row)
+    seconds = time.perf_counter() - start
+    print(f'_parse_row {seconds / len(parsed) * 1e6:6.1f} us/row')
+
+    feature = annotations['tracks']['0']['features'][0]
+    shapes = [item['geometry'] for item in feature['geometry']['features']]
+    assert [shape['type'] for shape in shapes].count('Polygon') == 3
+    assert all(len(shape['coordinates']) == 2 for shape in shapes if shape['type'] == 'Polygon')
@@ -1,7 +1,13 @@
 from copy import deepcopy
 import json
+import random
+from unittest.mock import MagicMock, patch
 
-from dive_server import crud_annotation, crud_dataset
+from bson.objectid import ObjectId
+from fake_mongo import FakeCollection
+import pytest
+
+from dive_server import crud_annotation, crud_dataset, views_annotation
 
 
 def test_type_filter_prunes_exported_confidence_pairs_without_mutating_storage(monkeypatch):
@@ -17,8 +23,8 @@ def test_type_filter_prunes_exported_confidence_pairs_without_mutating_storage(m
     }
     monkeypatch.setattr(
         crud_annotation,
-        'get_annotations',
-        lambda _folder, revision=None: {'tracks': tracks},
+        'get_tracks',
+        lambda _folder, revision=None, filters=None: tracks,
     )
 
     exported = crud_dataset._filtered_annotation_tracks({'meta': {}}, None, False, {'fish'})
@@ -45,8 +51,8 @@ def test_type_filter_matches_raw_pair_membership_not_hierarchy_resolution(monkey
     }
     monkeypatch.setattr(
         crud_annotation,
-        'get_annotations',
-        lambda _folder, revision=None: {'tracks': tracks},
+        'get_tracks',
+        lambda _folder, revision=None, filters=None: tracks,
     )
     folder = {'meta': {'typeHierarchy': {'salmon': 'fish'}}}
 
@@ -69,8 +75,8 @@ def test_export_filters_prune_threshold_and_type_pairs_without_mutating_storage(
     }
     monkeypatch.setattr(
         crud_annotation,
-        'get_annotations',
-        lambda _folder, revision=None: {'tracks': tracks},
+        'get_tracks',
+        lambda _folder, revision=None, filters=None: tracks,
     )
     folder = {'meta': {'confidenceFilters': {'default': 0.5, 'fish': 0.85}}}
 
@@ -81,6 +87,47 @@ def test_export_filters_prune_threshold_and_type_pairs_without_mutating_storage(
     assert tracks['7']['confidencePairs'] == [['fish', 0.8], ['shark', 0.4], ['ray', 0.9]]
 
 
+@pytest.mark.parametrize(
+    'thresholds,typeFilter',
+    [
+        (None, set()),
+        (None, {'fish', 'eel'}),
+        ({'default': 0.5}, set()),
+        ({'default': 0.5, 'fish': 0.85, 'ray': 0.2}, set()),
+        ({'default': 0.5, 'fish': 0.85}, {'fish', 'ray'}),
+        ({'fish': 0.85}, {'fish'}),
+    ],
+)
+def test_confidence_filter_selects_tracks_that_keep_a_pair(monkeypatch, thresholds, typeFilter):
+    rng = random.Random(0)
+    labels = ['fish', 'ray', 'eel', 'default']
+    docs = [
+        {
+            'id': id,
+            'confidencePairs': [
+                [label, round(rng.random(), 2)] for label in rng.sample(labels, rng.randint(0, 3))
+            ],
+        }
+        for id in range(200)
+    ]
+    tracks = {doc['id']: doc for doc in docs}
+    # The pairs exports keep, pruned in Python from every track
+    monkeypatch.setattr(
+        crud_annotation, 'get_tracks', lambda _folder, revision=None, filters=None: tracks
+    )
+    meta = {'confidenceFilters': thresholds} if thresholds else {}
+    expected = crud_dataset._filtered_annotation_tracks(
+        {'meta': meta}, None, thresholds is not None, typeFilter
+    )
+
+    query = crud_annotation.TrackItem.confidence_filter(thresholds, typeFilter)
+    selected = {doc['id'] for doc in FakeCollection(docs).find(query)}
+    if thresholds is None and not typeFilter:
+        assert query == {}
+    else:
+        assert selected == set(expected)
+
+
 def test_full_archive_dive_json_prunes_filtered_pairs_without_mutating_storage(monkeypatch):
     tracks = {
         '7': {
@@ -92,11 +139,15 @@ def test_full_archive_dive_json_prunes_filtered_pairs_without_mutating_storage(m
             'features': [{'frame': 0, 'bounds': [1, 2, 3, 4]}],
         }
     }
-    monkeypatch.setattr(
-        crud_annotation,
-        'get_annotations',
-        lambda _folder, revision=None: {'tracks': tracks},
-    )
+    reads = []
+
+    def iter_tracks(_folder, revision=None, filters=None):
+        reads.append(filters)
+        return iter(tracks.values())
+
+    monkeypatch.setattr(crud_annotation, 'iter_tracks', iter_tracks)
+    monkeypatch.setattr(crud_annotation, 'iter_groups', lambda _folder, revision=None: iter([]))
+    monkeypatch.setattr(crud_annotation, 'RevisionHeadItem', MagicMock())
     monkeypatch.setattr(crud_dataset.crud, 'getCloneRoot', lambda _user, folder: folder)
 
     class Zip:
@@ -120,10 +171,20 @@ def test_full_archive_dive_json_prunes_filtered_pairs_without_mutating_storage(m
 
     exported = json.loads(next(chunk for chunk in chunks if b'confidencePairs' in chunk))
     assert exported['tracks']['7']['confidencePairs'] == [['fish', 0.8]]
+    assert len(reads) == 1
     assert tracks['7']['confidencePairs'] == [['fish', 0.8], ['shark', 0.4]]
 
 
-def test_library_labels_use_raw_highest_score_and_exclude_empty_vectors(monkeypatch):
+def test_library_labels_use_raw_highest_score_and_exclude_empty_vectors():
+    assert crud_annotation.top_label([['salmon', 0.4], ['fish', 0.9]]) == 'fish'
+    # A strict comparison keeps the first stored pair when scores tie
+    assert crud_annotation.top_label([['fish', 0.5], ['salmon', 0.5]]) == 'fish'
+    # Imported empty vectors have no raw label and must not create a null Library row
+    assert crud_annotation.top_label([]) is None
+    assert crud_annotation.top_label(None) is None
+
+
+def test_library_labels_read_label_summaries(monkeypatch):
     captured = {}
 
     class Collection:
@@ -134,32 +195,240 @@ def test_library_labels_use_raw_highest_score_and_exclude_empty_vectors(monkeypa
     class FolderModel:
         collection = Collection()
 
+    summaries = MagicMock()
     monkeypatch.setattr(crud_annotation, 'Folder', lambda: FolderModel())
+    monkeypatch.setattr(crud_annotation, 'LabelSummaryItem', lambda: summaries)
     monkeypatch.setattr(crud_dataset, 'get_dataset_query', lambda *args, **kwargs: {})
 
     assert crud_annotation.get_labels({'_id': 'user'}) == ['raw-result']
-    lookup_pipeline = captured['pipeline'][1]['$lookup']['pipeline']
-    reducer = lookup_pipeline[3]['$set']['confidencePairs']['$reduce']
-    assert reducer['input'] == '$confidencePairs'
-    assert reducer['initialValue'] == []
-    condition = reducer['in']['$cond'][0]['$or']
-    assert condition[1] == {
-        '$gt': [
-            {'$arrayElemAt': ['$$this', 1]},
-            {'$arrayElemAt': ['$$value', 1]},
-        ],
-    }
-    assert lookup_pipeline[4] == {
-        '$set': {
-            'confidencePairs': {
-                '$arrayElemAt': ['$confidencePairs', 0],
-            },
-        },
-    }
-    assert lookup_pipeline[5] == {
-        '$match': {
-            '$expr': {
-                '$eq': [{'$type': '$confidencePairs'}, 'string'],
-            },
-        },
+    # Datasets saved before summaries existed are counted by the migration, not here
+    summaries.recount.assert_not_called()
+    assert captured['pipeline'][1]['$lookup']['from'] == 'revisionHeadItem'
+    assert captured['pipeline'][2]['$match'] == {
+        'head': {'$elemMatch': {'set': None, crud_annotation.LABELS_COUNTED: True}}
     }
+    lookup = captured['pipeline'][3]['$lookup']
+    assert lookup['from'] == 'labelSummaryItem'
+    assert captured['pipeline'][5]['$group']['count'] == {'$sum': '$label.count'}
+
+
+def test_legacy_labels_are_counted_in_batches(monkeypatch):
+    folders = [{'_id': id} for id in range(1, 8)]
+    heads = MagicMock()
+    heads.labels_counted.side_effect = lambda ids: [id for id in ids if id % 3 == 0]
+    summaries = MagicMock()
+    monkeypatch.setattr(
+        crud_annotation, 'Folder', lambda: MagicMock(**{'find.return_value': iter(folders)})
+    )
+    monkeypatch.setattr(crud_annotation, 'RevisionHeadItem', lambda: heads)
+    monkeypatch.setattr(crud_annotation, 'LabelSummaryItem', lambda: summaries)
+
+    assert crud_annotation.count_legacy_labels(limit=3, batch_size=2, dry_run=True) == [1, 2, 4]
+    summaries.recount.assert_not_called()
+    assert crud_annotation.count_legacy_labels(batch_size=2) == [1, 2, 4, 5, 7]
+    assert [call.args[0] for call in summaries.recount.call_args_list] == [
+        {'_id': id} for id in (1, 2, 4, 5, 7)
+    ]
+    assert all(len(call.args[0]) <= 2 for call in heads.labels_counted.call_args_list)
+
+
+def test_streamed_dive_json_matches_document(monkeypatch):
+    tracks = [
+        {'id': id, 'begin': 0, 'end': 0, 'confidencePairs': [['fish', id / 10]], 'features': []}
+        for id in range(1, 8)
+    ]
+    groups = [{'id': 1, 'members': {'1': {'ranges': [[0, 0]]}}, 'confidencePairs': []}]
+    monkeypatch.setattr(
+        crud_annotation, 'iter_tracks', lambda _folder, revision=None, filters=None: iter(tracks)
+    )
+    monkeypatch.setattr(crud_annotation, 'iter_groups', lambda _folder, revision=None: iter(groups))
+    monkeypatch.setattr(crud_dataset, 'EXPORT_CHUNK_SIZE', 100)
+    folder = {'meta': {'confidenceFilters': {'default': 0.3}, 'fps': 10}}
+
+    chunks = list(crud_dataset._dive_json_export_chunks(folder, 1, True, None))
+
+    assert len(chunks) > 1
+    assert ''.join(chunks) == json.dumps(
+        {
+            'tracks': {track['id']: track for track in tracks[2:]},
+            'groups': {1: groups[0]},
+            'version': crud_annotation.constants.AnnotationsCurrentVersion,
+            'fps': 10.0,
+        }
+    )
+
+
+def _unwrapped_endpoint(endpoint):
+    while hasattr(endpoint, '__wrapped__'):
+        endpoint = endpoint.__wrapped__
+    return endpoint
+
+
+def test_dive_json_export_endpoint_streams_bytes(monkeypatch):
+    tracks = [
+        {'id': id, 'begin': 0, 'end': 0, 'confidencePairs': [['físh', 0.5]], 'features': []}
+        for id in range(1, 8)
+    ]
+    monkeypatch.setattr(
+        crud_annotation, 'iter_tracks', lambda _folder, revision=None, filters=None: iter(tracks)
+    )
+    monkeypatch.setattr(crud_annotation, 'iter_groups', lambda _folder, revision=None: iter([]))
+    monkeypatch.setattr(crud_annotation, 'RevisionHeadItem', MagicMock())
+    monkeypatch.setattr(crud_dataset, 'EXPORT_CHUNK_SIZE', 100)
+    monkeypatch.setattr(views_annotation.crud, 'verify_dataset', lambda folder: True)
+    monkeypatch.setattr(views_annotation, 'setContentDisposition', MagicMock())
+    folder = {'name': 'dataset', 'meta': {}}
+
+    body = _unwrapped_endpoint(views_annotation.AnnotationResource.export)(
+        MagicMock(), folder, False, None, 'dive_json', None
+    )
+
+    # The response body is sent as it is, so every chunk must already be bytes
+    chunks = list(body())
+    assert len(chunks) > 1
+    assert all(isinstance(chunk, bytes) for chunk in chunks)
+    exported = json.loads(b''.join(chunks))
+    assert exported['tracks']['7']['confidencePairs'] == [['físh', 0.5]]
+
+
+def test_coco_json_export_endpoint_streams_bytes(monkeypatch):
+    tracks = [
+        {
+            'id': id,
+            'begin': 0,
+            'end': 0,
+            'confidencePairs': [['físh', 0.5]],
+            'attributes': {},
+            'features': [{'frame': 0, 'bounds': [1, 2, 3, 4]}],
+        }
+        for id in range(1, 8)
+    ]
+    reads = []
+
+    def iter_tracks(_folder, revision=None, filters=None, fields=None):
+        reads.append(fields)
+        return iter(tracks)
+
+    checked = []
+    monkeypatch.setattr(crud_annotation, 'iter_tracks', iter_tracks)
+    monkeypatch.setattr(crud_annotation, 'RevisionHeadItem', MagicMock())
+    monkeypatch.setattr(crud_dataset, 'EXPORT_CHUNK_SIZE', 100)
+    monkeypatch.setattr(
+        crud_dataset, 'type_hierarchy_for_export', lambda *args, **kwargs: checked.append(1)
+    )
+    monkeypatch.setattr(views_annotation.crud, 'verify_dataset', lambda folder: True)
+    monkeypatch.setattr(views_annotation, 'setContentDisposition', MagicMock())
+    folder = {'name': 'dataset', 'meta': {'type': 'video'}}
+
+    body = _unwrapped_endpoint(views_annotation.AnnotationResource.export)(
+        MagicMock(), folder, False, None, 'coco_json', None
+    )
+
+    # The hierarchy is checked before the response starts, the tracks only as it streams
+    assert checked and not reads
+    chunks = list(body())
+    assert len(chunks) > 1
+    assert all(isinstance(chunk, bytes) for chunk in chunks)
+    exported = json.loads(b''.join(chunks))
+    assert len(exported['annotations']) == len(tracks)
+    assert exported['categories'][0]['name'] == 'físh'
+
+
+def model_over(cls, collection):
+    model = object.__new__(cls)
+    model.collection = collection
+
+    def find(query=None, offset=0, limit=0, sort=None, fields=None):
+        return collection.find(query, sort=sort)[offset:][: limit or None]
+
+    model.find = find
+    return model
+
+
+@pytest.fixture
+def store():
+    state = {crud_annotation.HEAD: 0, crud_annotation.SNAPSHOTS: []}
+    heads = MagicMock()
+    heads.get.return_value = state
+    heads.head.side_effect = lambda folder, set=None: state[crud_annotation.HEAD]
+    heads.allocate.side_effect = lambda folder: state[crud_annotation.HEAD] + 1
+    heads.commit.side_effect = lambda folder, revision, set=None, lease=None: state.update(
+        {crud_annotation.HEAD: revision}
+    )
+    log = MagicMock()
+    log.latest_entry.return_value = None
+    with (
+        patch('dive_server.crud_annotation.RevisionHeadItem', return_value=heads),
+        patch('dive_server.crud_annotation.LabelSummaryItem'),
+        patch('dive_server.crud_annotation.RevisionLogItem', return_value=log),
+        patch(
+            'dive_server.crud_annotation.TrackItem',
+            return_value=model_over(crud_annotation.TrackItem, FakeCollection()),
+        ),
+        patch(
+            'dive_server.crud_annotation.TrackChunkItem',
+            return_value=model_over(crud_annotation.TrackChunkItem, FakeCollection()),
+        ),
+        patch(
+            'dive_server.crud_annotation.GroupItem',
+            return_value=model_over(crud_annotation.GroupItem, FakeCollection()),
+        ),
+    ):
+        yield
+
+
+def test_coco_export_reads_one_revision_across_saves(store, monkeypatch):
+    folder = {'_id': ObjectId(), 'name': 'dataset', 'meta': {'type': 'video'}}
+    user = {'login': 'user', '_id': ObjectId()}
+
+    def track(id, frame, label):
+        return {
+            'id': id,
+            'begin': frame,
+            'end': frame,
+            'confidencePairs': [[label, 1.0]],
+            'attributes': {},
+            'features': [{'frame': frame, 'bounds': [1, 2, 3, 4]}],
+        }
+
+    crud_annotation.save_annotations(folder, user, upsert_tracks=[track(1, 0, 'fish')])
+    monkeypatch.setattr(crud_dataset, 'type_hierarchy_for_export', lambda *args, **kwargs: None)
+    iter_tracks = crud_annotation.iter_tracks
+    passes = []
+
+    def save_between_passes(*args, **kwargs):
+        passes.append(args)
+        if len(passes) == 2:
+            # A track of a new type on a new frame, saved after the summary pass
+            crud_annotation.save_annotations(folder, user, upsert_tracks=[track(2, 5, 'ray')])
+        return iter_tracks(*args, **kwargs)
+
+    monkeypatch.setattr(crud_annotation, 'iter_tracks', save_between_passes)
+
+    exported = json.loads(
+        ''.join(crud_dataset._coco_json_export_chunks(folder, user, None, False, None))
+    )
+
+    assert len(passes) == 2
+    assert [category['name'] for category in exported['categories']] == ['fish']
+    assert [annotation['track_id'] for annotation in exported['annotations']] == [1]
+
+
+def test_dive_json_export_reads_one_revision_across_saves(store, monkeypatch):
+    folder = {'_id': ObjectId(), 'name': 'dataset', 'meta': {}}
+    user = {'login': 'user', '_id': ObjectId()}
+    track = {'id': 1, 'begin': 0, 'end': 0, 'confidencePairs': [['fish', 1.0]], 'features': []}
+    crud_annotation.save_annotations(folder, user, upsert_tracks=[track])
+    iter_groups = crud_annotation.iter_groups
+
+    def save_between_passes(*args, **kwargs):
+        group = {'id': 1, 'begin': 0, 'end': 0, 'members': {'1': {'ranges': [[0, 0]]}}}
+        crud_annotation.save_annotations(folder, user, upsert_groups=[group])
+        return iter_groups(*args, **kwargs)
+
+    monkeypatch.setattr(crud_annotation, 'iter_groups', save_between_passes)
+
+    exported = json.loads(''.join(crud_dataset._dive_json_export_chunks(folder, None, False, None)))
+
+    assert list(exported['tracks']) == ['1']
+    assert exported['groups'] == {}
@@ -692,6 +692,40 @@ def test_read_kwcoco_json(
     assert json.dumps(attributes, sort_keys=True) == json.dumps(expected_attributes, sort_keys=True)
 
 
+def _chunks(text: str, size: int):
+    return lambda: (text[i : i + size] for i in range(0, len(text), size))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+@pytest.mark.parametrize(
+    "document",
+    [item[0] for item in test_tuple]
+    + [profile['document'] for profile in KWCOCO_PROFILE.values() if 'document' in profile],
+)
+def test_streamed_coco_import_matches_document(document, chunk_size):
+    text = json.dumps(document, indent=1)
+    streamed = kwcoco.read_coco_json(_chunks(text, chunk_size))
+    assert isinstance(streamed['annotations'], kwcoco.StreamedAnnotations)
+    assert list(streamed['annotations']) == document['annotations']
+    assert {key: value for key, value in streamed.items() if key != 'annotations'} == {
+        key: value for key, value in document.items() if key != 'annotations'
+    }
+
+    expected = kwcoco.load_coco_as_tracks_and_attributes(json.loads(text))
+    # Spill every annotation to its own sorted run
+    assert kwcoco.load_coco_as_tracks_and_attributes(streamed, run_size=1) == expected
+
+
+def test_read_coco_json_other_documents():
+    dive = {'tracks': {}, 'annotations': [{'id': 1}], 'version': 2}
+    assert kwcoco.read_coco_json(_chunks(json.dumps(dive), 3)) == dive
+    assert kwcoco.read_coco_json(_chunks('[1, 2]', 1)) == [1, 2]
+    assert kwcoco.read_coco_json(_chunks('{"fps": 12.5e1 }', 1)) == {'fps': 125.0}
+    for malformed in ['', '{"images": []', '{"images": [] } []', '{"annotations": [1 2]}']:
+        with pytest.raises(json.JSONDecodeError):
+            kwcoco.read_coco_json(_chunks(malformed, 2))
+
+
 def test_is_coco_json_without_info():
     coco = {
         "images": [{"id": 1, "file_name": "img_0001.jpg"}],
@@ -830,6 +864,81 @@ def test_export_dive_as_coco_omits_unusable_or_absent_fps(fps):
     assert coco == baseline
 
 
+_STREAMED_TRACKS = [
+    *_EXPORT_TRACKS,
+    {
+        "id": 2,
+        "begin": 0,
+        "end": 3,
+        "confidencePairs": [["leaf", 0.75], ["fish", 0.5]],
+        "attributes": {"gear": "trawl"},
+        "features": [
+            {
+                "frame": 0,
+                "bounds": [0, 0, 40, 40],
+                "notes": ["reef"],
+                # Coordinates are stored as floats
+                "geometry": {
+                    "type": "FeatureCollection",
+                    "features": [
+                        {
+                            "type": "Feature",
+                            "properties": {"key": ""},
+                            "geometry": {
+                                "type": "Polygon",
+                                "coordinates": [
+                                    [[0.0, 0.0], [40.0, 0.0], [40.0, 40.0], [0.0, 0.0]]
+                                ],
+                            },
+                        },
+                        {
+                            "type": "Feature",
+                            "properties": {"key": "head"},
+                            "geometry": {"type": "Point", "coordinates": [5.0, 5.0]},
+                        },
+                    ],
+                },
+            },
+            {"frame": 2, "bounds": [1, 1, 9, 9], "attributes": {"occluded": True}},
+            # No image for this frame: left out of the export
+            {"frame": 3, "bounds": [1, 1, 9, 9]},
+        ],
+    },
+    {"id": 3, "begin": 1, "end": 1, "confidencePairs": [], "features": []},
+]
+
+
+@pytest.mark.parametrize("fps", [None, 10])
+@pytest.mark.parametrize("chunk_size", [1, 1 << 16])
+def test_stream_dive_as_coco_matches_document(fps, chunk_size):
+    """Streamed text is the json of the exported document, whatever the chunk size."""
+    image_filenames = {0: "a.jpg", 1: "b.jpg", 2: "c.jpg"}
+    hierarchy = {"leaf": "fish"}
+    document = kwcoco.export_dive_as_coco(
+        _STREAMED_TRACKS,
+        image_filenames,
+        dataset_name="demo",
+        datasetInfo=DATASET_INFO,
+        typeHierarchy=hierarchy,
+        fps=fps,
+    )
+    chunks = list(
+        kwcoco.stream_dive_as_coco(
+            _STREAMED_TRACKS,
+            _STREAMED_TRACKS,
+            image_filenames.get,
+            dataset_name="demo",
+            datasetInfo=DATASET_INFO,
+            typeHierarchy=hierarchy,
+            fps=fps,
+            chunk_size=chunk_size,
+        )
+    )
+    assert "".join(chunks) == json.dumps(document)
+    assert len(chunks) > 1 if chunk_size == 1 else len(chunks) == 1
+    assert len(document["annotations"]) == 3
+
+
 def test_load_coco_restores_dataset_info():
     """info.dive_dataset_info is surfaced as the 4th return value for the caller to persist."""
     coco = {
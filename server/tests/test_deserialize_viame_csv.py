@@ -22,3 +22,9 @@ def test_read_viame_csv(
         expected_tracks, sort_keys=True
     )
     assert json.dumps(attributes, sort_keys=True) == json.dumps(expected_attributes, sort_keys=True)
+
+
+def test_read_viame_csv_rejects_odd_polygon_coordinates():
+    row = '1,a.png,0,1,2,3,4,0.9,-1,fish,0.9,(poly) 1 2 3 4 5'
+    with pytest.raises(ValueError, match='odd number of coordinates'):
+        viame.load_csv_as_tracks_and_attributes([row])
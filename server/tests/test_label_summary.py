@@ -0,0 +1,113 @@
+from unittest.mock import MagicMock, patch
+
+from bson.objectid import ObjectId
+from fake_mongo import FakeCollection
+import pytest
+
+from dive_server import crud_annotation
+from dive_server.crud_annotation import HEAD, LABEL, LABEL_COUNT, SET, SNAPSHOTS
+
+DATASET_FOLDER = {'_id': ObjectId()}
+USER = {'login': 'user', '_id': ObjectId()}
+
+
+def make_track(id, *pairs):
+    return {
+        'id': id,
+        'begin': 0,
+        'end': 0,
+        'confidencePairs': [list(pair) for pair in pairs],
+        'attributes': {},
+        'features': [{'frame': 0, 'bounds': [0, 0, 10, 10]}],
+    }
+
+
+def model_over(cls, collection):
+    model = object.__new__(cls)
+    model.collection = collection
+
+    def find(query=None, offset=0, limit=0, sort=None, fields=None):
+        return collection.find(query, sort=sort)[offset:][: limit or None]
+
+    model.find = find
+    model.removeWithQuery = collection.delete_many
+    model.update = collection.update_many
+    return model
+
+
+@pytest.fixture
+def summary():
+    labels = FakeCollection()
+    state = {HEAD: 0, SNAPSHOTS: []}
+    heads = MagicMock()
+    heads.get.return_value = state
+    heads.head.side_effect = lambda folder, set=None: state[HEAD]
+    heads.allocate.side_effect = lambda folder: state[HEAD] + 1
+    heads.commit.side_effect = lambda folder, revision, set=None, lease=None: state.update(
+        {HEAD: revision}
+    )
+    heads.reset.side_effect = lambda folder, revision: state.update({HEAD: revision})
+    heads.clones.return_value = []
+    with (
+        patch('dive_server.crud_annotation.RevisionHeadItem', return_value=heads),
+        patch(
+            'dive_server.crud_annotation.RevisionLogItem',
+            **{'return_value.latest_entry.return_value': None},
+        ),
+        patch(
+            'dive_server.crud_annotation.LabelSummaryItem',
+            return_value=model_over(crud_annotation.LabelSummaryItem, labels),
+        ),
+        patch(
+            'dive_server.crud_annotation.TrackItem',
+            return_value=model_over(crud_annotation.TrackItem, FakeCollection()),
+        ),
+        patch(
+            'dive_server.crud_annotation.TrackChunkItem',
+            return_value=model_over(crud_annotation.TrackChunkItem, FakeCollection()),
+        ),
+        patch(
+            'dive_server.crud_annotation.GroupItem',
+            return_value=model_over(crud_annotation.GroupItem, FakeCollection()),
+        ),
+    ):
+        yield labels
+
+
+def counts(labels):
+    return {(doc[SET], doc[LABEL]): doc[LABEL_COUNT] for doc in labels.docs}
+
+
+def recounted(labels):
+    incremental = counts(labels)
+    crud_annotation.LabelSummaryItem().recount(DATASET_FOLDER)
+    assert counts(labels) == incremental
+    return incremental
+
+
+def test_saves_and_rollback_keep_label_counts(summary):
+    save = crud_annotation.save_annotations
+    save(
+        DATASET_FOLDER,
+        USER,
+        upsert_tracks=[
+            make_track(1, ('fish', 0.9), ('ray', 0.1)),
+            make_track(2, ('fish', 0.5)),
+            make_track(3, ('ray', 0.5)),
+            make_track(4),
+        ],
+    )
+    assert recounted(summary) == {(None, 'fish'): 2, (None, 'ray'): 1}
+
+    save(DATASET_FOLDER, USER, upsert_tracks=[make_track(2, ('ray', 0.5))], delete_tracks=[3])
+    assert recounted(summary) == {(None, 'fish'): 1, (None, 'ray'): 1}
+
+    save(DATASET_FOLDER, USER, upsert_tracks=[make_track(1, ('shark', 1.0))], set='alt')
+    assert recounted(summary) == {(None, 'fish'): 1, (None, 'ray'): 1, ('alt', 'shark'): 1}
+
+    # Overwrite replaces everything that is not upserted again
+    save(DATASET_FOLDER, USER, upsert_tracks=[make_track(5, ('eel', 1.0))], overwrite=True)
+    assert recounted(summary) == {(None, 'eel'): 1, ('alt', 'shark'): 1}
+
+    crud_annotation.rollback(DATASET_FOLDER, 2)
+    assert recounted(summary) == {(None, 'fish'): 1, (None, 'ray'): 1}
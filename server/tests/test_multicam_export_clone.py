@@ -501,7 +501,9 @@ def test_yield_metadata_file_skips_when_unset(item_cls, folder_cls, get_clone_ro
     z.addFile.assert_not_called()
 
 
-@patch('dive_server.crud_dataset.crud_annotation.get_annotations')
+@patch('dive_server.crud_dataset.crud_annotation.RevisionHeadItem')
+@patch('dive_server.crud_dataset.crud_annotation.iter_groups', return_value=[])
+@patch('dive_server.crud_dataset.crud_annotation.iter_tracks', return_value=[])
 @patch('dive_server.crud_dataset.get_dataset')
 @patch('dive_server.crud_dataset.get_media')
 @patch('dive_server.crud_dataset.crud_annotation.get_annotation_csv_generator')
@@ -519,7 +521,9 @@ def test_export_multicam_integration_zip_paths(
     csv_gen_mock,
     get_media_mock,
     get_dataset_mock,
-    get_annotations_mock,
+    iter_tracks_mock,
+    iter_groups_mock,
+    revision_head_mock,
 ):
     """Build a minimal zip and assert multicam layout from export helpers."""
     parent = _multi_parent_folder()
@@ -566,7 +570,6 @@ def test_export_multicam_integration_zip_paths(
     get_media_mock.return_value = MagicMock(
         dict=lambda exclude_none=True: {'imageData': [], 'video': None}
     )
-    get_annotations_mock.return_value = {'tracks': {}, 'groups': {}}
     csv_gen_mock.return_value = (None, iter(['# header\n']))
     get_clone_root_mock.side_effect = lambda _user, folder: folder
     valid_images_mock.return_value = [{'_id': 'img1', 'name': 'left.png'}]
@@ -743,7 +746,6 @@ def test_export_multicam_annotations_preflights_invalid_coco_hierarchy(zip_gen_c
         )
 
     assert str(error_info.value) == (
-        'Type hierarchy is invalid: self edge "fish -> fish". '
-        'No COCO file was exported.'
+        'Type hierarchy is invalid: self edge "fish -> fish". ' 'No COCO file was exported.'
     )
     zip_gen_cls.assert_not_called()
@@ -0,0 +1,71 @@
+import bson
+import pytest
+
+from dive_server import crud_annotation
+from dive_utils import models, packing
+
+
+def make_features(count):
+    features = [
+        {'frame': frame, 'bounds': [frame, frame + 1, frame + 20, frame + 30], 'attributes': {}}
+        for frame in range(count)
+    ]
+    features[0].update(keyframe=True, interpolate=False)
+    features[3].update(keyframe=False, attributes={'color': 'red'}, notes=['note'])
+    features[5]['head'] = (1.5, 2.5)
+    features[5]['geometry'] = {
+        'type': 'FeatureCollection',
+        'features': [
+            {
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [1.0, 2.0]},
+                'properties': {'key': 'head'},
+            }
+        ],
+    }
+    return features
+
+
+def make_track(count):
+    return {
+        'id': 1,
+        'begin': 0,
+        'end': count - 1,
+        'confidencePairs': [['fish', 0.9]],
+        'attributes': {},
+        'features': make_features(count),
+    }
+
+
+def test_roundtrip_preserves_json_shape():
+    track = make_track(10)
+    expected = models.Track(**track).dict(exclude_none=True)
+    packed = packing.pack_track(make_track(10), min_features=5)
+    assert packing.FEATURES not in packed
+    # Survives a trip through BSON, which turns the tuple into a list
+    stored = bson.decode(bson.encode(packed))
+    assert models.Track(**packing.unpack_track(stored)).dict(exclude_none=True) == expected
+
+
+def test_packing_threshold_and_fallback():
+    assert packing.FEATURES in packing.pack_track(make_track(8), min_features=10)
+    assert packing.FEATURES in packing.pack_track(make_track(10), min_features=0)
+    features = make_features(10)
+    features[2]['bounds'] = [1, 2, 3]
+    assert not packing.can_pack(features)
+    features = make_features(10)
+    features[2]['frame'] = 2**31
+    assert not packing.can_pack(features)
+
+
+def test_packed_track_is_smaller():
+    plain = bson.encode(make_track(5000))
+    packed = bson.encode(packing.pack_track(make_track(5000), min_features=1))
+    assert len(packed) * 3 < len(plain)
+
+
+@pytest.mark.parametrize('frame_start,frame_end,expected', [(2, 4, [2, 3, 4]), (None, 1, [0, 1])])
+def test_trim_unpacked_features(frame_start, frame_end, expected):
+    track = packing.unpack_track(packing.pack_track(make_track(10), min_features=1))
+    trimmed = crud_annotation.TrackItem.trim_features(track, frame_start, frame_end)
+    assert [feature['frame'] for feature in trimmed['features']] == expected
@@ -0,0 +1,143 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from fake_mongo import FakeCollection, apply_update, matches
+from girder.exceptions import RestException
+import pymongo
+import pytest
+
+from dive_server import crud_annotation
+from dive_server.crud_annotation import ALLOCATED, DATASET, HEAD, MAIN_HEAD, SET, WRITER
+
+
+class FakeHeadCollection(FakeCollection):
+    """FakeCollection with the find_one_and_update behind RevisionHeadItem."""
+
+    def find_one_and_update(self, filter, update, upsert=False, return_document=None):
+        for doc in self.docs:
+            if matches(doc, filter):
+                apply_update(doc, update)
+                return dict(doc)
+        if not upsert:
+            return None
+        doc = {key: value for key, value in filter.items() if not key.startswith('$')}
+        apply_update(doc, update)
+        self.docs.append(doc)
+        return dict(doc)
+
+    def update_one(self, filter, update, upsert=False):
+        result = self.find_one_and_update(filter, update, upsert=upsert)
+        return SimpleNamespace(matched_count=int(result is not None))
+
+
+@pytest.fixture
+def head_item():
+    item = object.__new__(crud_annotation.RevisionHeadItem)
+    item.collection = FakeHeadCollection()
+    with patch('dive_server.crud_annotation.RevisionLogItem') as revision_log:
+        revision_log.return_value.latest_logged.return_value = 7
+        yield item
+
+
+DATASET_FOLDER = {'_id': 'dataset-id'}
+
+
+def test_head_is_seeded_from_log_once(head_item):
+    assert head_item.head(DATASET_FOLDER) == 7
+    assert head_item.collection.docs == [{DATASET: 'dataset-id', SET: None, HEAD: 7, ALLOCATED: 7}]
+    crud_annotation.RevisionLogItem.return_value.latest_logged.return_value = 100
+    assert head_item.head(DATASET_FOLDER) == 7
+
+
+def test_allocations_are_unique_and_hidden_until_committed(head_item):
+    lease = head_item.acquire(DATASET_FOLDER, 60)
+    first = head_item.allocate(DATASET_FOLDER)
+    second = head_item.allocate(DATASET_FOLDER)
+    assert (first, second) == (8, 9)
+    # Neither save has written its log entry yet
+    assert head_item.head(DATASET_FOLDER) == 7
+
+    head_item.commit(DATASET_FOLDER, second, None, lease)
+    assert head_item.head(DATASET_FOLDER) == 9
+    assert head_item.allocate(DATASET_FOLDER) == 10
+
+
+def test_write_lease_admits_one_writer(head_item):
+    lease = head_item.acquire(DATASET_FOLDER, 60)
+    assert lease is not None
+    assert head_item.acquire(DATASET_FOLDER, 60) is None
+    head_item.renew(DATASET_FOLDER, lease, 60)
+
+    head_item.release(DATASET_FOLDER, lease)
+    assert WRITER not in head_item.get(DATASET_FOLDER)
+    assert head_item.acquire(DATASET_FOLDER, 60) is not None
+
+
+def test_writer_whose_lease_expired_cannot_publish(head_item):
+    stalled = head_item.acquire(DATASET_FOLDER, -1)
+    revision = head_item.allocate(DATASET_FOLDER)
+    taken_over = head_item.acquire(DATASET_FOLDER, 60)
+    assert taken_over is not None
+
+    with pytest.raises(RestException) as error:
+        head_item.renew(DATASET_FOLDER, stalled, 60)
+    assert error.value.code == 409
+    with pytest.raises(RestException):
+        head_item.commit(DATASET_FOLDER, revision, None, stalled)
+    assert head_item.head(DATASET_FOLDER) == 7
+    # Releasing a lost lease leaves the new writer's lease alone
+    head_item.release(DATASET_FOLDER, stalled)
+    assert head_item.get(DATASET_FOLDER)[WRITER] == taken_over
+
+
+def test_concurrent_first_saves_of_a_new_dataset(head_item):
+    collection = head_item.collection
+    find_one_and_update = collection.find_one_and_update
+    rivals = [lambda: head_item.allocate(DATASET_FOLDER)]
+    allocated = []
+
+    def racing_upsert(filter, update, upsert=False, return_document=None):
+        if upsert and rivals:
+            # The other first save inserts the counter between this one's match and insert
+            allocated.append(rivals.pop()())
+            raise pymongo.errors.DuplicateKeyError('E11000 duplicate key error')
+        return find_one_and_update(filter, update, upsert=upsert, return_document=return_document)
+
+    with patch.object(collection, 'find_one_and_update', side_effect=racing_upsert):
+        allocated.append(head_item.allocate(DATASET_FOLDER))
+    assert allocated == [8, 9]
+    assert collection.docs == [{DATASET: 'dataset-id', SET: None, HEAD: 7, ALLOCATED: 9}]
+
+
+def test_set_heads_and_reset(head_item):
+    lease = head_item.acquire(DATASET_FOLDER, 60)
+    revision = head_item.allocate(DATASET_FOLDER)
+    head_item.commit(DATASET_FOLDER, revision, 'setA', lease)
+    assert head_item.head(DATASET_FOLDER) == 8
+    assert head_item.head(DATASET_FOLDER, 'setA') == 8
+
+    head_item.reset(DATASET_FOLDER, 3)
+    assert head_item.head(DATASET_FOLDER) == 3
+    assert head_item.head(DATASET_FOLDER, 'setA') == 3
+    # Rollback re-issues revision numbers past the target
+    assert head_item.allocate(DATASET_FOLDER) == 4
+
+
+def test_main_set_head_ignores_other_sets(head_item):
+    # Saved before the main set head was kept: read from the log once
+    crud_annotation.RevisionLogItem.return_value.latest_entry.return_value = {'revision': 5}
+    assert head_item.set_head(DATASET_FOLDER) == 5
+    crud_annotation.RevisionLogItem.return_value.latest_entry.return_value = None
+
+    lease = head_item.acquire(DATASET_FOLDER, 60)
+    main = head_item.allocate(DATASET_FOLDER)
+    head_item.commit(DATASET_FOLDER, main, None, lease)
+    other = head_item.allocate(DATASET_FOLDER)
+    head_item.commit(DATASET_FOLDER, other, 'setA', lease)
+    assert head_item.head(DATASET_FOLDER) == other
+    assert head_item.set_head(DATASET_FOLDER) == main
+    assert head_item.set_head(DATASET_FOLDER, 'setA') == other
+
+    head_item.reset(DATASET_FOLDER, 6)
+    assert head_item.set_head(DATASET_FOLDER) == 6
+    assert head_item.collection.find_one({SET: None})[MAIN_HEAD] == 6
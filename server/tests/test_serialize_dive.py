@@ -0,0 +1,83 @@
+import json
+
+from bson.objectid import ObjectId
+import pytest
+
+from dive_utils import models
+from dive_utils.serializers import dive
+
+STORAGE = {'_id': ObjectId(), 'dataset': ObjectId(), 'rev_created': 3, 'hash': 'abc'}
+
+geometry = {
+    'type': 'FeatureCollection',
+    'features': [
+        {
+            'type': 'Feature',
+            'geometry': {'type': 'Polygon', 'coordinates': [[[1, 2], [3, 4], [5, 6], [1, 2]]]},
+            'properties': {'key': ''},
+        },
+        {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [7, 8]},
+            'properties': {'key': 'head'},
+        },
+    ],
+}
+
+tracks = [
+    {'id': 0, 'begin': 0, 'end': 0, 'features': [{'frame': 0, 'bounds': [1, 2, 3, 4]}]},
+    {
+        'id': 1,
+        'begin': 2,
+        'end': 5,
+        'meta': {'source': 'pipeline'},
+        'confidencePairs': [['fish', 0.9], ['ray', 0.1]],
+        'attributes': {'quality': 'good', 'empty': None},
+        'features': [
+            {
+                'frame': 2,
+                'bounds': [1, 2, 3, 4],
+                'keyframe': True,
+                'interpolate': True,
+                'geometry': geometry,
+                'head': [1.5, 2.5],
+                'tail': [3.5, 4.5],
+                'fishLength': 12.5,
+                'notes': ['first'],
+                'attributes': {'count': 3},
+            },
+            {'frame': 5, 'bounds': [5, 6, 7, 8], 'keyframe': True, 'flick': 1000},
+        ],
+    },
+    {'id': 2, 'begin': 0, 'end': 0, 'meta': None, 'features': []},
+]
+
+groups = [
+    {'id': 0, 'members': {'0': {'ranges': [[0, 5]]}}},
+    {
+        'id': 1,
+        'begin': 0,
+        'end': 9,
+        'confidencePairs': [['school', 1.0]],
+        'attributes': {'size': 2},
+        'members': {'0': {'ranges': [[0, 5]]}, '1': {'ranges': [[3, 9], [12, 14]]}},
+    },
+]
+
+
+def as_json(value):
+    return json.dumps(value)
+
+
+@pytest.mark.parametrize('track', tracks)
+def test_serialize_track_matches_validation(track):
+    stored = {**models.Track(**track).dict(exclude_none=True), **STORAGE}
+    expected = models.Track(**stored).dict(exclude_none=True)
+    assert as_json(dive.serialize_track(stored)) == as_json(expected)
+
+
+@pytest.mark.parametrize('group', groups)
+def test_serialize_group_matches_validation(group):
+    stored = {**models.Group(**group).dict(exclude_none=True), **STORAGE}
+    expected = models.Group(**stored).dict(exclude_none=True)
+    assert as_json(dive.serialize_group(stored)) == as_json(expected)
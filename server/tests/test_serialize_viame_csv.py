@@ -681,3 +681,121 @@ def test_export_csv_omits_track_when_no_pairs_meet_threshold():
     )
 
     assert [line.strip() for line in lines if line.strip()] == []
+
+
+@pytest.mark.parametrize("input,expected,typeFilter", test_tuple)
+def test_write_viame_csv_trusted(
+    input: Dict[str, dict], expected: List[str], typeFilter: List[str]
+):
+    # Stored documents are the validated form of the input
+    stored = [viame.Track(**track).dict(exclude_none=True) for track in input.values()]
+    # Rows come in chunks rather than one at a time
+    text = ''.join(
+        viame.export_tracks_as_csv(
+            stored, filenames=filenames, header=False, typeFilter=set(typeFilter), trusted=True
+        )
+    )
+    for i, line in enumerate(text.split('\r\n')):
+        assert line.strip(' ').rstrip() == expected[i]
+
+
+STORED_TRACKS = [
+    {
+        "id": 3,
+        "begin": 0,
+        "end": 4,
+        "confidencePairs": [["fish, large", 0.4], ['say "cod"', 0.9]],
+        "attributes": {"note": "a,b", "alive": True},
+        "features": [
+            {
+                "frame": 0,
+                "bounds": [0, 0, 10, 10],
+                "interpolate": True,
+                "attributes": {"length": "12", "color": "red"},
+                "notes": ["first, of two", "second"],
+                "geometry": {
+                    "type": "FeatureCollection",
+                    "features": [
+                        {
+                            "type": "Feature",
+                            "properties": {"key": ""},
+                            "geometry": {
+                                "type": "Polygon",
+                                "coordinates": [
+                                    [[0.0, 0.0], [10.4, 0.0], [10.0, 9.6], [0.0, 0.0]],
+                                    [[2.0, 2.0], [3.0, 2.0], [3.0, 3.0], [2.0, 2.0]],
+                                ],
+                            },
+                        },
+                        {
+                            "type": "Feature",
+                            "properties": {"key": "head"},
+                            "geometry": {"type": "Point", "coordinates": [1.2, 3.7]},
+                        },
+                    ],
+                },
+            },
+            {"frame": 4, "bounds": [40, 40, 50, 61], "fishLength": 7.5},
+        ],
+    },
+    {
+        "id": 4,
+        "begin": 2,
+        "end": 2,
+        "confidencePairs": [["ray", 0.2]],
+        "attributes": {},
+        "features": [{"frame": 2, "bounds": [1, 2, 3, 4], "fishLength": float('nan')}],
+    },
+]
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"filenames": ["a.png", "b,c.png", "d.png"]},
+        {"fps": 7.5},
+        {"excludeBelowThreshold": True, "thresholds": {"default": 0.3}},
+        {"typeFilter": {"ray"}},
+    ],
+)
+def test_trusted_export_matches_validated(options):
+    def export(trusted: bool) -> str:
+        return ''.join(
+            viame.export_tracks_as_csv(STORED_TRACKS, header=False, trusted=trusted, **options)
+        )
+
+    assert export(True) == export(False)
+
+
+UNSORTED_ROWS = [
+    "# 1: Detection or Track-id,2: Video or Image Identifier",
+    "# metadata,fps: 5",
+    "2,b.png,3,1,2,3,4,0.9,-1,fish,0.9",
+    "1,a.png,1,1,2,3,4,0.9,-1,fish,0.9,(note) first",
+    "",
+    '3,"c,d.png",3,1,2,3,4,0.9,-1,"say ""cod""",0.9',
+    "1,a.png,0,1,2,3,4,0.9,-1,fish,0.9",
+    "# late comment",
+    "4,e.png,2,1,2,3,4,0.9,-1,ray,0.9",
+]
+
+
+@pytest.mark.parametrize("run_size", [1, 2, 3, 100])
+def test_sort_csv_rows_matches_sort(run_size):
+    reads = []
+
+    def open_rows():
+        reads.append(1)
+        return iter(UNSORTED_ROWS)
+
+    expected = sorted(csv.reader(UNSORTED_ROWS), key=viame.custom_sort)
+    assert list(viame.sort_csv_rows(open_rows, run_size)) == expected
+    assert len(reads) == 2
+
+
+def test_sort_csv_rows_reads_ordered_rows_as_they_are():
+    rows = [row for row in UNSORTED_ROWS if row.startswith('#')]
+    rows += [f"{frame},a.png,{frame},1,2,3,4,0.9,-1,fish,0.9" for frame in range(5)]
+    assert list(viame.sort_csv_rows(lambda: iter(rows), 1)) == list(csv.reader(rows))
+    loaded = viame.load_sorted_csv_as_tracks_and_attributes(viame.sort_csv_rows(lambda: rows))
+    assert loaded == viame.load_csv_as_tracks_and_attributes(rows)
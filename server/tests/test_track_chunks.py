@@ -0,0 +1,125 @@
+from unittest.mock import MagicMock, patch
+
+from fake_mongo import FakeCollection
+import pytest
+
+from dive_server import crud_annotation
+from dive_server.crud_annotation import (
+    CHUNK,
+    CHUNKED,
+    DATASET,
+    HEAD,
+    IDENTIFIER,
+    REVISION_CREATED,
+    REVISION_DELETED,
+    SNAPSHOTS,
+)
+
+DATASET_FOLDER = {'_id': 'dataset-id'}
+SPAN = 10
+
+
+def make_track(frames, x=0):
+    return {
+        IDENTIFIER: 1,
+        'begin': frames[0],
+        'end': frames[-1],
+        'features': [{'frame': f, 'bounds': [x, 0, 10, 10]} for f in frames],
+    }
+
+
+def model_over(cls, collection):
+    model = object.__new__(cls)
+    model.collection = collection
+    model.find = lambda query=None, sort=None, **kwargs: collection.find(query, sort=sort)
+    return model
+
+
+@pytest.fixture
+def chunks():
+    collection = FakeCollection()
+    heads = MagicMock()
+    state = {HEAD: 1, SNAPSHOTS: []}
+    heads.get.return_value = state
+    chunk_model = model_over(crud_annotation.TrackChunkItem, collection)
+    with (
+        patch('dive_server.crud_annotation.RevisionHeadItem', return_value=heads),
+        patch('dive_server.crud_annotation.TrackChunkItem', return_value=chunk_model),
+    ):
+        yield collection, state
+
+
+def save(track, revision):
+    header, chunks = crud_annotation.split_track(track, SPAN)
+    chunked = {header[IDENTIFIER]: chunks} if chunks else {}
+    unchunked = [] if chunks else [header[IDENTIFIER]]
+    crud_annotation._update_chunks('dataset-id', revision, chunked, unchunked)
+    return header
+
+
+def read(track_header, revision, state, frame_window=None):
+    state[HEAD] = revision
+    track_model = object.__new__(crud_annotation.TrackItem)
+    return next(
+        track_model.decode([dict(track_header)], DATASET_FOLDER, revision, None, frame_window)
+    )
+
+
+def test_split_track():
+    header, chunks = crud_annotation.split_track(make_track(list(range(5, 35))), SPAN)
+    assert header[CHUNKED] and 'features' not in header
+    assert [(c[CHUNK], c['begin'], c['end'], len(c['features'])) for c in chunks] == [
+        (0, 5, 9, 5),
+        (1, 10, 19, 10),
+        (2, 20, 29, 10),
+        (3, 30, 34, 5),
+    ]
+    short = make_track(list(range(SPAN)))
+    assert crud_annotation.split_track(short, SPAN) == (short, [])
+    assert crud_annotation.split_track(short, 0) == (short, [])
+
+
+def test_edit_rewrites_only_changed_chunks(chunks):
+    collection, state = chunks
+    track = make_track(list(range(30)))
+    header = save(track, 1)
+    assert len(collection.docs) == 3
+
+    # Move the box on frames 12 and 13 only
+    for feature in track['features'][12:14]:
+        feature['bounds'] = [5, 5, 10, 10]
+    save(track, 2)
+    rewritten = [doc[CHUNK] for doc in collection.docs if doc[REVISION_CREATED] == 2]
+    expired = [doc[CHUNK] for doc in collection.docs if doc.get(REVISION_DELETED) == 2]
+    assert rewritten == expired == [1]
+
+    # Both revisions stay readable in full
+    assert read(header, 1, state)['features'] == make_track(list(range(30)))['features']
+    assert read(header, 2, state)['features'] == track['features']
+
+    # Frame-window reads only load overlapping chunks
+    window = crud_annotation.TrackItem.frame_window(21, 25)
+    assert [f['frame'] for f in read(header, 2, state, window)['features']] == list(range(20, 30))
+
+
+def test_deleted_or_shortened_tracks_expire_chunks(chunks):
+    collection, _state = chunks
+    save(make_track(list(range(30))), 1)
+    save(make_track(list(range(5))), 2)
+    assert all(doc.get(REVISION_DELETED) == 2 for doc in collection.docs)
+    save(make_track(list(range(30))), 3)
+    crud_annotation._update_chunks('dataset-id', 4, {}, [1])
+    live = [doc for doc in collection.docs if REVISION_DELETED not in doc]
+    assert live == []
+    assert all(doc[DATASET] == 'dataset-id' for doc in collection.docs)
+
+
+def test_main_set_saves_keep_chunks_of_other_sets(chunks):
+    collection, _state = chunks
+    _header, track_chunks = crud_annotation.split_track(make_track(list(range(30))), SPAN)
+    crud_annotation._update_chunks('dataset-id', 1, {1: track_chunks}, [], set='alt')
+    save(make_track(list(range(30))), 2)
+    crud_annotation._update_chunks('dataset-id', 3, {}, [1])
+    alt = [doc for doc in collection.docs if doc.get('set') == 'alt']
+    assert len(alt) == 3
+    assert not any(REVISION_DELETED in doc for doc in alt)
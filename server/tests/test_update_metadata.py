@@ -8,6 +8,7 @@ from dive_server import crud, crud_dataset
 from dive_server.crud_rpc import _get_data_by_type, process_items, resolve_imported_dataset_info
 from dive_server.views_dataset import DatasetResource
 from dive_utils import constants, models
+from dive_utils.serializers import kwcoco, viame
 
 
 def _stub_folder_load_and_save(folder_cls, folder):
@@ -1075,3 +1076,55 @@ def test_get_multicam_camera_name_returns_matching_camera():
     assert crud.get_multicam_camera_name({'_id': 'left-id'}, parent) == 'left'
     assert crud.get_multicam_camera_name({'_id': 'right-id'}, parent) == 'right'
     assert crud.get_multicam_camera_name({'_id': 'other-id'}, parent) is None
+
+
+@patch('dive_server.crud_rpc.File')
+def test_get_data_by_type_reads_csv_in_chunks(file_cls):
+    text = (
+        '# metadata,fps: 5\r\n'
+        '1,å.png,1,1,2,3,4,0.9,-1,fish,0.9,(note) naïve\r\n'
+        '0,b.png,0,1,2,3,4,0.8,-1,ray,0.8\r\n'
+        '1,c.png,2,1,2,3,4,0.9,-1,fish,0.9'
+    )
+    data = text.encode()
+    # Chunk boundaries inside line breaks and multibyte characters
+    chunks = [data[i : i + 3] for i in range(0, len(data), 3)]
+    file_cls.return_value.download.return_value = lambda: iter(chunks)
+
+    imported, warnings = _get_data_by_type({'_id': 'file-id', 'name': 'a.csv', 'exts': ['csv']})
+
+    converted, attributes, expected_warnings, fps, _ = viame.load_csv_as_tracks_and_attributes(
+        text.splitlines()
+    )
+    assert imported['annotations'] == converted
+    assert imported['attributes'] == attributes
+    assert imported['meta'] == {'fps': fps}
+    assert warnings == expected_warnings
+
+
+@patch('dive_server.crud_rpc.File')
+def test_get_data_by_type_reads_coco_in_chunks(file_cls):
+    coco = {
+        'info': {'dive_dataset_info': {'site': 'å'}},
+        'videos': [{'id': 1, 'name': 'v', 'annotation_fps': 5}],
+        'images': [{'id': 1, 'file_name': 'b.png'}, {'id': 2, 'file_name': 'a.png'}],
+        'annotations': [
+            {'id': 1, 'image_id': 1, 'category_id': 1, 'bbox': [1, 2, 3, 4], 'track_id': 0},
+            {'id': 2, 'image_id': 2, 'category_id': 2, 'bbox': [1, 2, 3, 4], 'track_id': 0},
+        ],
+        'categories': [{'id': 1, 'name': 'fish'}, {'id': 2, 'name': 'ray', 'supercategory': 'x'}],
+    }
+    data = json.dumps(coco, ensure_ascii=False).encode()
+    # Chunk boundaries inside values and multibyte characters
+    chunks = [data[i : i + 3] for i in range(0, len(data), 3)]
+    file_cls.return_value.download.return_value = lambda: iter(chunks)
+
+    imported, warnings = _get_data_by_type({'_id': 'file-id', 'name': 'a.json', 'exts': ['json']})
+
+    converted, attributes, _, datasetInfo = kwcoco.load_coco_as_tracks_and_attributes(coco)
+    assert imported['type'] == crud.FileType.COCO_JSON
+    assert imported['annotations'] == converted
+    assert imported['attributes'] == attributes
+    assert imported['meta'] == {'datasetInfo': datasetInfo, 'fps': 5.0}
+    assert imported['hierarchy'] == {'ray': 'x'}
+    assert warnings is None